@@ -1,18 +1,17 @@
 import numpy as np
 import time
-import threading
 import logging
 import sys
 import shutil
 import os
-import subprocess
 import platform
 from ruamel.yaml import YAML
 from pathlib import Path
 from psutil import virtual_memory
 from gputools import get_device
 from voxel.instruments.instrument import Instrument
-from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+from voxel.benchmarks.write_speed import benchmark_write_speed, mount_point
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
 import inflection
 import inspect
 import re
@@ -36,6 +35,8 @@ class Acquisition:
         # TODO: Validation of config should check that metadata exists and only one
         self.metadata = self._construct_class(self.config['acquisition']['metadata'])
         self.acquisition_name = None    # initialize acquisition_name that will be populated at start of acquisition
+        # compression ratios estimated by _check_compression_ratio, keyed by camera configuration and codec
+        self._compression_ratios = dict()
 
         # initialize operations
         for operation_type, operation_dict in self.config['acquisition']['operations'].items():
@@ -116,13 +117,58 @@ class Acquisition:
         return acquisition_rate_hz
 
     def run(self):
-        """Run function. This method must be overwritten for each specific microscope"""
+        """Run function. This method must be overwritten for each specific microscope.
+        Stacks are streamed to the writers by creating their buffers with _create_chunk_buffer
+        and grabbing with _acquire_chunks"""
 
         self.acquisition_name = self.metadata.acquisition_name
         self._set_acquisition_name()
         self._verify_acquisition()
         self._create_directories()
 
+    def _create_chunk_buffer(self, camera_id: str, writer_id: str):
+        """Create the ring buffer chunks of a camera are handed to a writer through, with the
+        writer's slot_count chunk slots, and prepare the writer to read from it
+        :param camera_id: camera the chunks come from
+        :param writer_id: writer reading the chunks
+        :return: ring buffer, the caller closes it with close_and_unlink once the writer finished"""
+        writer = self.writers[camera_id][writer_id]
+        buffer = SharedRingBuffer((writer.chunk_count_px, writer.row_count_px, writer.column_count_px),
+                                  writer.data_type, slot_count=writer.slot_count)
+        writer.prepare(buffer)
+        return buffer
+
+    def _acquire_chunks(self, camera_id: str, buffers: dict, timeout_s: float = None):
+        """Grab the frames of one stack from a started camera chunk by chunk into the ring buffers of
+        its writers. Each chunk is grabbed into the write slot of the first buffer, copied into the
+        others and committed to every writer, the camera only waits on a writer once all of its
+        slots are waiting to be written
+        :param camera_id: camera to grab from
+        :param buffers: ring buffers keyed by writer id, from _create_chunk_buffer
+        :param timeout_s: maximum time to wait for a writer to free a slot, None waits forever
+        :raises ValueError: writers of the camera use different chunk sizes or frame counts
+        :raises RuntimeError: camera stopped delivering frames
+        :raises TimeoutError: a writer did not free a slot in time"""
+        camera = self.instrument.cameras[camera_id]
+        writers = [self.writers[camera_id][writer_id] for writer_id in buffers]
+        chunk_count_px = writers[0].chunk_count_px
+        frame_count_px = writers[0].frame_count_px
+        if any(writer.chunk_count_px != chunk_count_px or writer.frame_count_px != frame_count_px
+               for writer in writers):
+            raise ValueError(f'writers of camera {camera_id} must use the same chunk size and frame count')
+        first_buffer, *other_buffers = buffers.values()
+        for chunk_index, start_frame in enumerate(range(0, frame_count_px, chunk_count_px)):
+            count = min(chunk_count_px, frame_count_px - start_frame)
+            frames = camera.grab_frames(first_buffer.write_buf, count)
+            if len(frames) < count:
+                raise RuntimeError(f'camera {camera_id} delivered {start_frame + len(frames)}/{frame_count_px} frames')
+            for buffer in other_buffers:
+                buffer.write_buf[:count] = frames
+            # blocks only while every slot of a writer is still waiting to be written
+            for buffer in buffers.values():
+                buffer.toggle_buffers(timeout=timeout_s)
+            self.log.debug(f'camera {camera_id} chunk {chunk_index} handed to writers')
+
     def _create_directories(self):
         """Using the latest metadata derived acquisition_name, correctly set writers and transfer and create
         directories if needed"""
@@ -197,78 +243,48 @@ class Acquisition:
             pyramid_factor += (1 / (2 ** level)) ** 3
         return pyramid_factor
 
-    def _check_compression_ratio(self, camera_id: str, writer_id: str):
-        self.log.info(f'estimating acquisition compression ratio')
-        # get the correct camera and writer
+    def _grab_sample_frames(self, camera_id: str, writer_id: str):
+        """Grab one chunk of free running frames into memory
+        :param camera_id: camera to grab from
+        :param writer_id: writer setting the chunk size and data type"""
         camera = self.instrument.cameras[camera_id]
         writer = self.writers[camera_id][writer_id]
-        if writer.compression != 'none':
-            # store initial trigger mode
-            initial_trigger = camera.trigger
-            # turn trigger off
-            new_trigger = initial_trigger
-            new_trigger['mode'] = 'off'
-            camera.trigger = new_trigger
-
-            # prepare the writer
-            writer.row_count_px = camera.height_px
-            writer.column_count_px = camera.width_px
-            writer.frame_count_px = writer.chunk_count_px
-            writer.filename = 'compression_ratio_test'
-
-            chunk_size = writer.chunk_count_px
-            chunk_lock = threading.Lock()
-            img_buffer = SharedDoubleBuffer((chunk_size, camera.height_px, camera.width_px),
-                                            dtype=writer.data_type)
-
-            # set up and start writer and camera
-            writer.prepare()
+        # store initial trigger mode and turn trigger off
+        initial_trigger = camera.trigger
+        camera.trigger = {**initial_trigger, 'mode': 'off'}
+        frames = np.empty((writer.chunk_count_px, camera.height_px, camera.width_px), dtype=writer.data_type)
+        try:
             camera.prepare()
-            writer.start()
             camera.start()
-
-            frame_index = 0
-            for frame_index in range(writer.chunk_count_px):
-                # grab camera frame
-
-                current_frame = camera.grab_frame()
-                # put into image buffer
-                img_buffer.write_buf[frame_index] = current_frame
-                frame_index += 1
-
-            while not writer.done_reading.is_set():
-                time.sleep(0.001)
-
-            with chunk_lock:
-                img_buffer.toggle_buffers()
-                if writer.path is not None:
-                    writer.shm_name = \
-                        img_buffer.read_buf_mem_name
-                    writer.done_reading.clear()
-
-                    # close writer and camera
-            writer.wait_to_finish()
+            camera.grab_frames(frames, writer.chunk_count_px)
             camera.stop()
-
+        finally:
             # reset the trigger
             camera.trigger = initial_trigger
+        return frames
 
-            # clean up the image buffer
-            img_buffer.close_and_unlink()
-            del img_buffer
-
-            # check the compressed file size
-            filepath = str((writer.path / Path(f"{writer.filename}")).absolute())
-            compressed_file_size_mb = os.stat(filepath).st_size / (1024 ** 2)
-            # calculate the raw file size
-            frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-            # get pyramid factor
-            pyramid_factor = self._pyramid_factor(levels=3)
-            raw_file_size_mb = frame_size_mb * writer.frame_count_px * pyramid_factor
-            # calculate the compression ratio
-            compression_ratio = raw_file_size_mb / compressed_file_size_mb
-            # delete the files
-            writer.delete_files()
+    def _check_compression_ratio(self, camera_id: str, writer_id: str):
+        """Estimate the compression ratio of a camera and writer pair by compressing one chunk of
+        frames in memory with the writer's codec, including its pyramid levels. Results are
+        cached by camera configuration and codec.
+        :param camera_id: camera to estimate with
+        :param writer_id: writer to estimate with"""
+        self.log.info(f'estimating acquisition compression ratio')
+        # get the correct camera and writer
+        camera = self.instrument.cameras[camera_id]
+        writer = self.writers[camera_id][writer_id]
+        if writer.compression != 'none':
+            key = (camera_id, camera.width_px, camera.height_px, camera.binning, camera.pixel_type,
+                   camera.exposure_time_ms, writer.data_type, type(writer).__name__, writer.compression)
+            if key not in self._compression_ratios:
+                frames = self._grab_sample_frames(camera_id, writer_id)
+                try:
+                    self._compression_ratios[key] = writer.estimate_compression_ratio(frames)
+                except ImportError as e:
+                    # assume no compression, the conservative choice for speed and space checks
+                    self.log.warning(f'cannot estimate compression for writer: {writer_id}, assuming none: {e}')
+                    self._compression_ratios[key] = 1.0
+            compression_ratio = self._compression_ratios[key]
         else:
             compression_ratio = 1.0
         self.log.info(f'compression ratio for camera: {camera_id} writer: {writer_id} ~ {compression_ratio:.1f}')
@@ -406,29 +422,23 @@ class Acquisition:
         else:
             raise ValueError(f'no transfers configured. check yaml files.')
 
-    def check_write_speed(self, size='16Gb', bs='1M', direct=1, numjobs=1,
-                          iodepth=1, runtime=0):
-        """Check local read/write speeds to make sure it can keep up with acquisition
-
-        :param size: Size of test file
-        :param bs: Block size in bytes used for I/O units
-        :param direct: Specifying buffered (0) or unbuffered (1) operation
-        :param numjobs: Number of clones of this job. Each clone of job is spawned as an independent thread or process
-        :param ioengine: Defines how the job issues I/O to the file
-        :param iodepth: Number of I/O units to keep in flight against the file.
-        :param runtime: Limit runtime. The test will run until it completes the configured I/O workload or until it has
-                        run for this specified amount of time, whichever occurs first
+    def check_write_speed(self, size_gb: float = 16, runtime_s: float = 30, direct_io: bool = True):
+        """Check write speeds of the local and external directories to make sure they can keep up with
+        acquisition. Directories are grouped by mount point and every mount point is tested with one
+        concurrent stream per camera writing or transferring to it, using the writer chunk size and
+        io depth.
+
+        :param size_gb: Size written per stream in GB
+        :param runtime_s: Stop each stream after this time in seconds, the sustained speed is measured
+                          over the second half of the written data
+        :param direct_io: Write with O_DIRECT where supported, bypassing the page cache
+        :raises ValueError: Sustained write speed of a mount point is below the camera data rate
+        :raises OSError: A directory could not be written to
         """
         self.log.info(f"checking write speed to local and external directories")
-        # windows ioengine
-        if platform.system() == 'Windows':
-            ioengine = 'windowsaio'
-        # unix ioengine
-        else:
-            ioengine = 'posixaio'
 
-        drives = dict()
-        camera_speed_mb_s = dict()
+        # mount point -> stream settings of every camera writing there
+        streams = dict()
 
         # loop over cameras and see where they are acquiring data
         for camera_id, camera in self.instrument.cameras.items():
@@ -438,67 +448,41 @@ class Acquisition:
                 # grab the frame size and acquisition rate
                 frame_size_mb = self._frame_size_mb(camera_id, writer_id)
                 acquisition_rate_hz = self._acquisition_rate_hz
-                local_path = writer.path
-                # strip drive letters from paths so that we can combine
-                # cameras acquiring to the same drives
-                if platform.system() == 'Windows':
-                    local_drive_letter = os.path.splitdrive(local_path)[0]
-                # if unix
-                else:
-                    # TODO FIX THIS -> what is syntax for unix drives?
-                    local_abs_path = os.path.abspath(local_path)
-                    local_drive_letter = '/'
-                # add into drives dictionary append to list if same drive letter
-                drives.setdefault(local_drive_letter, []).append(local_path)
-                camera_speed_mb_s.setdefault(local_drive_letter, []).append(
-                    acquisition_rate_hz * frame_size_mb / compression_ratio)
+                stream = {
+                    'speed_mb_s': acquisition_rate_hz * frame_size_mb / compression_ratio,
+                    'block_nbytes': int(writer.chunk_count_px * frame_size_mb * 1024 ** 2 / compression_ratio),
+                    'io_depth': writer.io_depth,
+                }
+                # group streams by the filesystem they write to, directories on one disk share its bandwidth
+                streams.setdefault(mount_point(writer.path), []).append({**stream, 'path': writer.path})
                 if self.transfers:
                     for transfer_id, transfer in self.transfers[camera_id].items():
                         external_path = transfer.external_path
-                        # strip drive letters from paths so that we can combine
-                        # cameras acquiring to the same drives
-                        if platform.system() == 'Windows':
-                            external_drive_letter = os.path.splitdrive(local_path)[0]
-                        # if unix
-                        else:
-                            # TODO FIX THIS -> what is syntax for unix drives?
-                            external_abs_path = os.path.abspath(local_path)
-                            external_drive_letter = '/'
-                        # add into drives dictionary append to list if same drive letter
-                        drives.setdefault(external_drive_letter, []).append(external_path)
-                        camera_speed_mb_s.setdefault(external_drive_letter, []).append(
-                            acquisition_rate_hz * frame_size_mb)
+                        streams.setdefault(mount_point(external_path), []).append(
+                            {**stream, 'path': external_path, 'io_depth': 1})
 
-        for drive in drives:
+        for drive, drive_streams in streams.items():
             # if more than one stream on this drive, just test the first directory location
-            local_path = drives[drive][0]
-            test_filename = Path(f'{local_path}/iotest')
-            f = open(test_filename, 'a')  # Create empty file to check reading/writing speed
-            f.close()
-            try:
-                output = subprocess.check_output(
-                    fr'fio --name=test --filename={test_filename} --size={size} --rw=write --bs={bs} '
-                    fr'--direct={direct} --numjobs={numjobs} --ioengine={ioengine} --iodepth={iodepth} '
-                    fr'--runtime={runtime} --startdelay=0 --thread --group_reporting', shell=True)
-                out = str(output)
-                # Converting MiB to MB = (10**6/2**20)
-                write_speed_mb_s = round(
-                    float(out[out.find('BW=') + len('BW='):out.find('MiB/s')]) / (10 ** 6 / 2 ** 20))
-
-                total_speed_mb_s = sum(camera_speed_mb_s[drive])
-                # check if drive write speed exceeds the sum of all cameras streaming to this drive
-                if write_speed_mb_s < total_speed_mb_s:
-                    self.log.warning(f'write speed too slow on drive {drive}')
-                    raise ValueError(f'write speed too slow on drive {drive}')
-
-                self.log.info(f'available write speed = {write_speed_mb_s:.1f} [MB/sec] to directory {drive}')
-                self.log.info(f'required write speed = {total_speed_mb_s:.1f} [MB/sec] to directory {drive}')
-
-            except subprocess.CalledProcessError:
-                self.log.warning('fios not installed on computer. Cannot verify read/write speed')
-            finally:
-                # Delete test file
-                os.remove(test_filename)
+            result = benchmark_write_speed(
+                drive_streams[0]['path'],
+                block_nbytes=max(stream['block_nbytes'] for stream in drive_streams),
+                io_depth=max(stream['io_depth'] for stream in drive_streams),
+                stream_count=len(drive_streams),
+                total_nbytes=int(size_gb * 1024 ** 3),
+                runtime_s=runtime_s,
+                direct_io=direct_io,
+            )
+            total_speed_mb_s = sum(stream['speed_mb_s'] for stream in drive_streams)
+            self.log.info(f'burst write speed = {result["burst_mb_s"]:.1f} [MB/sec] to directory {drive}')
+            self.log.info(f'available write speed = {result["sustained_mb_s"]:.1f} [MB/sec] to directory {drive}')
+            self.log.info(f'required write speed = {total_speed_mb_s:.1f} [MB/sec] to directory {drive}')
+            # check if sustained drive write speed exceeds the sum of all cameras streaming to this drive
+            if result['sustained_mb_s'] < total_speed_mb_s:
+                if result['burst_mb_s'] >= total_speed_mb_s:
+                    self.log.warning(f'only burst write speed keeps up on drive {drive}, '
+                                     f'write speed drops once its cache is full')
+                self.log.warning(f'write speed too slow on drive {drive}')
+                raise ValueError(f'write speed too slow on drive {drive}')
 
     def check_system_memory(self):
         """Make sure this machine can image under the specified configuration.
@@ -509,14 +493,14 @@ class Acquisition:
         :raises MemoryError:
         """
         self.log.info(f"checking available system memory")
-        # Calculate double buffer size for all channels.
+        # Calculate ring buffer size for all channels.
         memory_gb = 0
         for camera_id, camera in self.instrument.cameras.items():
             for writer_id, writer in self.writers[camera_id].items():
                 chunk_count_px = writer.chunk_count_px
-                # factor of 2 for concurrent chunks being written/read
+                # one chunk per ring buffer slot, filled by the camera or waiting to be written
                 frame_size_mb = self._frame_size_mb(camera_id, writer_id)
-                memory_gb += 2 * chunk_count_px * frame_size_mb / 1024
+                memory_gb += writer.slot_count * chunk_count_px * frame_size_mb / 1024
 
         free_memory_gb = virtual_memory()[1] / 1024 ** 3
 
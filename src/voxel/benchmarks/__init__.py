@@ -0,0 +1,31 @@
+"""
+Available benchmarks:
+- voxel.benchmarks.chunk_handoff
+    - benchmark_chunk_handoff
+- voxel.benchmarks.pipeline
+    - benchmark_pipeline
+    - run_benchmarks
+- voxel.benchmarks.write_speed
+    - benchmark_write_speed
+    - mount_point
+"""
+
+import importlib
+
+# benchmark -> module, imported on first use so that importing one benchmark,
+# e.g. write_speed from an acquisition, does not import the writers and cameras
+_BENCHMARKS = {
+    "benchmark_chunk_handoff": "chunk_handoff",
+    "benchmark_pipeline": "pipeline",
+    "run_benchmarks": "pipeline",
+    "benchmark_write_speed": "write_speed",
+    "mount_point": "write_speed",
+}
+
+__all__ = list(_BENCHMARKS.keys())
+
+
+def __getattr__(name: str):
+    if name not in _BENCHMARKS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_BENCHMARKS[name]}", __name__), name)
@@ -0,0 +1,120 @@
+import argparse
+import json
+import mmap
+from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+
+import numpy as np
+
+from voxel.writers.data_structures.shared_double_buffer import SharedDoubleBuffer
+
+
+def _consumer(shape: tuple, dtype: str, nbytes: int, persistent: bool, chunk_queue: Queue, done_queue: Queue):
+    """
+    Writer-like consumer that attaches to each handed off chunk and touches\n
+    every page of it, mimicking a writer reading the chunk out.
+
+    :param shape: Chunk shape
+    :type shape: tuple
+    :param dtype: Chunk data type
+    :type dtype: str
+    :param nbytes: Chunk size in bytes
+    :type nbytes: int
+    :param persistent: Attach to each shared memory block once instead of per chunk
+    :type persistent: bool
+    :param chunk_queue: Queue carrying (shm_name, handoff timestamp)
+    :type chunk_queue: multiprocessing.Queue
+    :param done_queue: Queue carrying the handoff latency of each chunk
+    :type done_queue: multiprocessing.Queue
+    """
+
+    page_stride = max(1, mmap.PAGESIZE // np.dtype(dtype).itemsize)
+    blocks = dict()
+    frames_by_name = dict()
+    while True:
+        item = chunk_queue.get()
+        if item is None:
+            break
+        shm_name, handoff_time = item
+        if persistent:
+            if shm_name not in frames_by_name:
+                blocks[shm_name] = SharedMemory(shm_name, create=False, size=nbytes)
+                frames_by_name[shm_name] = np.ndarray(shape, dtype, buffer=blocks[shm_name].buf)
+            frames = frames_by_name[shm_name]
+            frames.reshape(-1)[::page_stride].sum()
+            latency_s = perf_counter() - handoff_time
+            frames = None
+        else:
+            shm = SharedMemory(shm_name, create=False, size=nbytes)
+            frames = np.ndarray(shape, dtype, buffer=shm.buf)
+            frames.reshape(-1)[::page_stride].sum()
+            frames = None
+            shm.close()
+            latency_s = perf_counter() - handoff_time
+        done_queue.put(latency_s)
+    frames_by_name.clear()
+    for shm in blocks.values():
+        shm.close()
+
+
+def benchmark_chunk_handoff(
+    shape: tuple = (64, 2048, 2048), dtype: str = "uint16", chunk_count: int = 100, persistent: bool = True
+) -> dict:
+    """
+    Measure the latency from handing a chunk off to a consumer process until\n
+    the consumer has attached to it and touched every page.
+
+    :param shape: Chunk shape
+    :type shape: tuple
+    :param dtype: Chunk data type
+    :type dtype: str
+    :param chunk_count: Number of chunks to hand off
+    :type chunk_count: int
+    :param persistent: Attach to each shared memory block once instead of per chunk
+    :type persistent: bool
+    :return: Latency statistics in milliseconds
+    :rtype: dict
+    """
+
+    img_buffer = SharedDoubleBuffer(shape, dtype)
+    chunk_queue = Queue()
+    done_queue = Queue()
+    consumer = Process(
+        target=_consumer, args=(shape, dtype, img_buffer.nbytes, persistent, chunk_queue, done_queue)
+    )
+    consumer.start()
+    latencies_ms = list()
+    try:
+        for _ in range(chunk_count):
+            img_buffer.toggle_buffers()
+            chunk_queue.put((img_buffer.read_buf_mem_name, perf_counter()))
+            latencies_ms.append(done_queue.get() * 1000)
+        chunk_queue.put(None)
+        consumer.join()
+    finally:
+        img_buffer.close_and_unlink()
+    latencies_ms = np.asarray(latencies_ms)
+    return {
+        "persistent": persistent,
+        "shape": list(shape),
+        "dtype": dtype,
+        "chunk_count": chunk_count,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="chunk handoff latency, per-chunk vs persistent attachment")
+    parser.add_argument("--shape", type=int, nargs=3, default=(64, 2048, 2048))
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--chunk-count", type=int, default=100)
+    args = parser.parse_args()
+    results = [
+        benchmark_chunk_handoff(tuple(args.shape), args.dtype, args.chunk_count, persistent=persistent)
+        for persistent in (False, True)
+    ]
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,342 @@
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from time import monotonic, perf_counter
+
+import numpy as np
+
+import voxel
+from voxel.devices.camera.simulated import Camera
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+# writer name -> (module, class), writers that fail to import are reported as unavailable
+WRITERS = {
+    "tiff": ("voxel.writers.tiff", "TiffWriter"),
+    "bdv": ("voxel.writers.bdv", "BDVWriter"),
+    "imaris": ("voxel.writers.imaris", "ImarisWriter"),
+    "zarr": ("voxel.writers.zarr", "ZarrWriter"),
+    "raw": ("voxel.writers.raw", "RawWriter"),
+}
+# latency percentiles reported per run
+LATENCY_PERCENTILES = (50, 90, 99)
+# interval to check that the writer process is still alive while waiting on a free slot
+POLL_INTERVAL_S = 0.5
+
+
+def _peak_rss_mb() -> dict:
+    """
+    Peak resident memory of this process and of its joined child processes.
+
+    :return: Peak resident memory in MB, None where the platform does not report it
+    :rtype: dict
+    """
+
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+
+            return {"pipeline": psutil.Process().memory_info().peak_wset / 1024**2, "writer": None}
+        except (ImportError, AttributeError):
+            return {"pipeline": None, "writer": None}
+    # ru_maxrss is in bytes on macos and in kilobytes elsewhere
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return {
+        "pipeline": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "writer": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def _commit(writer, buffer: SharedRingBuffer) -> float:
+    """
+    Commit the filled write slot to the writer, waiting for a free slot.
+
+    :param writer: Writer reading the ring buffer
+    :type writer: BaseWriter
+    :param buffer: Ring buffer the writer was prepared with
+    :type buffer: SharedRingBuffer
+    :raise RuntimeError: The writer process exited before freeing a slot
+    :return: Time spent waiting for a free slot
+    :rtype: float
+    """
+
+    start_s = perf_counter()
+    while True:
+        try:
+            buffer.toggle_buffers(timeout=POLL_INTERVAL_S)
+            return perf_counter() - start_s
+        except TimeoutError:
+            if not writer._process.is_alive():
+                raise RuntimeError(f"writer process exited with code {writer._process.exitcode}")
+
+
+def benchmark_pipeline(
+    writer_name: str,
+    path: str,
+    frame_shape: tuple = (2048, 2048),
+    chunk_count: int = 4,
+    compression: str = "none",
+    dtype: str = "uint16",
+    exposure_time_ms: float = 0.001,
+    keep_files: bool = False,
+) -> dict:
+    """
+    Stream frames from the simulated camera through a ring buffer into a writer.
+
+    The camera runs freely at its frame time and fills one slot of the\n
+    writer's slot_count slots while the writer reads the others, as in an\n
+    acquisition. Frames the camera produces while the pipeline waits for a\n
+    free slot are dropped. Chunk latency runs from committing a chunk until\n
+    the writer recorded it as written.
+
+    :param writer_name: Writer, one of WRITERS
+    :type writer_name: str
+    :param path: Directory the writer writes to
+    :type path: str
+    :param frame_shape: Frame shape (rows, columns), rounded by the camera
+    :type frame_shape: tuple
+    :param chunk_count: Number of chunks in the stack
+    :type chunk_count: int
+    :param compression: Writer compression
+    :type compression: str
+    :param dtype: Frame data type
+    :type dtype: str
+    :param exposure_time_ms: Camera exposure time, the frame time adds the readout time
+    :type exposure_time_ms: float
+    :param keep_files: Keep the written files
+    :type keep_files: bool
+    :raise ValueError: Unknown writer
+    :return: Throughput, latency, dropped frame and memory statistics
+    :rtype: dict
+    """
+
+    if writer_name not in WRITERS:
+        raise ValueError("writer must be one of %r." % list(WRITERS.keys()))
+    module, class_name = WRITERS[writer_name]
+    writer = getattr(importlib.import_module(module), class_name)(path)
+    rows, columns = frame_shape
+
+    camera = Camera("benchmark")
+    camera.width_px = columns
+    camera.height_px = rows
+    # the camera rounds the size to its step, everything downstream uses the size it delivers
+    rows, columns = camera.height_px, camera.width_px
+    camera.pixel_type = "mono8" if np.dtype(dtype).itemsize == 1 else "mono16"
+    camera.exposure_time_ms = exposure_time_ms
+    camera.trigger = {"mode": "off", "source": "internal", "polarity": "rising"}
+
+    acquisition_name = f"benchmark_{writer_name}"
+    Path(path, acquisition_name).mkdir(parents=True, exist_ok=True)
+    writer.acquisition_name = acquisition_name
+    writer.filename = f"{writer_name}_{compression}_{rows}x{columns}_{chunk_count}"
+    writer.compression = compression
+    writer.data_type = dtype
+    writer.row_count_px = rows
+    writer.column_count_px = columns
+    writer.frame_count_px = chunk_count * writer.chunk_count_px
+    writer.x_voxel_size_um = writer.y_voxel_size_um = writer.z_voxel_size_um = 1.0
+    writer.x_position_mm = writer.y_position_mm = writer.z_position_mm = 0.0
+    writer.theta_deg = 0.0
+    writer.channel = "0"
+
+    img_buffer = SharedRingBuffer((writer.chunk_count_px, rows, columns), dtype, slot_count=writer.slot_count)
+    # commit time of every chunk, on the monotonic clock of the writer metrics
+    commit_times_s = list()
+    producer_wait_s = 0.0
+    try:
+        writer.prepare(img_buffer)
+        camera.prepare()
+        writer.start()
+        camera.start()
+        start_s = perf_counter()
+        for _ in range(chunk_count):
+            camera.grab_frames(img_buffer.write_buf)
+            # blocks only while every other slot is still waiting to be written
+            producer_wait_s += _commit(writer, img_buffer)
+            commit_times_s.append(monotonic())
+        writer.wait_to_finish()
+        elapsed_s = perf_counter() - start_s
+        state = camera.signal_acquisition_state()
+        camera.stop()
+        if not keep_files:
+            writer.delete_files()
+    except Exception:
+        writer.abort()
+        camera.abort()
+        if writer._process is not None and writer._process.is_alive():
+            writer._process.join(POLL_INTERVAL_S)
+            if writer._process.is_alive():
+                writer._process.terminate()
+        raise
+    finally:
+        img_buffer.close_and_unlink()
+
+    frame_mb = rows * columns * np.dtype(dtype).itemsize / 1024**2
+    data_mb = frame_mb * writer.frame_count_px
+    records = writer.metrics.records()
+    latencies_ms = (records["end_time_s"] - np.asarray(commit_times_s)[records["chunk_index"].astype(int)]) * 1000
+    result = {
+        "writer": writer_name,
+        "compression": compression,
+        "frame_shape": [rows, columns],
+        "requested_frame_shape": list(frame_shape),
+        "dtype": dtype,
+        "chunk_count": chunk_count,
+        "chunk_frame_count": writer.chunk_count_px,
+        "slot_count": writer.slot_count,
+        "data_mb": data_mb,
+        "elapsed_s": elapsed_s,
+        "throughput_mb_s": data_mb / elapsed_s,
+        "camera_mb_s": frame_mb * 1000 / camera.frame_time_ms,
+        "dropped_frames": int(state["Dropped Frames"]),
+        "producer_wait_s": producer_wait_s,
+        "chunk_latency_mean_ms": float(latencies_ms.mean()),
+        "chunk_latency_max_ms": float(latencies_ms.max()),
+        "peak_rss_mb": _peak_rss_mb(),
+        "writer_metrics": writer.metrics.summary(window_s=elapsed_s),
+    }
+    for percentile in LATENCY_PERCENTILES:
+        result[f"chunk_latency_p{percentile}_ms"] = float(np.percentile(latencies_ms, percentile))
+    return result
+
+
+def _run_isolated(kwargs: dict, results: multiprocessing.Queue):
+    """
+    Run one benchmark and report the result or the error.
+
+    :param kwargs: Arguments of benchmark_pipeline
+    :type kwargs: dict
+    :param results: Queue receiving the result
+    :type results: multiprocessing.Queue
+    """
+
+    try:
+        results.put(benchmark_pipeline(**kwargs))
+    except Exception as e:
+        results.put(
+            {
+                "writer": kwargs["writer_name"],
+                "compression": kwargs["compression"],
+                "frame_shape": list(kwargs["frame_shape"]),
+                "chunk_count": kwargs["chunk_count"],
+                "error": f"{type(e).__name__}: {e}",
+            }
+        )
+
+
+def run_benchmarks(
+    path: str,
+    writers: tuple = ("tiff", "bdv", "imaris"),
+    frame_shapes: tuple = ((2048, 2048),),
+    chunk_counts: tuple = (4,),
+    compressions: tuple = ("none",),
+    dtype: str = "uint16",
+    exposure_time_ms: float = 0.001,
+) -> dict:
+    """
+    Benchmark every combination of writer, frame shape, chunk count and compression.
+
+    Each run starts in a fresh process, so peak memory is measured per run\n
+    and a crashing writer does not end the suite. Compressions a writer does\n
+    not support are skipped for that writer.
+
+    :param path: Directory the writers write to
+    :type path: str
+    :param writers: Writers, names of WRITERS
+    :type writers: tuple
+    :param frame_shapes: Frame shapes (rows, columns)
+    :type frame_shapes: tuple
+    :param chunk_counts: Numbers of chunks per stack
+    :type chunk_counts: tuple
+    :param compressions: Writer compressions
+    :type compressions: tuple
+    :param dtype: Frame data type
+    :type dtype: str
+    :param exposure_time_ms: Camera exposure time
+    :type exposure_time_ms: float
+    :return: Environment and results of all runs
+    :rtype: dict
+    """
+
+    context = multiprocessing.get_context("spawn")
+    results = list()
+    for writer_name in writers:
+        try:
+            module = importlib.import_module(WRITERS[writer_name][0])
+        except Exception as e:
+            results.append({"writer": writer_name, "error": f"unavailable: {type(e).__name__}: {e}"})
+            continue
+        supported = [compression for compression in compressions if compression in module.COMPRESSION_TYPES]
+        for frame_shape, chunk_count, compression in itertools.product(frame_shapes, chunk_counts, supported):
+            kwargs = {
+                "writer_name": writer_name,
+                "path": path,
+                "frame_shape": tuple(frame_shape),
+                "chunk_count": chunk_count,
+                "compression": compression,
+                "dtype": dtype,
+                "exposure_time_ms": exposure_time_ms,
+            }
+            queue = context.Queue()
+            process = context.Process(target=_run_isolated, args=(kwargs, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+    return {
+        "voxel_version": voxel.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def _frame_shape(value: str) -> tuple:
+    """
+    Parse a frame shape given as ROWSxCOLUMNS.
+
+    :param value: Frame shape
+    :type value: str
+    :return: Frame shape (rows, columns)
+    :rtype: tuple
+    """
+
+    rows, columns = value.lower().split("x")
+    return int(rows), int(columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="camera to buffer to writer to disk throughput")
+    parser.add_argument("--path", default=None, help="directory to write to, a temporary directory if omitted")
+    parser.add_argument("--writers", nargs="+", default=["tiff", "bdv", "imaris"], choices=list(WRITERS.keys()))
+    parser.add_argument("--frame-shapes", type=_frame_shape, nargs="+", default=[(2048, 2048)])
+    parser.add_argument("--chunk-counts", type=int, nargs="+", default=[4])
+    parser.add_argument("--compressions", nargs="+", default=["none"])
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--exposure-time-ms", type=float, default=0.001)
+    parser.add_argument("--output", default=None, help="json file to write the results to")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_path:
+        report = run_benchmarks(
+            args.path or temp_path,
+            tuple(args.writers),
+            tuple(args.frame_shapes),
+            tuple(args.chunk_counts),
+            tuple(args.compressions),
+            args.dtype,
+            args.exposure_time_ms,
+        )
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(text)
+    print(text)
@@ -0,0 +1,324 @@
+import argparse
+import itertools
+import json
+import mmap
+import os
+import sys
+import threading
+from pathlib import Path
+from time import get_clock_info, perf_counter
+from typing import Optional
+
+import numpy as np
+
+# offset, size and memory alignment required by O_DIRECT on common filesystems
+DIRECT_IO_ALIGNMENT_BYTES = 4096
+# share of the written bytes, from the start, that burst bandwidth is measured over
+BURST_FRACTION = 0.1
+# share of the written bytes, from the end, that sustained bandwidth is measured over
+SUSTAINED_FRACTION = 0.5
+# shortest measurable interval, bandwidth denominators are clamped to it
+TIMER_RESOLUTION_S = get_clock_info("perf_counter").resolution
+
+
+def mount_point(path: str) -> str:
+    """
+    Mount point of the filesystem a path is on.
+
+    The path does not need to exist, its nearest existing parent is used.\n
+    Paths on the same device, e.g. two directories on one disk, return the\n
+    same mount point.
+
+    :param path: File or directory
+    :type path: str
+    :return: Mount point, the drive on windows
+    :rtype: str
+    """
+
+    path = Path(path).absolute()
+    while not path.exists():
+        path = path.parent
+    device = os.stat(path).st_dev
+    while path.parent != path and os.stat(path.parent).st_dev == device:
+        path = path.parent
+    return str(path)
+
+
+def _open_file(filepath: Path, direct_io: bool) -> tuple:
+    """
+    Open a test file, with O_DIRECT if requested and supported.
+
+    :param filepath: Path of the test file
+    :type filepath: Path
+    :param direct_io: Request O_DIRECT
+    :type direct_io: bool
+    :return: File descriptor and whether O_DIRECT is in use
+    :rtype: tuple
+    """
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    if direct_io and hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(filepath, flags | os.O_DIRECT), True
+        except OSError:
+            # e.g. tmpfs and some network filesystems reject O_DIRECT
+            pass
+    return os.open(filepath, flags), False
+
+
+def _write_stream(
+    filepath: Path,
+    block_nbytes: int,
+    io_depth: int,
+    total_nbytes: int,
+    runtime_s: Optional[float],
+    direct_io: bool,
+    start: threading.Barrier,
+    completions: list,
+    direct_io_used: list,
+    errors: list,
+):
+    """
+    Write one stream of blocks to a test file with io_depth writes in flight.
+
+    The file is opened and the buffers filled before the start barrier. A\n
+    stream failing before the start aborts the barrier so that the other\n
+    streams and the caller do not wait on it forever.
+
+    :param filepath: Path of the test file
+    :type filepath: Path
+    :param block_nbytes: Size of each write
+    :type block_nbytes: int
+    :param io_depth: Number of writes in flight
+    :type io_depth: int
+    :param total_nbytes: Bytes to write
+    :type total_nbytes: int
+    :param runtime_s: Stop issuing writes after this time, None writes all bytes
+    :type runtime_s: float
+    :param direct_io: Request O_DIRECT
+    :type direct_io: bool
+    :param start: Barrier releasing all streams at once
+    :type start: threading.Barrier
+    :param completions: Receives (completion time, bytes) of every write
+    :type completions: list
+    :param direct_io_used: Receives whether O_DIRECT was used
+    :type direct_io_used: list
+    :param errors: Receives the exceptions raised by the stream and its writes
+    :type errors: list
+    """
+
+    fd = None
+    buffers = list()
+    fd_lock = threading.Lock()
+    block_indices = itertools.count()
+    block_count = -(-total_nbytes // block_nbytes)
+
+    def write_blocks(buffer: mmap.mmap):
+        data = memoryview(buffer)
+        try:
+            while True:
+                index = next(block_indices)
+                # every thread writes at least one block, even past the runtime
+                timed_out = runtime_s is not None and index >= io_depth and perf_counter() - start_s > runtime_s
+                if index >= block_count or timed_out or errors:
+                    break
+                offset_bytes = index * block_nbytes
+                position = 0
+                while position < block_nbytes:
+                    if hasattr(os, "pwrite"):
+                        position += os.pwrite(fd, data[position:], offset_bytes + position)
+                    else:
+                        # no positional writes on windows, serialize seek and write
+                        with fd_lock:
+                            os.lseek(fd, offset_bytes + position, os.SEEK_SET)
+                            position += os.write(fd, data[position:])
+                completions.append((perf_counter(), block_nbytes))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            data.release()
+
+    try:
+        fd, direct_io = _open_file(filepath, direct_io)
+        direct_io_used.append(direct_io)
+        # anonymous mmaps are page aligned, as O_DIRECT requires, random data defeats filesystem compression
+        buffers = [mmap.mmap(-1, block_nbytes) for _ in range(io_depth)]
+        for buffer in buffers:
+            buffer[:] = np.random.default_rng().integers(0, 256, block_nbytes, dtype=np.uint8).tobytes()
+        threads = [threading.Thread(target=write_blocks, args=(buffer,), daemon=True) for buffer in buffers]
+        start.wait()
+        start_s = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not errors:
+            # buffered writes only count once they reach the disk
+            os.fsync(fd)
+            completions.append((perf_counter(), 0))
+    except threading.BrokenBarrierError:
+        # another stream failed before the start and recorded its error
+        pass
+    except Exception as e:
+        errors.append(e)
+        start.abort()
+    finally:
+        if fd is not None:
+            os.close(fd)
+        for buffer in buffers:
+            buffer.close()
+
+
+def _bandwidth_mb_s(completions: np.ndarray, start_s: float, first: float, last: float) -> float:
+    """
+    Bandwidth over a share of the written bytes.
+
+    :param completions: (completion time, bytes) of every write, sorted by time
+    :type completions: numpy.ndarray
+    :param start_s: Start time of the benchmark
+    :type start_s: float
+    :param first: Start of the share, 0 is the first byte
+    :type first: float
+    :param last: End of the share, 1 is the last byte
+    :type last: float
+    :return: Bandwidth in MB/s
+    :rtype: float
+    """
+
+    written = np.cumsum(completions[:, 1])
+    total = written[-1]
+    # writes completing the share, widened to whole writes
+    begin = np.searchsorted(written, first * total, side="right")
+    end = len(written) - 1 if last >= 1 else max(np.searchsorted(written, last * total, side="left"), begin)
+    begin_s = start_s if begin == 0 else completions[begin - 1, 0]
+    nbytes = written[end] - (written[begin - 1] if begin > 0 else 0)
+    # writes completing within one timer tick have no measurable duration
+    elapsed_s = max(completions[end, 0] - begin_s, TIMER_RESOLUTION_S)
+    return float(nbytes / 1024**2 / elapsed_s)
+
+
+def benchmark_write_speed(
+    path: str,
+    block_nbytes: int = 1 << 26,
+    io_depth: int = 1,
+    stream_count: int = 1,
+    total_nbytes: int = 1 << 32,
+    runtime_s: Optional[float] = None,
+    direct_io: bool = True,
+) -> dict:
+    """
+    Measure write bandwidth to a directory the way the writers write.
+
+    Every stream writes blocks to its own file with io_depth writes in\n
+    flight, as concurrent cameras writing to one disk do. Burst bandwidth\n
+    covers the first BURST_FRACTION of the bytes, where caches absorb\n
+    writes, sustained bandwidth the last SUSTAINED_FRACTION.
+
+    :param path: Directory to write to
+    :type path: str
+    :param block_nbytes: Size of each write, e.g. the chunk size of the writer
+    :type block_nbytes: int
+    :param io_depth: Number of writes in flight per stream
+    :type io_depth: int
+    :param stream_count: Number of concurrent streams
+    :type stream_count: int
+    :param total_nbytes: Bytes to write per stream
+    :type total_nbytes: int
+    :param runtime_s: Stop issuing writes after this time, None writes all bytes
+    :type runtime_s: float
+    :param direct_io: Write with O_DIRECT where supported
+    :type direct_io: bool
+    :raise ValueError: Invalid block size, io depth, stream count or size
+    :raise OSError: A test file could not be opened or written, re-raised from the failing stream
+    :return: Burst, sustained and mean bandwidth in MB/s and the test setup
+    :rtype: dict
+    """
+
+    if block_nbytes < 1 or io_depth < 1 or stream_count < 1 or total_nbytes < 1:
+        raise ValueError("block size, io depth, stream count and size must be >= 1")
+    # O_DIRECT writes whole aligned blocks
+    block_nbytes = -(-block_nbytes // DIRECT_IO_ALIGNMENT_BYTES) * DIRECT_IO_ALIGNMENT_BYTES
+    Path(path).mkdir(parents=True, exist_ok=True)
+    filepaths = [Path(path, f"write_speed_{os.getpid()}_{stream}.tmp") for stream in range(stream_count)]
+    # the last party to arrive records the start before any stream is released
+    start_times = list()
+    start = threading.Barrier(stream_count + 1, action=lambda: start_times.append(perf_counter()))
+    completions = list()
+    direct_io_used = list()
+    errors = list()
+    streams = [
+        threading.Thread(
+            target=_write_stream,
+            args=(
+                filepath,
+                block_nbytes,
+                io_depth,
+                total_nbytes,
+                runtime_s,
+                direct_io,
+                start,
+                completions,
+                direct_io_used,
+                errors,
+            ),
+            daemon=True,
+        )
+        for filepath in filepaths
+    ]
+    try:
+        for stream in streams:
+            stream.start()
+        try:
+            start.wait()
+        except threading.BrokenBarrierError:
+            # a stream failed before the start, its error is raised below
+            pass
+        for stream in streams:
+            stream.join()
+    finally:
+        for filepath in filepaths:
+            filepath.unlink(missing_ok=True)
+
+    if errors:
+        raise errors[0]
+    if not completions:
+        raise RuntimeError(f"no writes completed to {path}")
+    start_s = start_times[0]
+    completions = np.array(sorted(completions), dtype=np.float64)
+    elapsed_s = max(completions[-1, 0] - start_s, TIMER_RESOLUTION_S)
+    written_mb = completions[:, 1].sum() / 1024**2
+    return {
+        "path": str(path),
+        "mount_point": mount_point(path),
+        "block_nbytes": block_nbytes,
+        "io_depth": io_depth,
+        "stream_count": stream_count,
+        "direct_io": all(direct_io_used),
+        "written_mb": written_mb,
+        "elapsed_s": elapsed_s,
+        "mean_mb_s": written_mb / elapsed_s,
+        "burst_mb_s": _bandwidth_mb_s(completions, start_s, 0.0, BURST_FRACTION),
+        "sustained_mb_s": _bandwidth_mb_s(completions, start_s, 1 - SUSTAINED_FRACTION, 1.0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write bandwidth of a directory")
+    parser.add_argument("path")
+    parser.add_argument("--block-mb", type=float, default=64)
+    parser.add_argument("--io-depth", type=int, default=1)
+    parser.add_argument("--streams", type=int, default=1)
+    parser.add_argument("--size-gb", type=float, default=4)
+    parser.add_argument("--runtime-s", type=float, default=None)
+    parser.add_argument("--buffered", action="store_true", help="write through the page cache")
+    args = parser.parse_args()
+    result = benchmark_write_speed(
+        args.path,
+        int(args.block_mb * 1024**2),
+        args.io_depth,
+        args.streams,
+        int(args.size_gb * 1024**3),
+        args.runtime_s,
+        not args.buffered,
+    )
+    json.dump(result, sys.stdout, indent=2)
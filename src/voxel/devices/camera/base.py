@@ -112,6 +112,24 @@ class BaseCamera:
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
         pass
 
+    def grab_frames(self, out, count: int = None):
+        """Grab the next frames into out, shape (frames, rows, cols).
+
+        Falls back to one grab_frame call per frame, cameras override this\n
+        to fill a whole chunk in one call.
+
+        :param out: Destination with at least count frames, e.g. the writer buffer
+        :type out: numpy.ndarray
+        :param count: Number of frames to grab, all frames of out if None
+        :type count: int
+        :return: Grabbed frames
+        :rtype: numpy.ndarray
+        """
+        count = out.shape[0] if count is None else count
+        for index in range(count):
+            out[index] = self.grab_frame()
+        return out[:count]
+
     def signal_acquisition_state(self):
         self.log.warning(f"WARNING: {inspect.stack()[0][3]} not implemented")
         pass
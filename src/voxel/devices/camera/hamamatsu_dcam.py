@@ -360,6 +360,8 @@ class Camera(BaseCamera):
         self.dropped_frames = 0
         self.pre_frame_time = 0
         self.pre_frame_count_px = 0
+        # sequence number of the next frame read by grab_frames
+        self._frames_read = 0
         self.dcam.cap_start()
 
     def abort(self):
@@ -397,11 +399,64 @@ class Camera(BaseCamera):
     def latest_frame(self):
         return self._latest_frame
 
+    def grab_frames(self, out, count: int = None):
+        """Copy the next frames in acquisition order into out, shape (frames, rows, cols).
+
+        Frames already in the DCAM buffer are copied in one pass without waiting,\n
+        so a wait is only made when the camera has not captured the next frame yet.\n
+        The frame count is checked around every copy, frames the camera wrote over\n
+        before or while they were copied are skipped and logged as overwritten.
+
+        :param out: Destination with at least count frames, e.g. the writer buffer
+        :type out: numpy.ndarray
+        :param count: Number of frames to grab, all frames of out if None
+        :type count: int
+        :return: Grabbed frames, fewer than count if the camera timed out
+        :rtype: numpy.ndarray
+        """
+        count = out.shape[0] if count is None else count
+        timeout_ms = 1000
+        index = 0
+        while index < count:
+            available = self._transferred_frames() - self._frames_read
+            if available <= 0:
+                if self.dcam.wait_capevent_frameready(timeout_ms) is False:
+                    self.log.warning(f"timed out after {index}/{count} frames")
+                    break
+                continue
+            for _ in range(min(available, count - index)):
+                # the camera writes frame n + buffer_size_frames over frame n, possibly while it is copied
+                overwritten = self._transferred_frames() - self._frames_read >= self.buffer_size_frames
+                if not overwritten:
+                    if self.dcam.buf_copyframe(self._frames_read % self.buffer_size_frames, out[index]) is False:
+                        raise RuntimeError(f"could not copy frame {self._frames_read}: {self.dcam.lasterr()}")
+                    overwritten = self._transferred_frames() - self._frames_read >= self.buffer_size_frames
+                if overwritten:
+                    # skip ahead, leaving half the buffer to copy before the camera catches up again
+                    skipped = max(self._transferred_frames() - self._frames_read - self.buffer_size_frames // 2, 1)
+                    self.log.warning(f"{skipped} frames overwritten before grabbing")
+                    self._frames_read += skipped
+                    break
+                self._frames_read += 1
+                index += 1
+        if index > 0:
+            self._latest_frame = out[index - 1].copy()
+        return out[:index]
+
+    def _transferred_frames(self) -> int:
+        """Number of frames the camera transferred into the DCAM buffer since the capture started.
+
+        :return: Frame count
+        :rtype: int
+        """
+        cap_info = self.dcam.cap_transferinfo()
+        if cap_info is False:
+            raise RuntimeError(f"could not get transfer info: {self.dcam.lasterr()}")
+        return cap_info.nFrameCount
+
     def signal_acquisition_state(self):
         """return a dict with the state of the acquisition buffers"""
-        cap_info = DCAMCAP_TRANSFERINFO()
-        # __hdcam inside class Dcam referenced as _Dcam__hdcam
-        dcamcap_transferinfo(self.dcam._Dcam__hdcam, byref(cap_info))
+        cap_info = self.dcam.cap_transferinfo()
         self.post_frame_time = time.time()
         frame_index = cap_info.nFrameCount
         out_buffer_size = frame_index - self.pre_frame_count_px
@@ -500,6 +500,32 @@ class Dcam:
 
         return (aFrame, npBuf)
 
+    def buf_copyframe(self, iFrame, npBuf):
+        """
+        Copy image data specified by iFrame into an existing NumPy buffer.
+
+        Args:
+            arg1(int): Index of target frame
+            arg2(NumPy ndarray): C-contiguous buffer with the frame width, height and pixel type
+
+        Returns:
+            True:   success
+            False:  error happens.  lasterr() returns the DCAMERR value
+        """
+        if not self.is_opened():
+            return self.__result(DCAMERR.INVALIDHANDLE)  # instance is not opened yet.
+
+        aFrame = DCAMBUF_FRAME()
+        aFrame.iFrame = iFrame
+
+        aFrame.buf = npBuf.ctypes.data_as(c_void_p)
+        aFrame.rowbytes = npBuf.strides[0]
+        aFrame.type = self.__bufframe.type
+        aFrame.width = self.__bufframe.width
+        aFrame.height = self.__bufframe.height
+
+        return self.__result(dcambuf_copyframe(self.__hdcam, byref(aFrame)))
+
     def buf_getframedata(self, iFrame):
         """
         Return NumPy buffer of image data specified by iFrame.
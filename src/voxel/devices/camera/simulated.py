@@ -1,9 +1,10 @@
 import logging
 import numpy
 import time
-from multiprocessing import Process, Queue, Event
+from multiprocessing import Process, Queue, Event, Value
+from multiprocessing.shared_memory import SharedMemory
 from voxel.devices.camera.base import BaseCamera
-from voxel.processes.downsample.gpu.gputools.downsample_2d import GPUToolsDownSample2D
+from voxel.processes.downsample.registry import best_downsampler
 from voxel.descriptors.deliminated_property import DeliminatedProperty
 from threading import Thread
 
@@ -16,6 +17,17 @@ MAX_HEIGHT_PX = 10640
 DIVISIBLE_HEIGHT_PX = 1
 MIN_EXPOSURE_TIME_MS = 0.001
 MAX_EXPOSURE_TIME_MS = 6e4
+# phantom mode serves frames from a pool of precomputed frames, bounded in size
+PHANTOM_POOL_MB = 1024
+MAX_PHANTOM_POOL_FRAMES = 16
+# mean spacing between beads of a phantom
+PHANTOM_BEAD_SPACING_PX = 48
+# brightest phantom value, frames of wider data types use a 12 bit range
+PHANTOM_MAX_VALUE = 4095
+# longest sleep while waiting for a frame, so stop() is noticed quickly
+MAX_WAIT_S = 0.01
+
+SIMULATION_MODES = ["phantom", "random"]
 
 
 BINNING = {
@@ -47,6 +59,121 @@ POLARITIES =  {
         "falling": "FallingEdge",
     }
 
+def generate_phantoms(frame_count: int, shape: tuple, dtype: str, seed: int = 0) -> numpy.ndarray:
+    """
+    Generate a deterministic pool of structured frames.
+
+    Each frame is a smooth background with gaussian beads and shot-like noise,\n
+    so frames compress like real data, unlike uniform random noise.\n
+    The beads drift between frames, as if stepping through a sample.
+
+    :param frame_count: Number of frames
+    :type frame_count: int
+    :param shape: Frame shape (rows, columns)
+    :type shape: tuple
+    :param dtype: Frame data type
+    :type dtype: str
+    :param seed: Random seed, the same seed always generates the same frames
+    :type seed: int
+    :return: Frames, shape (frame_count, rows, columns)
+    :rtype: numpy.ndarray
+    """
+
+    rng = numpy.random.default_rng(seed)
+    rows, columns = shape
+    # 12 bit sensor range for 16 bit frames
+    max_value = min(numpy.iinfo(dtype).max, PHANTOM_MAX_VALUE)
+    # dark offset plus a dim, smooth illumination falloff
+    y = numpy.cos(numpy.linspace(-1.2, 1.2, rows, dtype=numpy.float32))
+    x = numpy.cos(numpy.linspace(-1.2, 1.2, columns, dtype=numpy.float32))
+    background = numpy.outer(y, x) * (max_value * 0.02) + max_value * 0.025
+    # bead sprite, stamped at random positions with random brightness
+    sprite_y, sprite_x = numpy.mgrid[-4:5, -4:5].astype(numpy.float32)
+    sprite = numpy.exp(-(sprite_y ** 2 + sprite_x ** 2) / 4.0)
+    bead_count = max(1, rows * columns // PHANTOM_BEAD_SPACING_PX ** 2)
+    bead_y = rng.integers(0, rows, bead_count)
+    bead_x = rng.integers(0, columns, bead_count)
+    bead_brightness = rng.uniform(0.1, 0.6, bead_count).astype(numpy.float32) * max_value
+    frames = numpy.empty((frame_count, rows, columns), dtype=dtype)
+    for index in range(frame_count):
+        image = background.copy()
+        # beads drift by a pixel per frame and fade in and out of focus
+        focus = 0.5 + 0.5 * numpy.cos(2 * numpy.pi * (index / frame_count + bead_brightness / max_value))
+        for (dy, dx), weight in numpy.ndenumerate(sprite):
+            yy = (bead_y + dy - 4 + index) % rows
+            xx = (bead_x + dx - 4) % columns
+            numpy.add.at(image, (yy, xx), weight * bead_brightness * focus)
+        # shot noise of about the square root of the signal
+        noise = rng.standard_normal((rows, columns), dtype=numpy.float32)
+        numpy.multiply(noise, numpy.sqrt(image) * 0.5 + 1.0, out=noise)
+        numpy.add(image, noise, out=image)
+        numpy.clip(image, 0, max_value, out=image)
+        frames[index] = image
+    return frames
+
+
+def _produce_frames(
+    shm_name: str,
+    frame_shape: tuple,
+    dtype: str,
+    pool_frame_count: int,
+    seed: int,
+    binning: int,
+    frame_time_s: float,
+    produced,
+    start_time_s,
+    stop,
+):
+    """
+    Frame producer run in its own process by the simulated camera.
+
+    Regenerates the phantom pool from the seed and copies a frame into the\n
+    shared ring buffer every frame time, like a frame grabber writing into\n
+    host memory.
+
+    :param shm_name: Name of the shared ring buffer
+    :type shm_name: str
+    :param frame_shape: Shape of the frames in the ring buffer
+    :type frame_shape: tuple
+    :param dtype: Frame data type
+    :type dtype: str
+    :param pool_frame_count: Number of frames in the phantom pool
+    :type pool_frame_count: int
+    :param seed: Random seed of the phantom pool
+    :type seed: int
+    :param binning: Binning factor
+    :type binning: int
+    :param frame_time_s: Frame time in seconds
+    :type frame_time_s: float
+    :param produced: Shared count of frames written into the ring buffer
+    :type produced: multiprocessing.Value
+    :param start_time_s: Shared time when frame 0 started exposing
+    :type start_time_s: multiprocessing.Value
+    :param stop: Set to stop producing
+    :type stop: multiprocessing.Event
+    """
+
+    shm = SharedMemory(shm_name, create=False)
+    ring = numpy.ndarray((BUFFER_SIZE_FRAMES,) + tuple(frame_shape), dtype=dtype, buffer=shm.buf)
+    pool = generate_phantoms(pool_frame_count, (frame_shape[0] * binning, frame_shape[1] * binning), dtype, seed)
+    if binning > 1:
+        downsampler = best_downsampler(pool.shape[1:], dtype, binning)
+        pool = numpy.stack([downsampler.run(frame) for frame in pool])
+    start_time_s.value = time.perf_counter()
+    index = 0
+    while not stop.is_set():
+        # frame n is read out at the end of its frame time
+        wait_s = start_time_s.value + (index + 1) * frame_time_s - time.perf_counter()
+        if wait_s > 0:
+            time.sleep(min(wait_s, MAX_WAIT_S))
+            continue
+        ring[index % BUFFER_SIZE_FRAMES] = pool[index % pool_frame_count]
+        index += 1
+        produced.value = index
+    del ring
+    shm.close()
+
+
 class Camera(BaseCamera):
 
     width_px = DeliminatedProperty(fget=lambda instance: getattr(instance, '_width_px'),
@@ -74,18 +201,35 @@ class Camera(BaseCamera):
         self.id = id
         self.terminate_frame_grab = Event()
         self.terminate_frame_grab.clear()
-        self._pixel_type = "mono16"
-        self._line_interval_us = LINE_INTERVALS_US[self._pixel_type]
+        self._pixel_type = PIXEL_TYPES["mono16"]
+        self._line_interval_us = LINE_INTERVALS_US["mono16"]
         self._exposure_time_ms = 10
         self._width_px = MAX_WIDTH_PX
         self._height_px = MAX_HEIGHT_PX
         self._width_offset_px = 0
         self._height_offset_px = 0
         self._binning = 1
+        self._downsampler = None
+        self._downsampler_key = None
         self._trigger = {'mode': 'on',
                          'source': 'internal',
                          'polarity': 'rising'}
         self._latest_frame = None
+        self._simulation_mode = "phantom"
+        self._own_process = False
+        self._seed = 0
+        # precomputed, binned frames served in phantom mode
+        self._pool = None
+        self._pool_key = None
+        # acquisition state
+        self.frame = 0
+        self._dropped_frames = 0
+        self._start_time_s = None
+        self._last_frame_time_s = None
+        # frame producer process and its shared ring buffer
+        self._producer = None
+        self._ring_shm = None
+        self._ring = None
 
     @DeliminatedProperty(minimum=MIN_EXPOSURE_TIME_MS, maximum=MAX_EXPOSURE_TIME_MS, step=0.001)
     def exposure_time_ms(self):
@@ -185,8 +329,8 @@ class Camera(BaseCamera):
             raise ValueError("binning must be one of %r." % BINNING)
         else:
             self._binning = BINNING[binning]
-            # initialize the downsampling in 2d
-            self.gpu_binning = GPUToolsDownSample2D(binning=self._binning)
+            # the 2d downsampling backend is picked on the next binned frame
+            self._downsampler = None
 
     @property
     def pixel_type(self):
@@ -208,6 +352,70 @@ class Camera(BaseCamera):
     def line_interval_us(self):
         return self._line_interval_us
 
+    @property
+    def simulation_mode(self):
+        """Get how frames are simulated.\n
+        phantom serves structured frames from a precomputed pool,\n
+        random generates uniform noise for every frame.
+
+        :return: Simulation mode
+        :rtype: str
+        """
+        return self._simulation_mode
+
+    @simulation_mode.setter
+    def simulation_mode(self, simulation_mode: str):
+        """Set how frames are simulated.
+
+        :param simulation_mode: Simulation mode
+        :type simulation_mode: str
+        :raises ValueError: Invalid simulation mode
+        """
+        if simulation_mode not in SIMULATION_MODES:
+            raise ValueError("simulation mode must be one of %r." % SIMULATION_MODES)
+        self._simulation_mode = simulation_mode
+        self.log.info(f"simulation mode set to: {simulation_mode}")
+
+    @property
+    def own_process(self):
+        """Get whether phantom frames are produced in a separate process.
+
+        :return: Own process
+        :rtype: bool
+        """
+        return self._own_process
+
+    @own_process.setter
+    def own_process(self, own_process: bool):
+        """Set whether phantom frames are produced in a separate process,\n
+        which writes them into a shared ring buffer like a frame grabber.
+
+        :param own_process: Own process
+        :type own_process: bool
+        """
+        self._own_process = bool(own_process)
+        self.log.info(f"own process set to: {self._own_process}")
+
+    @property
+    def seed(self):
+        """Get the random seed of the phantom frames.
+
+        :return: Seed
+        :rtype: int
+        """
+        return self._seed
+
+    @seed.setter
+    def seed(self, seed: int):
+        """Set the random seed of the phantom frames,\n
+        the same seed always simulates the same frames.
+
+        :param seed: Seed
+        :type seed: int
+        """
+        self._seed = int(seed)
+        self.log.info(f"seed set to: {self._seed}")
+
     @property
     def sensor_width_px(self):
         return MAX_WIDTH_PX
@@ -220,55 +428,264 @@ class Camera(BaseCamera):
     def frame_time_ms(self):
         return self._height_px * self._line_interval_us / 1000 + self._exposure_time_ms
 
+    @property
+    def frame_shape(self):
+        """Shape (rows, cols) of the frames returned by grab_frame, after binning."""
+        return (self._height_px // self._binning, self._width_px // self._binning)
+
     def prepare(self):
         self.log.info('simulated camera preparing...')
-
+        if self._simulation_mode == "phantom" and not self._own_process:
+            self._prepare_pool()
 
     def start(self, frame_count: int = float('inf')):
         self.log.info('simulated camera starting...')
         self.frame = 0
-
+        self._dropped_frames = 0
+        self._last_frame_time_s = None
+        if self._simulation_mode == "phantom" and self._own_process:
+            self._start_producer()
+        else:
+            self._start_time_s = time.perf_counter()
 
     def stop(self):
         self.log.info('simulated camera stopping...')
+        self._stop_producer()
         self.frame = 0
 
     def grab_frame(self):
-
-        self.frame += 1
-        image = numpy.random.randint(low=128, high=256, size=(self._height_px, self._width_px), dtype=self._pixel_type)
+        """
+        Wait for the next frame and return it.
+
+        Frames are paced to frame_time_ms. In phantom mode the returned frame\n
+        is a read-only frame of the pool, or a copy out of the ring buffer\n
+        when frames are produced in their own process.
+
+        :return: Frame
+        :rtype: numpy.ndarray
+        """
+
+        if self._simulation_mode == "phantom" and self._ring is None:
+            self._prepare_pool()
+        index = self._wait_for_frame()
+        if self._simulation_mode == "random":
+            image = numpy.random.randint(low=128, high=256, size=(self._height_px, self._width_px),
+                                         dtype=self._pixel_type)
+            if self._binning > 1:
+                image = self._get_downsampler(image).run(image)
+        elif self._ring is not None:
+            image = numpy.empty(self._ring.shape[1:], dtype=self._ring.dtype)
+            self._copy_ring_frame(index, image)
+        else:
+            image = self._pool[index % len(self._pool)]
         self._latest_frame = image
-        if self._binning > 1:
-            return self.gpu_binning.run(image)
+        return image
+
+    def grab_frames(self, out: numpy.ndarray, count: int = None):
+        """
+        Grab the next frames into out, shape (frames, rows, cols).
+
+        :param out: Destination with at least count frames
+        :type out: numpy.ndarray
+        :param count: Number of frames to grab, all frames of out if None
+        :type count: int
+        :return: Grabbed frames
+        :rtype: numpy.ndarray
+        """
+
+        count = out.shape[0] if count is None else count
+        if self._simulation_mode == "random":
+            for index in range(count):
+                out[index] = self.grab_frame()
+            return out[:count]
+        if self._ring is None:
+            self._prepare_pool()
+        for index in range(count):
+            frame_index = self._wait_for_frame()
+            if self._ring is not None:
+                self._copy_ring_frame(frame_index, out[index])
+            else:
+                out[index] = self._pool[frame_index % len(self._pool)]
+        if count > 0:
+            self._latest_frame = out[count - 1].copy()
+        return out[:count]
+
+    def _copy_ring_frame(self, index: int, out: numpy.ndarray) -> None:
+        """
+        Copy a frame out of the ring buffer of the producer process.
+
+        The producer writes frame index + BUFFER_SIZE_FRAMES over the frame\n
+        once it produced that many, a frame written over while it was copied\n
+        is dropped and the next frame is copied instead.
+
+        :param index: Sequence number of the frame
+        :type index: int
+        :param out: Destination frame
+        :type out: numpy.ndarray
+        """
+
+        while True:
+            out[...] = self._ring[index % BUFFER_SIZE_FRAMES]
+            if self._produced_frame_count() < index + BUFFER_SIZE_FRAMES:
+                return
+            self._dropped_frames += 1
+            index = self._wait_for_frame()
+
+    def _produced_frame_count(self) -> int:
+        """
+        Number of frames read out of the sensor since start.
+
+        :return: Frame count
+        :rtype: int
+        """
+
+        if self._producer is not None:
+            return self._produced.value
+        frame_time_s = self.frame_time_ms / 1000
+        return int((time.perf_counter() - self._start_time_s) / frame_time_s)
+
+    def _wait_for_frame(self) -> int:
+        """
+        Wait until the next frame is read out and account for dropped frames.
+
+        With internal or no triggering the sensor runs freely from start and\n
+        frames the reader falls behind on are dropped once the ring of\n
+        BUFFER_SIZE_FRAMES frames is full. With an external trigger every\n
+        frame is triggered when it is requested, at most once per frame time,\n
+        so no frames are dropped.
+
+        :return: Sequence number of the frame
+        :rtype: int
+        """
+
+        frame_time_s = self.frame_time_ms / 1000
+        if self._start_time_s is None:
+            self._start_time_s = time.perf_counter()
+        if self._trigger['mode'] == 'on' and self._trigger['source'] == 'external' and self._producer is None:
+            now = time.perf_counter()
+            start_s = now if self._last_frame_time_s is None else max(now, self._last_frame_time_s)
+            self._last_frame_time_s = start_s + frame_time_s
+            time.sleep(max(0.0, self._last_frame_time_s - now))
         else:
-            return image
+            produced = self._produced_frame_count()
+            if produced - self.frame > BUFFER_SIZE_FRAMES:
+                # the oldest frames were overwritten before they were read
+                dropped = produced - self.frame - BUFFER_SIZE_FRAMES
+                self._dropped_frames += dropped
+                self.frame += dropped
+            while produced <= self.frame:
+                if self._producer is not None and not self._producer.is_alive():
+                    raise RuntimeError("simulated frame producer stopped")
+                wait_s = frame_time_s if self._producer is not None else \
+                    self._start_time_s + (self.frame + 1) * frame_time_s - time.perf_counter()
+                time.sleep(min(max(wait_s, 0.0), MAX_WAIT_S))
+                produced = self._produced_frame_count()
+        index = self.frame
+        self.frame += 1
+        return index
+
+    def _prepare_pool(self):
+        """
+        Generate and bin the phantom pool for the current frame geometry.
+        """
+
+        key = (self._height_px, self._width_px, self._pixel_type, self._binning, self._seed)
+        if self._pool_key == key:
+            return
+        frame_mb = self._height_px * self._width_px * numpy.dtype(self._pixel_type).itemsize / 1024 ** 2
+        frame_count = int(max(2, min(MAX_PHANTOM_POOL_FRAMES, PHANTOM_POOL_MB // frame_mb)))
+        self.log.info(f"generating {frame_count} phantom frames")
+        pool = generate_phantoms(frame_count, (self._height_px, self._width_px), self._pixel_type, self._seed)
+        if self._binning > 1:
+            pool = numpy.stack([self._get_downsampler(frame).run(frame) for frame in pool])
+        # frames are handed out without copying
+        pool.flags.writeable = False
+        self._pool = pool
+        self._pool_key = key
+
+    def _start_producer(self):
+        """
+        Start the frame producer process and its shared ring buffer.
+        """
+
+        frame_shape = self.frame_shape
+        frame_mb = self._height_px * self._width_px * numpy.dtype(self._pixel_type).itemsize / 1024 ** 2
+        frame_count = int(max(2, min(MAX_PHANTOM_POOL_FRAMES, PHANTOM_POOL_MB // frame_mb)))
+        nbytes = BUFFER_SIZE_FRAMES * int(numpy.prod(frame_shape)) * numpy.dtype(self._pixel_type).itemsize
+        self._ring_shm = SharedMemory(create=True, size=nbytes)
+        self._ring = numpy.ndarray((BUFFER_SIZE_FRAMES,) + frame_shape, dtype=self._pixel_type,
+                                   buffer=self._ring_shm.buf)
+        self._produced = Value('q', 0)
+        self._producer_start_time_s = Value('d', 0.0)
+        self._producer_stop = Event()
+        self._producer = Process(
+            target=_produce_frames,
+            args=(self._ring_shm.name, frame_shape, self._pixel_type, frame_count, self._seed, self._binning,
+                  self.frame_time_ms / 1000, self._produced, self._producer_start_time_s, self._producer_stop),
+            daemon=True,
+        )
+        self._producer.start()
+
+    def _stop_producer(self):
+        """
+        Stop the frame producer process and release its ring buffer.
+        """
+
+        if self._producer is not None:
+            self._producer_stop.set()
+            self._producer.join()
+            self._producer = None
+        if self._ring_shm is not None:
+            self._ring = None
+            self._ring_shm.close()
+            self._ring_shm.unlink()
+            self._ring_shm = None
+
+    def _get_downsampler(self, image: numpy.ndarray):
+        """
+        Get the fastest 2d downsampler for the current frame shape and pixel type.
+
+        :param image: Frame to downsample
+        :type image: numpy.ndarray
+        :return: Downsampler
+        :rtype: BaseDownSample
+        """
+
+        key = (image.shape, image.dtype.name, self._binning)
+        if self._downsampler is None or self._downsampler_key != key:
+            self._downsampler = best_downsampler(*key)
+            self._downsampler_key = key
+        return self._downsampler
 
     @property
     def latest_frame(self):
         return self._latest_frame
 
-    # def signal_acquisition_state(self):
-    #     """return a dict with the state of the acquisition buffers"""
-    #     state = {}
-    #     state['Frame Index'] = self.frame
-    #     state['Input Buffer Size'] = len(self.buffer)
-    #     state['Output Buffer Size'] = BUFFER_SIZE_FRAMES - len(self.buffer)
-    #     # number of underrun, i.e. dropped frames
-    #     state['Dropped Frames'] = self.dropped_frames
-    #     state['Data Rate [MB/s]'] = self.frame_rate * self._width_px * self._height_px * numpy.dtype(
-    #         self._pixel_type).itemsize / self._binning ** 2 / 1e6
-    #     state['Frame Rate [fps]'] = self.frame_rate
-    #     self.log.info(f"id: {self.id}, "
-    #                   f"frame: {state['Frame Index']}, "
-    #                   f"input: {state['Input Buffer Size']}, "
-    #                   f"output: {state['Output Buffer Size']}, "
-    #                   f"dropped: {state['Dropped Frames']}, "
-    #                   f"data rate: {state['Data Rate [MB/s]']:.2f} [MB/s], "
-    #                   f"frame rate: {state['Frame Rate [fps]']:.2f} [fps].")
-    #     return state
+    def signal_acquisition_state(self):
+        """return a dict with the state of the acquisition buffers"""
+        produced = self._produced_frame_count() if self._start_time_s is not None or self._producer else 0
+        output_buffer_size = min(max(produced - self.frame, 0), BUFFER_SIZE_FRAMES)
+        frame_rate = 1000 / self.frame_time_ms
+        state = {}
+        state['Frame Index'] = self.frame
+        state['Input Buffer Size'] = BUFFER_SIZE_FRAMES - output_buffer_size
+        state['Output Buffer Size'] = output_buffer_size
+        # number of underrun, i.e. dropped frames
+        state['Dropped Frames'] = self._dropped_frames
+        state['Data Rate [MB/s]'] = frame_rate * self._width_px * self._height_px * numpy.dtype(
+            self._pixel_type).itemsize / self._binning ** 2 / 1e6
+        state['Frame Rate [fps]'] = frame_rate
+        self.log.info(f"id: {self.id}, "
+                      f"frame: {state['Frame Index']}, "
+                      f"input: {state['Input Buffer Size']}, "
+                      f"output: {state['Output Buffer Size']}, "
+                      f"dropped: {state['Dropped Frames']}, "
+                      f"data rate: {state['Data Rate [MB/s]']:.2f} [MB/s], "
+                      f"frame rate: {state['Frame Rate [fps]']:.2f} [fps].")
+        return state
 
     def abort(self):
-        pass
+        self._stop_producer()
 
     def close(self):
-        pass
+        self._stop_producer()
@@ -4,7 +4,7 @@ from functools import wraps
 from voxel.devices.camera.base import BaseCamera
 from voxel.devices.camera.sdks.egrabber import *
 from voxel.devices.utils.singleton import Singleton
-from voxel.processes.downsample.gpu.gputools.downsample_2d import GPUToolsDownSample2D
+from voxel.processes.downsample.registry import best_downsampler
 from voxel.descriptors.deliminated_property import DeliminatedProperty
 import numpy as np
 # from copy import deepcopy
@@ -68,6 +68,8 @@ class Camera(BaseCamera):
         self.id = str(id)  # convert to string incase serial # is entered as int
         self.gentl = EGenTLSingleton()
         self._latest_frame = None
+        # frame geometry cached by _update_frame_geometry, None when stale
+        self._frame_geometry = None
 
         discovery = EGrabberDiscovery(self.gentl)
         discovery.discover()
@@ -141,6 +143,7 @@ class Camera(BaseCamera):
         centered_offset_px = round((self.max_width_px / 2 - value / 2) / self.step_width_px) * self.step_width_px
         self.grabber.remote.set("OffsetX", centered_offset_px)
         self.grabber.remote.set("Width", value)
+        self._frame_geometry = None
         self.log.info(f"width set to: {value} px")
         # refresh parameter values
         self._get_min_max_step_values()
@@ -160,6 +163,7 @@ class Camera(BaseCamera):
         centered_offset_px = round((self.max_height_px / 2 - value / 2) / self.step_height_px) * self.step_height_px
         self.grabber.remote.set("OffsetY", centered_offset_px)
         self.grabber.remote.set("Height", value)
+        self._frame_geometry = None
         self.log.info(f"height set to: {value} px")
         # refresh parameter values
         self._get_min_max_step_values()
@@ -181,6 +185,7 @@ class Camera(BaseCamera):
             raise ValueError("pixel_type_bits must be one of %r." % valid)
         # note: for the Vieworks VP-151MX camera, the pixel type also controls line interval
         self.grabber.remote.set("PixelFormat", PIXEL_TYPES[pixel_type_bits])
+        self._frame_geometry = None
         self.log.info(f"pixel type set to: {pixel_type_bits}")
         # refresh parameter values
         self._update_parameters()
@@ -197,6 +202,7 @@ class Camera(BaseCamera):
         if bit_packing not in valid:
             raise ValueError("bit_packing_mode must be one of %r." % valid)
         self.grabber.stream.set("UnpackingMode", BIT_PACKING_MODES[bit_packing])
+        self._frame_geometry = None
         self.log.info(f"bit packing mode set to: {bit_packing}")
         # refresh parameter values
         self._get_min_max_step_values()
@@ -256,9 +262,8 @@ class Camera(BaseCamera):
         if not isinstance(BINNING[binning], int):
             self.grabber.remote.set("BinningHorizontal", BINNING[binning])
             self.grabber.remote.set("BinningVertical", BINNING[binning])
-        # initialize the opencl binning program
-        else:
-            self.gpu_binning = GPUToolsDownSample2D(binning=int(self._binning))
+        # software binning backend is picked with the frame geometry
+        self._frame_geometry = None
         # refresh parameter values
         self._get_min_max_step_values()
 
@@ -298,6 +303,8 @@ class Camera(BaseCamera):
         # realloc buffers appears to be allocating ram on the pc side, not camera side.
         self.grabber.realloc_buffers(self.buffer_size_frames)  # allocate RAM buffer N frames
         self.log.info(f"buffer set to: {self.buffer_size_frames} frames")
+        # query the frame geometry once here instead of on every frame
+        self._update_frame_geometry()
 
     def start(self, frame_count: int = GENTL_INFINITE):
         """Start camera. If no frame count given, assume infinite frames"""
@@ -319,32 +326,106 @@ class Camera(BaseCamera):
         self.grabber = EGrabber(self.gentl, self.egrabber['interface'], self.egrabber['device'], self.egrabber['stream'],
                                    remote_required=True)
                 
-    def grab_frame(self):
-        """Retrieve a frame as a 2D numpy array with shape (rows, cols)."""
+    @property
+    def frame_shape(self):
+        """Shape (rows, cols) of the frames returned by grab_frame, after software binning."""
+        if self._frame_geometry is None:
+            self._update_frame_geometry()
+        return self._frame_geometry['frame_shape']
+
+    @property
+    def frame_dtype(self):
+        """Data type of the frames returned by grab_frame."""
+        if self._frame_geometry is None:
+            self._update_frame_geometry()
+        return self._frame_geometry['dtype']
+
+    def grab_frame(self, out: np.ndarray = None):
+        """Retrieve a frame as a 2D numpy array with shape (rows, cols).
+
+        The frame is copied once out of the grabber buffer, straight into out if given,\n
+        e.g. the next frame of the writer buffer. Geometry is cached, so no GenICam\n
+        queries are made per frame.
+
+        :param out: Destination of shape frame_shape and data type frame_dtype,\n
+        allocated if None
+        :type out: numpy.ndarray
+        :raises ValueError: Destination does not match the frame geometry
+        :return: Frame, out if given
+        :rtype: numpy.ndarray
+        """
+        if self._frame_geometry is None:
+            self._update_frame_geometry()
+        geometry = self._frame_geometry
+        if out is not None and (out.shape != geometry['frame_shape'] or out.dtype != geometry['dtype']):
+            raise ValueError(f"out must have shape {geometry['frame_shape']} and dtype {geometry['dtype']}")
+        out = self._copy_buffer(geometry, out)
+        # private copy, the caller may reuse out, e.g. a ring buffer slot handed to a writer
+        self._latest_frame = out.copy()
+        return out
+
+    @property
+    def latest_frame(self):
+        return self._latest_frame
+
+    def grab_frames(self, out: np.ndarray, count: int = None):
+        """Grab the next frames into out, shape (frames, rows, cols).
+
+        Each grabber buffer is popped and copied straight into its frame of out,\n
+        with the geometry checked once per call instead of once per frame.
+
+        :param out: Destination with at least count frames of shape frame_shape\n
+        and data type frame_dtype, e.g. the writer buffer
+        :type out: numpy.ndarray
+        :param count: Number of frames to grab, all frames of out if None
+        :type count: int
+        :raises ValueError: Destination does not match the frame geometry
+        :return: Grabbed frames
+        :rtype: numpy.ndarray
+        """
+        count = out.shape[0] if count is None else count
+        if self._frame_geometry is None:
+            self._update_frame_geometry()
+        geometry = self._frame_geometry
+        if out.shape[1:] != geometry['frame_shape'] or out.dtype != geometry['dtype']:
+            raise ValueError(f"out must have frames of shape {geometry['frame_shape']} and dtype {geometry['dtype']}")
+        for index in range(count):
+            self._copy_buffer(geometry, out[index])
+        if count > 0:
+            self._latest_frame = out[count - 1].copy()
+        return out[:count]
+
+    def _copy_buffer(self, geometry: dict, out: np.ndarray = None):
+        """Pop the next grabber buffer and copy it, binned if needed, into out.
+
+        :param geometry: Cached frame geometry
+        :type geometry: dict
+        :param out: Destination, allocated if None
+        :type out: numpy.ndarray
+        :return: Frame
+        :rtype: numpy.ndarray
+        """
         # Note: creating the buffer and then "pushing" it at the end has the
         #   effect of moving the internal camera frame buffer from the output
         #   pool back to the input pool, so it can be reused.
-        column_count = self.grabber.remote.get("Width")
-        row_count = self.grabber.remote.get("Height")
         timeout_ms = 1000
         with Buffer(self.grabber, timeout=timeout_ms) as buffer:
             ptr = buffer.get_info(BUFFER_INFO_BASE, INFO_DATATYPE_PTR)  # grab pointer to new frame
-            # grab frame data
-            data = ct.cast(ptr, ct.POINTER(ct.c_ubyte * column_count * row_count * 2)).contents
-            # cast data to numpy array of correct size/datatype:
-            image = numpy.frombuffer(data, count=int(column_count * row_count),
-                                     dtype=numpy.uint16).reshape((row_count,
-                                                                  column_count))
-        # do software binning if != 1 and not a string for setting in egrabber
-        if self._binning > 1 and isinstance(self._binning, int):
-            image = np.copy(self.gpu_binning.run(image))
-        self._latest_frame = np.copy(image)
-        return image
-
-    @property
-    def latest_frame(self):
-        return self._latest_frame
-        #return np.random.rand(self.height_px,self.width_px)
+            # view the grabber buffer without copying, it is only valid inside this block
+            data = ct.cast(ptr, ct.POINTER(ct.c_ubyte * geometry['nbytes'])).contents
+            image = numpy.frombuffer(data, dtype=geometry['dtype']).reshape(geometry['sensor_shape'])
+            if geometry['downsampler'] is not None:
+                # the binned frame is a new array, only copied if a destination is given
+                binned = geometry['downsampler'].run(image)
+                if out is None:
+                    out = binned
+                else:
+                    np.copyto(out, binned)
+            else:
+                if out is None:
+                    out = np.empty(geometry['frame_shape'], geometry['dtype'])
+                np.copyto(out, image)
+        return out
 
     def signal_acquisition_state(self):
         """return a dict with the state of the acquisition buffers"""
@@ -422,6 +503,23 @@ class Camera(BaseCamera):
                         if not self.grabber.system.get(query.command(feature)):
                             self.log.info(f'system, {feature}, {self.grabber.system.get(feature)}')
 
+    def _update_frame_geometry(self):
+        """Query and cache the frame size, data type and software binning backend."""
+        row_count = self.grabber.remote.get("Height")
+        column_count = self.grabber.remote.get("Width")
+        dtype = np.dtype(np.uint8 if self.pixel_type == 'mono8' else np.uint16)
+        geometry = {'sensor_shape': (row_count, column_count),
+                    'frame_shape': (row_count, column_count),
+                    'dtype': dtype,
+                    'nbytes': row_count * column_count * dtype.itemsize,
+                    'downsampler': None}
+        # do software binning if != 1 and not a string for setting in egrabber
+        if self._binning > 1 and isinstance(BINNING[self._binning], int):
+            geometry['downsampler'] = best_downsampler((row_count, column_count), dtype, self._binning)
+            geometry['frame_shape'] = (row_count // self._binning, column_count // self._binning)
+        self._frame_geometry = geometry
+        self.log.debug(f"frame geometry set to: {geometry['frame_shape']} px, {dtype}")
+
     def _update_parameters(self):
         # grab min/max parameter values
         self._get_min_max_step_values()
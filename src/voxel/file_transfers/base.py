@@ -1,9 +1,90 @@
 import logging
+import os
+import shutil
 import threading
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from time import perf_counter, sleep
+from typing import TYPE_CHECKING, Optional
 from voxel.descriptors.deliminated_property import DeliminatedProperty
-from imohash import hashfile
+from voxel.file_transfers.digests import DEFAULT_ALGORITHM, file_digest
+from voxel.file_transfers.journal import VERIFIED, TransferJournal
+
+if TYPE_CHECKING:
+    # voxel.writers imports every writer, including ones with optional dependencies
+    from voxel.writers.base import BaseWriter
+
+# files smaller than this are copied in batches, one copy invocation per batch
+SMALL_FILE_MB = 64
+# largest batch of small files handed to a single copy invocation
+BATCH_MAX_FILE_COUNT = 256
+BATCH_MAX_MB = 1024
+# interval at which a transfer following a live writer checks for finished files
+FOLLOW_INTERVAL_S = 1.0
+# size of each read and write when copying byte ranges
+RANGE_BLOCK_NBYTES = 1 << 24
+# slowest sustained rate a copy may run at before it is killed, on top of the timeout
+COPY_MIN_THROUGHPUT_MB_S = 10
+# copied bytes between journal records of a file being copied, a restart resumes from the last record
+JOURNAL_CHECKPOINT_NBYTES = 1 << 30
+
+
+class BandwidthLimiter:
+    """
+    Caps the average rate of copies to one destination.\n
+    Every copy reserves the next free slot of transmission time for its\n
+    bytes and waits until the slot starts.
+
+    :param bandwidth_mb_s: Maximum rate in MB/s
+    :type bandwidth_mb_s: float
+    """
+
+    # limiters shared by all transfers writing to the same device
+    _limiters = dict()
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, bandwidth_mb_s: float):
+        self.bandwidth_mb_s = bandwidth_mb_s
+        self._lock = threading.Lock()
+        self._next_slot_s = perf_counter()
+
+    @classmethod
+    def for_destination(cls, path: Path, bandwidth_mb_s: float) -> "BandwidthLimiter":
+        """
+        Limiter shared by every transfer to the device of a path.\n
+        The most recently requested rate applies to all of them.
+
+        :param path: Destination path, need not exist yet
+        :type path: Path
+        :param bandwidth_mb_s: Maximum rate in MB/s
+        :type bandwidth_mb_s: float
+        :return: Limiter of the device
+        :rtype: BandwidthLimiter
+        """
+
+        path = Path(path).absolute()
+        while not path.exists():
+            path = path.parent
+        device = os.stat(path).st_dev
+        with cls._limiters_lock:
+            limiter = cls._limiters.setdefault(device, cls(bandwidth_mb_s))
+            limiter.bandwidth_mb_s = bandwidth_mb_s
+            return limiter
+
+    def acquire(self, size_mb: float) -> None:
+        """
+        Wait until size_mb can be sent without exceeding the rate.
+
+        :param size_mb: Size of the copy in MB
+        :type size_mb: float
+        """
+
+        with self._lock:
+            now_s = perf_counter()
+            start_s = max(now_s, self._next_slot_s)
+            self._next_slot_s = start_s + size_mb / self.bandwidth_mb_s
+        sleep(start_s - now_s)
 
 
 class BaseFileTransfer:
@@ -36,6 +117,21 @@ class BaseFileTransfer:
         self._num_tries = 1
         self._timeout_s = 60
         self._progress = 0
+        self._worker_count = 4
+        self._bandwidth_limit_mb_s = None
+        self._throughput_mb_s = 0.0
+        # MB of finished copies and of copies in flight keyed by batch, guarded by the progress lock
+        self._progress_lock = threading.Lock()
+        self._batch_local = threading.local()
+        self._start_time = None
+        self._total_size_mb = 0.0
+        self._transferred_mb = 0.0
+        self._in_flight_mb = dict()
+        # state of every file, opened on the external acquisition directory by each run
+        self._journal = None
+        self._writer = None
+        # bytes of files already copied, while following the writer or before a restart, keyed by local path
+        self._shipped_bytes = dict()
 
     @property
     @abstractmethod
@@ -191,7 +287,8 @@ class BaseFileTransfer:
     @abstractmethod
     def timeout_s(self) -> float:
         """
-        Timeout for the transfer process.
+        Timeout for the transfer process. A copy that runs longer than the\n
+        timeout plus its size at COPY_MIN_THROUGHPUT_MB_S is killed and retried.
 
         :return: Timeout in seconds
         :rtype: float
@@ -212,6 +309,97 @@ class BaseFileTransfer:
         self._timeout_s = timeout_s
         self.log.info(f"setting timeout to: {timeout_s} [s]")
 
+    @property
+    def worker_count(self) -> int:
+        """
+        Number of copies running concurrently.
+
+        :return: Number of copies
+        :rtype: int
+        """
+
+        return self._worker_count
+
+    @worker_count.setter
+    def worker_count(self, worker_count: int) -> None:
+        """
+        Number of copies running concurrently.
+
+        :param worker_count: Number of copies
+        :type worker_count: int
+        :raise ValueError: Worker count is less than 1
+        """
+
+        if worker_count < 1:
+            raise ValueError("worker count must be >= 1")
+        self._worker_count = worker_count
+        self.log.info(f"setting worker count to: {worker_count}")
+
+    @property
+    def bandwidth_limit_mb_s(self) -> Optional[float]:
+        """
+        Maximum average rate to the external device, shared by all\n
+        transfers to that device. None is unlimited.
+
+        :return: Rate in MB/s
+        :rtype: float
+        """
+
+        return self._bandwidth_limit_mb_s
+
+    @bandwidth_limit_mb_s.setter
+    def bandwidth_limit_mb_s(self, bandwidth_limit_mb_s: Optional[float]) -> None:
+        """
+        Maximum average rate to the external device, shared by all\n
+        transfers to that device. None is unlimited.
+
+        :param bandwidth_limit_mb_s: Rate in MB/s
+        :type bandwidth_limit_mb_s: float
+        :raise ValueError: Rate is not positive
+        """
+
+        if bandwidth_limit_mb_s is not None and bandwidth_limit_mb_s <= 0:
+            raise ValueError("bandwidth limit must be > 0")
+        self._bandwidth_limit_mb_s = bandwidth_limit_mb_s
+        self.log.info(f"setting bandwidth limit to: {bandwidth_limit_mb_s} [MB/s]")
+
+    @property
+    def writer(self) -> Optional["BaseWriter"]:
+        """
+        Live writer the transfer follows, None transfers once the files are written.
+
+        :return: Writer
+        :rtype: BaseWriter
+        """
+
+        return self._writer
+
+    @writer.setter
+    def writer(self, writer: Optional["BaseWriter"]) -> None:
+        """
+        Follow a live writer. Started with or before the writer, the transfer\n
+        ships the files and byte ranges the writer has finished while it\n
+        writes the next chunks, then the rest once the writer exits, and\n
+        verifies every file shipped in pieces.
+
+        :param writer: Writer writing the files of this transfer, None to not follow
+        :type writer: BaseWriter
+        """
+
+        self._writer = writer
+        self.log.info(f"setting writer to: {None if writer is None else writer.filename}")
+
+    @property
+    def throughput_mb_s(self) -> float:
+        """
+        Aggregate rate of the current or last transfer.
+
+        :return: Rate in MB/s
+        :rtype: float
+        """
+
+        return self._throughput_mb_s
+
     @DeliminatedProperty(minimum=0, maximum=100, unit='%')
     @abstractmethod
     def progress(self) -> float:
@@ -269,14 +457,13 @@ class BaseFileTransfer:
         :return: State of transfered file
         :rtype: bool
         """
-        # verifying large files with a full checksum is too time consuming
-        # verifying based on file size alone is not thorough
-        # use imohash library to perform hasing on small subset of file
-        # imohash defaults to reading 16K bits (i.e. 1<<14) from beginning, middle, and end
-        local_hash = hashfile(local_file_path, sample_size=1 << 14)
-        external_hash = hashfile(external_file_path, sample_size=1 << 14)
+
+        # full content digests, sampling parts of multi GB files misses corrupt blocks in between
+        local_hash = file_digest(local_file_path)
+        external_hash = file_digest(external_file_path)
         if local_hash == external_hash:
             self.log.info(f"{local_file_path} and {external_file_path} hashes match")
+            self._journal.record_verified(external_file_path, local_file_path, DEFAULT_ALGORITHM, external_hash)
             return True
         else:
             self.log.info(
@@ -286,9 +473,452 @@ class BaseFileTransfer:
             self.log.info(f"{external_file_path} hash = {external_hash}")
             return False
 
+    def reverify(self, full: bool = False) -> list:
+        """
+        Check the transferred files of this transfer against the digests\n
+        recorded when they were verified. The local files are gone by then,\n
+        the journal on the external disk is the reference.
+
+        :param full: Hash every file, otherwise only files changed since they were verified
+        :type full: bool
+        :return: Paths, relative to the external acquisition directory, of missing or corrupt files
+        :rtype: list
+        """
+
+        journal = TransferJournal(self._journal_path())
+        failed = journal.verify(full)
+        self.log.info(f"{self._filename}: {len(journal) - len(failed)}/{len(journal)} files verified.")
+        journal.close()
+        return failed
+
+    def _journal_path(self) -> Path:
+        """
+        Journal of this transfer, next to the external files.
+
+        :return: Path of the journal
+        :rtype: Path
+        """
+
+        return Path(self._external_path, self._acquisition_name, f"{self._filename}_journal.jsonl")
+
+    def _checkpoint(self, local_file_path: str, external_file_path: str, fd: int, offset_bytes: int) -> None:
+        """
+        Flush the copied bytes of a file to the external disk and record\n
+        them, so a restart resumes the copy from there.
+
+        :param local_file_path: Local path of the file
+        :type local_file_path: str
+        :param external_file_path: External path of the file
+        :type external_file_path: str
+        :param fd: Descriptor of the external file
+        :type fd: int
+        :param offset_bytes: Number of leading bytes copied
+        :type offset_bytes: int
+        """
+
+        os.fsync(fd)
+        self._journal.record_copying(external_file_path, local_file_path, offset_bytes)
+
+    def _list_files(self, local_directory: Path) -> dict:
+        """
+        Files of this transfer below the local acquisition directory.
+
+        :param local_directory: Local acquisition directory
+        :type local_directory: Path
+        :return: File sizes in MB keyed by absolute path
+        :rtype: dict
+        """
+
+        # path is the entire experiment path
+        # subdirs is any tile specific subdir i.e. zarr store
+        # files are any tile specific files
+        file_list = dict()
+        for path, subdirs, files in os.walk(local_directory.absolute()):
+            for name in files:
+                file_path = os.path.join(path, name)
+                if self._is_transfer_file(local_directory, file_path):
+                    file_list[file_path] = os.path.getsize(file_path) / 1024**2
+        return file_list
+
+    def _is_transfer_file(self, local_directory: Path, file_path: str) -> bool:
+        """
+        Whether a file belongs to this transfer, i.e. its name or the name\n
+        of its top level directory, e.g. a zarr store, matches the filename.
+
+        :param local_directory: Local acquisition directory
+        :type local_directory: Path
+        :param file_path: Absolute path of the file
+        :type file_path: str
+        :return: State of the file
+        :rtype: bool
+        """
+
+        return self._filename in Path(os.path.relpath(file_path, local_directory.absolute())).parts[0]
+
+    def _batch_files(self, file_list: dict) -> list:
+        """
+        Split files into copies. Large files are copied on their own, small\n
+        files of one directory are batched into a single copy invocation.
+
+        :param file_list: File sizes in MB keyed by absolute path
+        :type file_list: dict
+        :return: Batches of (directory, filenames, size in MB), largest first
+        :rtype: list
+        """
+
+        batches = list()
+        open_batches = dict()
+        for file_path, file_size_mb in sorted(file_list.items(), key=lambda item: item[1]):
+            local_dir, filename = os.path.split(file_path)
+            if file_size_mb >= SMALL_FILE_MB:
+                batches.append((local_dir, [filename], file_size_mb))
+                continue
+            batch = open_batches.get(local_dir)
+            if batch is None or len(batch[1]) >= BATCH_MAX_FILE_COUNT or batch[2] + file_size_mb > BATCH_MAX_MB:
+                batch = [local_dir, [], 0.0]
+                open_batches[local_dir] = batch
+                batches.append(batch)
+            batch[1].append(filename)
+            batch[2] += file_size_mb
+        # start the largest copies first so they do not trail at the end
+        return sorted((tuple(batch) for batch in batches), key=lambda batch: batch[2], reverse=True)
+
+    def _report_copied(self, size_mb: float) -> None:
+        """
+        Report MB moved by the copy running on this thread. Backends that\n
+        copy in process call this as they go, so progress and throughput\n
+        follow the bytes moved rather than the finished copies.
+
+        :param size_mb: Size moved since the last report in MB
+        :type size_mb: float
+        """
+
+        batch_index = self._batch_local.index
+        with self._progress_lock:
+            self._in_flight_mb[batch_index] = self._in_flight_mb.get(batch_index, 0.0) + size_mb
+            self._update_progress()
+
+    def _update_progress(self) -> None:
+        """
+        Update progress and throughput, called with the progress lock held.
+        """
+
+        copied_mb = self._transferred_mb + sum(self._in_flight_mb.values())
+        # the total is unknown while following a writer
+        self._progress = min(copied_mb / self._total_size_mb * 100, 100) if self._total_size_mb else 0
+        self._throughput_mb_s = copied_mb / (perf_counter() - self._start_time)
+
+    def _transfer_batch(
+        self, batch_index: int, local_dir: str, external_dir: str, filenames: list, size_mb: float
+    ) -> list:
+        """
+        Copy one batch, then verify and delete the local files.
+
+        :param batch_index: Index of the batch, keys the progress of the copy
+        :type batch_index: int
+        :param local_dir: Local directory of the files
+        :type local_dir: str
+        :param external_dir: External directory of the files
+        :type external_dir: str
+        :param filenames: Names of the files
+        :type filenames: list
+        :param size_mb: Total size of the files in MB
+        :type size_mb: float
+        :return: Names of the files transferred and deleted locally
+        :rtype: list
+        """
+
+        self._batch_local.index = batch_index
+        if self._bandwidth_limit_mb_s is not None:
+            BandwidthLimiter.for_destination(Path(external_dir), self._bandwidth_limit_mb_s).acquire(size_mb)
+        os.makedirs(external_dir, exist_ok=True)
+        # files partly shipped while following the writer or before a restart only need their tails
+        tails = [filename for filename in filenames if os.path.join(local_dir, filename) in self._shipped_bytes]
+        if len(tails) < len(filenames):
+            copies = [filename for filename in filenames if filename not in tails]
+            self._copy_files(local_dir, external_dir, copies)
+            for filename in copies:
+                external_file_path = os.path.join(external_dir, filename)
+                if os.path.isfile(external_file_path):
+                    local_file_path = os.path.join(local_dir, filename)
+                    # not flushed by subprocess backends, a restart verifies the file before trusting it
+                    self._journal.record_copying(
+                        external_file_path, local_file_path, os.path.getsize(local_file_path)
+                    )
+        for filename in tails:
+            local_file_path = os.path.join(local_dir, filename)
+            external_file_path = os.path.join(external_dir, filename)
+            size_bytes = os.path.getsize(local_file_path)
+            self._copy_range(local_file_path, external_file_path, self._shipped_bytes[local_file_path], size_bytes)
+            os.truncate(external_file_path, size_bytes)
+        transferred = list()
+        for filename in filenames:
+            local_file_path = os.path.join(local_dir, filename)
+            external_file_path = os.path.join(external_dir, filename)
+            # files assembled from pieces or copied before a restart are always verified
+            verify = self._verify_transfer or filename in tails
+            if not os.path.isfile(external_file_path):
+                self.log.warning(f"no external file exists at {external_file_path}")
+            elif verify and not self._verify_file(local_file_path, external_file_path):
+                # external file is corrupt, remove it and try again
+                self.log.info(f"hashes did not match, deleting {external_file_path}")
+                os.remove(external_file_path)
+                self._shipped_bytes.pop(local_file_path, None)
+            else:
+                self.log.info(f"deleting {local_file_path}")
+                os.remove(local_file_path)
+                self._shipped_bytes.pop(local_file_path, None)
+                transferred.append(filename)
+        return transferred
+
+    def _copy_range(self, local_file_path: str, external_file_path: str, start_bytes: int, end_bytes: int) -> None:
+        """
+        Copy a byte range of a file to the same range of the external file,\n
+        creating it if needed, recording checkpoints in the journal.
+
+        :param local_file_path: Local path of the file
+        :type local_file_path: str
+        :param external_file_path: External path of the file
+        :type external_file_path: str
+        :param start_bytes: Offset of the first byte
+        :type start_bytes: int
+        :param end_bytes: Offset past the last byte
+        :type end_bytes: int
+        :raise OSError: The local file ends before end_bytes
+        """
+
+        buffer = bytearray(min(RANGE_BLOCK_NBYTES, max(end_bytes - start_bytes, 1)))
+        view = memoryview(buffer)
+        # no O_TRUNC, the bytes before start_bytes were copied earlier
+        dst_fd = os.open(external_file_path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        with open(local_file_path, "rb", buffering=0) as src, open(dst_fd, "wb", buffering=0) as dst:
+            src.seek(start_bytes)
+            dst.seek(start_bytes)
+            position = start_bytes
+            checkpoint_bytes = start_bytes + JOURNAL_CHECKPOINT_NBYTES
+            while position < end_bytes:
+                count = src.readinto(view[: min(len(buffer), end_bytes - position)])
+                if not count:
+                    raise OSError(f"{local_file_path} ends at byte {position} before {end_bytes}")
+                written = 0
+                while written < count:
+                    written += dst.write(view[written:count])
+                position += count
+                self._report_copied(count / 1024**2)
+                if checkpoint_bytes <= position < end_bytes:
+                    self._checkpoint(local_file_path, external_file_path, dst.fileno(), position)
+                    checkpoint_bytes = position + JOURNAL_CHECKPOINT_NBYTES
+            self._checkpoint(local_file_path, external_file_path, dst.fileno(), end_bytes)
+
+    def _follow_writer(self, local_directory: Path, external_directory: Path) -> None:
+        """
+        Ship the files and byte ranges the writer has finished until it exits.\n
+        Whole files are verified and deleted locally as they ship, growing\n
+        files keep their local copy until the final pass.
+
+        :param local_directory: Local acquisition directory
+        :type local_directory: Path
+        :param external_directory: External acquisition directory
+        :type external_directory: Path
+        """
+
+        self.log.info(f"{self._filename}: following writer {self._writer.filename}.")
+        with ThreadPoolExecutor(max_workers=self._worker_count, thread_name_prefix="transfer") as pool:
+            while True:
+                # the process has no exit code until it is started and has exited
+                writing = self._writer._process is None or self._writer._process.exitcode is None
+                finished_files = dict()
+                ranges = dict()
+                for file_path, nbytes in self._writer.finished_files().items():
+                    if not self._is_transfer_file(local_directory, file_path) or not os.path.isfile(file_path):
+                        continue
+                    if nbytes is None:
+                        finished_files[file_path] = os.path.getsize(file_path) / 1024**2
+                    elif nbytes > self._shipped_bytes.get(file_path, 0):
+                        ranges[file_path] = nbytes
+                # files still open are shipped by the final pass
+                if not writing:
+                    break
+                futures = dict()
+                for batch_index, (local_dir, filenames, size_mb) in enumerate(self._batch_files(finished_files)):
+                    external_dir = local_dir.replace(
+                        str(local_directory.absolute()), str(external_directory.absolute())
+                    )
+                    future = pool.submit(self._transfer_batch, batch_index, local_dir, external_dir, filenames, size_mb)
+                    futures[future] = (batch_index, local_dir, filenames)
+                for batch_index, (file_path, nbytes) in enumerate(ranges.items(), start=len(futures)):
+                    external_file_path = file_path.replace(
+                        str(local_directory.absolute()), str(external_directory.absolute())
+                    )
+                    future = pool.submit(self._ship_range, batch_index, file_path, external_file_path, nbytes)
+                    futures[future] = (batch_index, file_path, None)
+                for future in as_completed(futures):
+                    batch_index, path, filenames = futures[future]
+                    try:
+                        transferred = future.result()
+                    except Exception as e:
+                        # left locally, shipped again next round or by the final pass
+                        self.log.warning(f"shipping {path} while writing failed: {e}")
+                        # nothing counted as shipped, bytes for a range and files for a batch
+                        transferred = 0 if filenames is None else list()
+                    with self._progress_lock:
+                        self._in_flight_mb.pop(batch_index, None)
+                        if filenames is None:
+                            self._transferred_mb += transferred / 1024**2
+                        else:
+                            for filename in transferred:
+                                self._transferred_mb += finished_files[os.path.join(path, filename)]
+                        self._update_progress()
+                sleep(FOLLOW_INTERVAL_S)
+
+    def _ship_range(self, batch_index: int, local_file_path: str, external_file_path: str, end_bytes: int) -> int:
+        """
+        Ship the finished bytes of a growing file not shipped yet.
+
+        :param batch_index: Index of the copy, keys the progress of the copy
+        :type batch_index: int
+        :param local_file_path: Local path of the file
+        :type local_file_path: str
+        :param external_file_path: External path of the file
+        :type external_file_path: str
+        :param end_bytes: Offset past the last finished byte
+        :type end_bytes: int
+        :return: Number of bytes shipped
+        :rtype: int
+        """
+
+        self._batch_local.index = batch_index
+        start_bytes = self._shipped_bytes.get(local_file_path, 0)
+        os.makedirs(os.path.dirname(external_file_path), exist_ok=True)
+        self._copy_range(local_file_path, external_file_path, start_bytes, end_bytes)
+        self._shipped_bytes[local_file_path] = end_bytes
+        return end_bytes - start_bytes
+
+    def _copy_timeout_s(self, local_dir: str, filenames: list) -> float:
+        """
+        Time a single copy of files may take before it counts as failed,\n
+        the timeout plus the files copied at COPY_MIN_THROUGHPUT_MB_S.
+
+        :param local_dir: Local directory of the files
+        :type local_dir: str
+        :param filenames: Names of the files
+        :type filenames: list
+        :return: Timeout in seconds
+        :rtype: float
+        """
+
+        size_mb = sum(os.path.getsize(os.path.join(local_dir, filename)) for filename in filenames) / 1024**2
+        return self._timeout_s + size_mb / COPY_MIN_THROUGHPUT_MB_S
+
     @abstractmethod
-    def _run(self):
+    def _copy_files(self, local_dir: str, external_dir: str, filenames: list) -> None:
         """
-        Internal function that runs the transfer process.
+        Copy files of one directory in a single invocation of the backend.
+
+        :param local_dir: Local directory of the files
+        :type local_dir: str
+        :param external_dir: External directory, already created
+        :type external_dir: str
+        :param filenames: Names of the files
+        :type filenames: list
+        :raise RuntimeError: The copy failed
         """
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def _run(self):
+        """
+        Internal function that runs the transfer process.\n
+        Files are copied by worker_count concurrent copies, each copy is\n
+        verified and its local files deleted as soon as it completes.\n
+        Failed files are retried up to max_retry times. Following a writer,\n
+        files are shipped while it writes first. Files the journal records\n
+        as verified by a previous run are skipped, partial copies resumed.
+        """
+
+        start_time = perf_counter()
+        local_directory = Path(self._local_path, self._acquisition_name)
+        external_directory = Path(self._external_path, self._acquisition_name)
+        self._journal = TransferJournal(self._journal_path())
+        self._journal.compact()
+        with self._progress_lock:
+            self._start_time = start_time
+            self._total_size_mb = 0.0
+            self._transferred_mb = 0.0
+            self._in_flight_mb.clear()
+            self._progress = 0
+            self._throughput_mb_s = 0.0
+        self._shipped_bytes.clear()
+        if self._writer is not None:
+            self._follow_writer(local_directory, external_directory)
+        # top level files and directories, e.g. zarr stores, to delete at the end
+        delete_list = [name for name in os.listdir(local_directory.absolute()) if self._filename in name]
+        file_list = self._list_files(local_directory)
+        for file_path in list(file_list):
+            # need to change directories to str because they are Path objects
+            external_file_path = file_path.replace(str(local_directory.absolute()), str(external_directory.absolute()))
+            entry = self._journal.resume(external_file_path, file_path)
+            if entry is None or file_path in self._shipped_bytes:
+                continue
+            if entry["state"] == VERIFIED:
+                self.log.info(f"{external_file_path} verified by a previous run, deleting {file_path}")
+                os.remove(file_path)
+                with self._progress_lock:
+                    self._transferred_mb += file_list.pop(file_path)
+            else:
+                self.log.info(f"resuming {file_path} at byte {entry['offset_bytes']}")
+                self._shipped_bytes[file_path] = entry["offset_bytes"]
+        for file_path, shipped_bytes in self._shipped_bytes.items():
+            if file_path in file_list:
+                file_list[file_path] = max(file_list[file_path] - shipped_bytes / 1024**2, 0.0)
+        with self._progress_lock:
+            self._total_size_mb = self._transferred_mb + sum(file_list.values())
+        retry_num = 0
+        while file_list and retry_num < self._max_retry:
+            batches = self._batch_files(file_list)
+            self.log.info(
+                f"attempt {retry_num + 1}/{self._max_retry}, transferring {len(file_list)} files "
+                f"in {len(batches)} copies with {self._worker_count} workers."
+            )
+            with ThreadPoolExecutor(max_workers=self._worker_count, thread_name_prefix="transfer") as pool:
+                futures = dict()
+                for batch_index, (local_dir, filenames, size_mb) in enumerate(batches):
+                    # need to change directories to str because they are Path objects
+                    external_dir = local_dir.replace(
+                        str(local_directory.absolute()), str(external_directory.absolute())
+                    )
+                    future = pool.submit(self._transfer_batch, batch_index, local_dir, external_dir, filenames, size_mb)
+                    futures[future] = (batch_index, local_dir)
+                for future in as_completed(futures):
+                    batch_index, local_dir = futures[future]
+                    try:
+                        transferred = future.result()
+                    except Exception as e:
+                        self.log.warning(f"copying files in {local_dir} failed: {e}")
+                        transferred = list()
+                    with self._progress_lock:
+                        # moved bytes of failed files no longer count
+                        self._in_flight_mb.pop(batch_index, None)
+                        for filename in transferred:
+                            self._transferred_mb += file_list.pop(os.path.join(local_dir, filename))
+                        self._update_progress()
+                    self.log.info(
+                        f"{self._filename} transfer is {self._progress:.2f} [%] complete "
+                        f"at {self._throughput_mb_s:.1f} [MB/s]."
+                    )
+            retry_num += 1
+        self._journal.close()
+        if file_list:
+            self.log.error(f"{self._filename}: {len(file_list)} files not transferred after {retry_num} attempts.")
+            return
+        # clean up the local subdirs, their files are all transferred
+        for name in delete_list:
+            local_file_path = os.path.join(local_directory.absolute(), name)
+            if os.path.isdir(local_file_path):
+                shutil.rmtree(local_file_path)
+        self._progress = 100
+        total_time = perf_counter() - start_time
+        self.log.info(
+            f"{self._filename} transfer complete, total time: {total_time:.2f} [s], "
+            f"{self._throughput_mb_s:.1f} [MB/s]"
+        )
@@ -0,0 +1,72 @@
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# size of each read when hashing a file
+HASH_BLOCK_NBYTES = 1 << 24
+
+
+def _hashers() -> dict:
+    """
+    Importable hash algorithms, fastest first.
+
+    :return: Hasher constructors keyed by algorithm name
+    :rtype: dict
+    """
+
+    hashers = dict()
+    if xxhash is not None:
+        hashers["xxh3_128"] = xxhash.xxh3_128
+    if blake3 is not None:
+        hashers["blake3"] = blake3.blake3
+    # always available, several times slower than the above
+    hashers["blake2b"] = hashlib.blake2b
+    return hashers
+
+
+HASHERS = _hashers()
+# algorithm of new digests, digests in a manifest keep the algorithm they were made with
+DEFAULT_ALGORITHM = next(iter(HASHERS))
+
+
+def new_hasher(algorithm: str = DEFAULT_ALGORITHM):
+    """
+    Incremental hasher with update and hexdigest methods.
+
+    :param algorithm: Algorithm name, one of HASHERS
+    :type algorithm: str
+    :raise ValueError: Algorithm not available
+    :return: Hasher
+    """
+
+    if algorithm not in HASHERS:
+        raise ValueError("algorithm must be one of %r." % list(HASHERS.keys()))
+    return HASHERS[algorithm]()
+
+
+def file_digest(file_path: str, algorithm: str = DEFAULT_ALGORITHM) -> str:
+    """
+    Full content digest of a file.
+
+    :param file_path: Path of the file
+    :type file_path: str
+    :param algorithm: Algorithm name, one of HASHERS
+    :type algorithm: str
+    :return: Hex digest
+    :rtype: str
+    """
+
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(HASH_BLOCK_NBYTES)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while count := f.readinto(buffer):
+            hasher.update(view[:count])
+    return hasher.hexdigest()
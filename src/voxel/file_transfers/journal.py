@@ -0,0 +1,260 @@
+import json
+import os
+import threading
+from pathlib import Path
+from time import time
+from typing import Optional
+
+from voxel.file_transfers.digests import file_digest
+
+# a file is being copied, offset_bytes of it are on the external disk
+COPYING = "copying"
+# a file is copied and its digest matches the local file
+VERIFIED = "verified"
+
+
+class TransferJournal:
+    """
+    Append only journal of the files of one transfer, one json line per\n
+    change of state, stored next to the files on the external disk.
+
+    Files are keyed by their path relative to the journal directory. Each\n
+    entry holds the state, the size and modification time of the local\n
+    file, the bytes copied, and for verified files the digest and the\n
+    size and modification time of the external file. Later lines replace\n
+    earlier ones of the same file, so a transfer restarted after a crash\n
+    resumes partial copies and skips verified files.
+
+    :param journal_path: Path of the journal file
+    :type journal_path: str
+
+    .. code-block: python
+
+        journal = TransferJournal("D:/acquisition/tile_0_journal.jsonl")
+        journal.record_copying("D:/acquisition/tile_0.raw", "C:/acquisition/tile_0.raw", 2**30)
+        journal.record_verified("D:/acquisition/tile_0.raw", "C:/acquisition/tile_0.raw", "xxh3_128", digest)
+        failed = journal.verify()
+    """
+
+    def __init__(self, journal_path: str):
+        self.journal_path = Path(journal_path)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        # kept open for appending, a transfer records every file
+        self._file = None
+
+    def _load(self) -> dict:
+        """
+        Read the journal file, skipping a line cut short by a crash.
+
+        :return: Entries keyed by relative path
+        :rtype: dict
+        """
+
+        entries = dict()
+        try:
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry["path"]] = entry
+        except OSError:
+            pass
+        return entries
+
+    def _key(self, file_path: str) -> str:
+        """
+        Journal key of a file.
+
+        :param file_path: Absolute external path of the file
+        :type file_path: str
+        :return: Path relative to the journal directory, with forward slashes
+        :rtype: str
+        """
+
+        return Path(os.path.relpath(file_path, self.journal_path.parent)).as_posix()
+
+    def __len__(self) -> int:
+        return len(self.verified())
+
+    def get(self, file_path: str) -> Optional[dict]:
+        """
+        Entry of a file.
+
+        :param file_path: Absolute external path of the file
+        :type file_path: str
+        :return: Latest entry, None if not recorded
+        :rtype: dict
+        """
+
+        return self._entries.get(self._key(file_path))
+
+    def verified(self) -> dict:
+        """
+        Entries of the verified files.
+
+        :return: Entries keyed by relative path
+        :rtype: dict
+        """
+
+        return {key: entry for key, entry in self._entries.items() if entry["state"] == VERIFIED}
+
+    def _append(self, entry: dict) -> None:
+        """
+        Add an entry and append it to the journal file.
+
+        :param entry: Entry with at least path and state
+        :type entry: dict
+        """
+
+        entry["time"] = time()
+        with self._lock:
+            self._entries[entry["path"]] = entry
+            if self._file is None:
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.journal_path, "a")
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+        Close the journal file, it is opened again by the next record.
+        """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record_copying(self, file_path: str, local_file_path: str, offset_bytes: int) -> None:
+        """
+        Record the bytes of a file on the external disk, called once they are flushed.
+
+        :param file_path: Absolute external path of the file
+        :type file_path: str
+        :param local_file_path: Absolute local path of the file
+        :type local_file_path: str
+        :param offset_bytes: Number of leading bytes copied
+        :type offset_bytes: int
+        """
+
+        stat = os.stat(local_file_path)
+        self._append(
+            {
+                "path": self._key(file_path),
+                "state": COPYING,
+                "local_size": stat.st_size,
+                "local_mtime_ns": stat.st_mtime_ns,
+                "offset_bytes": offset_bytes,
+            }
+        )
+
+    def record_verified(
+        self, file_path: str, local_file_path: Optional[str], algorithm: str, digest: str
+    ) -> None:
+        """
+        Record the digest of a verified file.
+
+        :param file_path: Absolute external path of the file
+        :type file_path: str
+        :param local_file_path: Absolute local path of the file, None if it is gone
+        :type local_file_path: str
+        :param algorithm: Algorithm of the digest
+        :type algorithm: str
+        :param digest: Hex digest
+        :type digest: str
+        """
+
+        stat = os.stat(file_path)
+        entry = {
+            "path": self._key(file_path),
+            "state": VERIFIED,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "algorithm": algorithm,
+            "digest": digest,
+        }
+        if local_file_path is not None:
+            local_stat = os.stat(local_file_path)
+            entry["local_size"] = local_stat.st_size
+            entry["local_mtime_ns"] = local_stat.st_mtime_ns
+        self._append(entry)
+
+    def resume(self, file_path: str, local_file_path: str) -> Optional[dict]:
+        """
+        Entry of a file a previous run left behind, if it still applies.\n
+        It applies if the local file is unchanged since and the external\n
+        file holds at least the bytes recorded.
+
+        :param file_path: Absolute external path of the file
+        :type file_path: str
+        :param local_file_path: Absolute local path of the file
+        :type local_file_path: str
+        :return: Entry, None to copy the file from the start
+        :rtype: dict
+        """
+
+        entry = self.get(file_path)
+        if entry is None or "local_size" not in entry:
+            return None
+        try:
+            local_stat = os.stat(local_file_path)
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if local_stat.st_size != entry["local_size"] or local_stat.st_mtime_ns != entry["local_mtime_ns"]:
+            return None
+        if entry["state"] == VERIFIED:
+            unchanged = stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+            return entry if unchanged else None
+        return entry if stat.st_size >= entry["offset_bytes"] else None
+
+    def compact(self) -> None:
+        """
+        Rewrite the journal with the latest entry of every file only.
+        """
+
+        self.close()
+        with self._lock:
+            if not self.journal_path.exists():
+                return
+            # write and rename so a crash never leaves a partial journal
+            temp_path = self.journal_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, "w") as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.journal_path)
+
+    def verify(self, full: bool = False) -> list:
+        """
+        Check the verified files against their digests.
+
+        :param full: Hash every file, otherwise only files whose size or\n
+        modification time changed since they were verified
+        :type full: bool
+        :raise ValueError: A digest was made with an algorithm not available here
+        :return: Relative paths of missing files and files whose digest differs
+        :rtype: list
+        """
+
+        failed = list()
+        for key, entry in self.verified().items():
+            file_path = self.journal_path.parent / key
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                failed.append(key)
+                continue
+            unchanged = stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+            if unchanged and not full:
+                continue
+            if file_digest(file_path, entry["algorithm"]) != entry["digest"]:
+                failed.append(key)
+            elif not unchanged:
+                # same content, e.g. touched by a backup tool, skip it next time
+                self.record_verified(str(file_path), None, entry["algorithm"], entry["digest"])
+        return failed
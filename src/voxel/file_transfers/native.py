@@ -0,0 +1,376 @@
+import errno
+import mmap
+import os
+from typing import Callable, Optional
+
+from voxel.file_transfers.base import JOURNAL_CHECKPOINT_NBYTES, BaseFileTransfer
+from voxel.file_transfers.digests import DEFAULT_ALGORITHM, new_hasher
+
+# size of each read and write, large blocks keep both disks streaming
+BLOCK_NBYTES = 1 << 25
+# offset, size and memory alignment required by O_DIRECT on common filesystems
+DIRECT_IO_ALIGNMENT_BYTES = 4096
+
+
+class NativeFileTransfer(BaseFileTransfer):
+    """
+    Voxel driver for an in process file transfer, without rsync or robocopy.
+
+    Files are copied by the kernel with copy_file_range or sendfile where\n
+    possible, otherwise through large page aligned buffers, optionally with\n
+    O_DIRECT to bypass the page cache. With verify_transfer and O_DIRECT the\n
+    source blocks and the blocks read back from the destination are hashed\n
+    while copying, so files are not read again after the copy. Without\n
+    O_DIRECT a read back would be served from the page cache and prove\n
+    nothing, so the external file is dropped from the cache after it is\n
+    flushed and hashed again after the copy. Dropping it needs\n
+    posix_fadvise, elsewhere, e.g. on windows, that hash may still be\n
+    served from the cache.
+
+    Process will transfer files with the following regex
+    format:
+
+    From -> \\\\local_path\\\\acquisition_name\\\\filename*
+    To -> \\\\external_path\\\\acquisition_name\\\\filename*
+
+    :param external_path: External path of files to be transferred
+    :param local_path: Local path of files to be transferred
+    :type external_path: str
+    :type local_path: str
+    """
+
+    def __init__(self, external_path: str, local_path: str):
+        super().__init__(external_path, local_path)
+        self._protocol = "native"
+        self._direct_io = False
+        # digests of external files verified while copying with O_DIRECT, their check after the copy is skipped
+        self._copied_digests = dict()
+
+    @property
+    def direct_io(self) -> bool:
+        """
+        Whether destination files are written with O_DIRECT.
+
+        :return: Direct io state
+        :rtype: bool
+        """
+
+        return self._direct_io
+
+    @direct_io.setter
+    def direct_io(self, direct_io: bool) -> None:
+        """
+        Write destination files with O_DIRECT where supported, bypassing\n
+        the page cache so large transfers do not evict acquisition data.
+
+        :param direct_io: Direct io state
+        :type direct_io: bool
+        """
+
+        self.log.info(f"setting direct io to: {direct_io}")
+        self._direct_io = direct_io
+
+    def _copy_files(self, local_dir: str, external_dir: str, filenames: list) -> None:
+        """
+        Copy files of one directory one after the other.
+
+        :param local_dir: Local directory of the files
+        :type local_dir: str
+        :param external_dir: External directory, already created
+        :type external_dir: str
+        :param filenames: Names of the files
+        :type filenames: list
+        :raise OSError: A file could not be read or written
+        """
+
+        # anonymous mmaps are page aligned, as O_DIRECT requires
+        buffer = mmap.mmap(-1, BLOCK_NBYTES)
+        check_buffer = mmap.mmap(-1, BLOCK_NBYTES) if self._verify_transfer else None
+        try:
+            for filename in filenames:
+                self._copy_file(
+                    os.path.join(local_dir, filename), os.path.join(external_dir, filename), buffer, check_buffer
+                )
+        finally:
+            buffer.close()
+            if check_buffer is not None:
+                check_buffer.close()
+
+    def _copy_file(
+        self, local_file_path: str, external_file_path: str, buffer: mmap.mmap, check_buffer: Optional[mmap.mmap]
+    ) -> None:
+        """
+        Copy one file and flush it to the external disk.\n
+        A file failing verification is removed, so it is retried.
+
+        :param local_file_path: Local path of the file
+        :type local_file_path: str
+        :param external_file_path: External path of the file
+        :type external_file_path: str
+        :param buffer: Block buffer
+        :type buffer: mmap.mmap
+        :param check_buffer: Buffer blocks written with O_DIRECT are read back into, None skips verification
+        :type check_buffer: mmap.mmap
+        """
+
+        size_bytes = os.path.getsize(local_file_path)
+        src_fd = os.open(local_file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            dst_fd, direct_io = self._open_destination(external_file_path, check_buffer is not None)
+
+            def checkpoint(offset_bytes: int):
+                self._checkpoint(local_file_path, external_file_path, dst_fd, offset_bytes)
+
+            # blocks read back without O_DIRECT come from the page cache, those files are verified after the copy
+            check_buffer = check_buffer if direct_io else None
+            digests = None
+            try:
+                self._preallocate(dst_fd, size_bytes)
+                # the kernel copies without passing the data through python, but cannot bypass the cache
+                if direct_io or not self._kernel_copy(src_fd, dst_fd, size_bytes, checkpoint):
+                    digests = self._buffer_copy(
+                        src_fd, dst_fd, size_bytes, direct_io, buffer, check_buffer, checkpoint
+                    )
+                    if direct_io:
+                        # the last block was padded to the alignment
+                        os.ftruncate(dst_fd, size_bytes)
+                    if digests is not None and digests[0] != digests[1]:
+                        self.log.warning(f"{external_file_path} does not match {local_file_path}, deleting it")
+                        os.close(dst_fd)
+                        dst_fd = None
+                        os.remove(external_file_path)
+                        return
+                # the local file is deleted after the copy, the external file must be on disk by then
+                os.fsync(dst_fd)
+                if not direct_io and self._verify_transfer and hasattr(os, "posix_fadvise"):
+                    # drop the cached pages, so the verification after the copy reads the disk
+                    os.posix_fadvise(dst_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                if dst_fd is not None:
+                    os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        if digests is not None:
+            self._copied_digests[external_file_path] = digests[1]
+
+    def _open_destination(self, external_file_path: str, readable: bool) -> tuple:
+        """
+        Open a destination file, with O_DIRECT if requested and supported.
+
+        :param external_file_path: External path of the file
+        :type external_file_path: str
+        :param readable: Open for reading too, to verify written blocks
+        :type readable: bool
+        :return: File descriptor and whether O_DIRECT is in use
+        :rtype: tuple
+        """
+
+        flags = (os.O_RDWR if readable else os.O_WRONLY) | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        if self._direct_io and hasattr(os, "O_DIRECT"):
+            try:
+                return os.open(external_file_path, flags | os.O_DIRECT), True
+            except OSError:
+                # e.g. tmpfs and some network filesystems reject O_DIRECT
+                pass
+        return os.open(external_file_path, flags), False
+
+    def _preallocate(self, fd: int, size_bytes: int) -> None:
+        """
+        Reserve the space of a file up front, so the filesystem lays it\n
+        out contiguously and a full disk fails before copying.
+
+        :param fd: Destination file descriptor
+        :type fd: int
+        :param size_bytes: File size in bytes
+        :type size_bytes: int
+        """
+
+        if size_bytes and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size_bytes)
+            except OSError as e:
+                # some filesystems do not support preallocation, a full disk still fails
+                if e.errno == errno.ENOSPC:
+                    raise
+                self.log.debug(f"preallocation not supported: {e}")
+
+    def _kernel_copy(self, src_fd: int, dst_fd: int, size_bytes: int, checkpoint: Callable) -> bool:
+        """
+        Copy a file within the kernel with copy_file_range or sendfile.
+
+        :param src_fd: Source file descriptor
+        :type src_fd: int
+        :param dst_fd: Destination file descriptor
+        :type dst_fd: int
+        :param size_bytes: File size in bytes
+        :type size_bytes: int
+        :param checkpoint: Flushes and records the bytes copied so far
+        :type checkpoint: Callable
+        :raise OSError: The copy failed after moving data
+        :return: False if neither call is supported for these files
+        :rtype: bool
+        """
+
+        for method in ("copy_file_range", "sendfile"):
+            if not hasattr(os, method):
+                continue
+            offset_bytes = 0
+            checkpoint_bytes = JOURNAL_CHECKPOINT_NBYTES
+            try:
+                while offset_bytes < size_bytes:
+                    count = min(BLOCK_NBYTES, size_bytes - offset_bytes)
+                    if method == "copy_file_range":
+                        moved = os.copy_file_range(src_fd, dst_fd, count, offset_bytes, offset_bytes)
+                    else:
+                        os.lseek(dst_fd, offset_bytes, os.SEEK_SET)
+                        moved = os.sendfile(dst_fd, src_fd, offset_bytes, count)
+                    if moved == 0:
+                        raise OSError(f"{method} stopped at byte {offset_bytes} of {size_bytes}")
+                    offset_bytes += moved
+                    self._report_copied(moved / 1024**2)
+                    if checkpoint_bytes <= offset_bytes < size_bytes:
+                        checkpoint(offset_bytes)
+                        checkpoint_bytes = offset_bytes + JOURNAL_CHECKPOINT_NBYTES
+            except OSError:
+                # e.g. copies across filesystems on older kernels, or sendfile to a file on macos
+                if offset_bytes > 0:
+                    raise
+                continue
+            return True
+        return size_bytes == 0
+
+    def _buffer_copy(
+        self,
+        src_fd: int,
+        dst_fd: int,
+        size_bytes: int,
+        direct_io: bool,
+        buffer: mmap.mmap,
+        check_buffer: Optional[mmap.mmap],
+        checkpoint: Callable,
+    ) -> Optional[tuple]:
+        """
+        Copy a file block by block through a buffer. If a check buffer is\n
+        given every block is read back from the destination, and the source\n
+        and destination blocks are hashed. The read back only reaches the\n
+        disk with O_DIRECT, callers pass a check buffer only then.
+
+        :param src_fd: Source file descriptor
+        :type src_fd: int
+        :param dst_fd: Destination file descriptor
+        :type dst_fd: int
+        :param size_bytes: File size in bytes
+        :type size_bytes: int
+        :param direct_io: Destination is opened with O_DIRECT
+        :type direct_io: bool
+        :param buffer: Block buffer
+        :type buffer: mmap.mmap
+        :param check_buffer: Buffer blocks are read back into, None skips verification
+        :type check_buffer: mmap.mmap
+        :param checkpoint: Flushes and records the bytes copied so far
+        :type checkpoint: Callable
+        :return: Digests of the source and the destination, None without check buffer
+        :rtype: tuple
+        """
+
+        data = memoryview(buffer)
+        check = memoryview(check_buffer) if check_buffer is not None else None
+        src_hasher = new_hasher()
+        dst_hasher = new_hasher()
+        try:
+            offset_bytes = 0
+            checkpoint_bytes = JOURNAL_CHECKPOINT_NBYTES
+            while offset_bytes < size_bytes:
+                count = _pread_into(src_fd, data[: min(BLOCK_NBYTES, size_bytes - offset_bytes)], offset_bytes)
+                if count == 0:
+                    raise OSError(f"source ended at byte {offset_bytes} of {size_bytes}")
+                # O_DIRECT writes whole aligned blocks, the padding is truncated at the end
+                write_count = -(-count // DIRECT_IO_ALIGNMENT_BYTES) * DIRECT_IO_ALIGNMENT_BYTES if direct_io else count
+                _pwrite_all(dst_fd, data[:write_count], offset_bytes)
+                if check is not None:
+                    read_count = _pread_into(dst_fd, check[:write_count], offset_bytes)
+                    src_hasher.update(data[:count])
+                    dst_hasher.update(check[: min(count, read_count)])
+                offset_bytes += count
+                self._report_copied(count / 1024**2)
+                if checkpoint_bytes <= offset_bytes < size_bytes:
+                    checkpoint(offset_bytes)
+                    checkpoint_bytes = offset_bytes + JOURNAL_CHECKPOINT_NBYTES
+            if check is None:
+                return None
+            return src_hasher.hexdigest(), dst_hasher.hexdigest()
+        finally:
+            data.release()
+            if check is not None:
+                check.release()
+
+    def _verify_file(self, local_file_path: str, external_file_path: str) -> bool:
+        """
+        Files verified while copying with O_DIRECT pass without reading them\n
+        again, all other files are hashed again.
+
+        :param local_file_path: Local path of files
+        :type local_file_path: str
+        :param external_file_path: External path of files
+        :type external_file_path: str
+        :return: State of transfered file
+        :rtype: bool
+        """
+
+        digest = self._copied_digests.pop(external_file_path, None)
+        if digest is not None:
+            self.log.info(f"{external_file_path} verified while copying")
+            self._journal.record_verified(external_file_path, local_file_path, DEFAULT_ALGORITHM, digest)
+            return True
+        return super()._verify_file(local_file_path, external_file_path)
+
+
+def _pread_into(fd: int, view: memoryview, offset_bytes: int) -> int:
+    """
+    Read into a buffer at an offset until it is full or the file ends.
+
+    :param fd: File descriptor
+    :type fd: int
+    :param view: Buffer to fill
+    :type view: memoryview
+    :param offset_bytes: File offset
+    :type offset_bytes: int
+    :return: Number of bytes read
+    :rtype: int
+    """
+
+    position = 0
+    while position < len(view):
+        if hasattr(os, "preadv"):
+            count = os.preadv(fd, [view[position:]], offset_bytes + position)
+        else:
+            # no positional reads into buffers on windows, the file is only used by this thread
+            os.lseek(fd, offset_bytes + position, os.SEEK_SET)
+            chunk = os.read(fd, len(view) - position)
+            count = len(chunk)
+            view[position : position + count] = chunk
+        if count == 0:
+            break
+        position += count
+    return position
+
+
+def _pwrite_all(fd: int, view: memoryview, offset_bytes: int) -> None:
+    """
+    Write a whole buffer at an offset.
+
+    :param fd: File descriptor
+    :type fd: int
+    :param view: Buffer to write
+    :type view: memoryview
+    :param offset_bytes: File offset
+    :type offset_bytes: int
+    """
+
+    position = 0
+    while position < len(view):
+        if hasattr(os, "pwrite"):
+            position += os.pwrite(fd, view[position:], offset_bytes + position)
+        else:
+            os.lseek(fd, offset_bytes + position, os.SEEK_SET)
+            position += os.write(fd, view[position:])
@@ -25,3 +25,28 @@ class BaseDownSample():
         :type image: numpy.array
         """
         pass
+
+    def run_pyramid(self, image: numpy.array, levels: int) -> list:
+        """
+        Downsample an image into a pyramid of levels.
+
+        Level n is the image binned n times. By default each level is\n
+        binned from the previous level with run, backends that can\n
+        produce all levels in one pass over the image override this.
+
+        :param image: Input image
+        :type image: numpy.array
+        :param levels: Number of downsampled levels
+        :type levels: int
+        :raise ValueError: Number of levels is less than 1
+        :return: Downsampled levels 1 to levels
+        :rtype: list
+        """
+
+        if levels < 1:
+            raise ValueError("levels must be >= 1")
+        pyramid = list()
+        for _ in range(levels):
+            image = self.run(image)
+            pyramid.append(image)
+        return pyramid
@@ -0,0 +1,329 @@
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from numbers import Number
+from typing import Optional, Union
+
+import numpy
+
+METHODS = ("mean", "max", "min", "rank")
+# target size of the tiles swept by downsample_pyramid, small enough that a tile
+# and its binned levels stay in the l2 cache while they are reduced
+PYRAMID_TILE_BYTES = 1 << 20
+# accumulators kept per thread, one per level of a pyramid tile
+MAX_ACCUMULATORS = 16
+
+# per thread accumulators, reused across calls with the same slab shape
+_accumulators = threading.local()
+
+
+def normalize_binning(binning: Union[int, tuple], ndim: int) -> tuple:
+    """
+    Expand a binning factor to one integer factor per axis.
+
+    :param binning: Binning factor, or one factor per axis
+    :type binning: int or tuple
+    :param ndim: Number of axes
+    :type ndim: int
+    :raise ValueError: Invalid binning factor
+    :return: Binning factor per axis
+    :rtype: tuple
+    """
+
+    if isinstance(binning, Number):
+        binning = (int(binning),) * ndim
+    binning = tuple(int(factor) for factor in binning)
+    if len(binning) != ndim:
+        raise ValueError(f"binning must be an int or a tuple of {ndim} ints")
+    if any(factor < 1 for factor in binning):
+        raise ValueError("binning factors must be >= 1")
+    return binning
+
+
+def accumulator_dtype(dtype: numpy.dtype, count: int) -> numpy.dtype:
+    """
+    Data type wide enough to sum count values of dtype without overflow.
+
+    :param dtype: Data type of the image
+    :type dtype: numpy.dtype
+    :param count: Number of values summed per output pixel
+    :type count: int
+    :return: Accumulator data type
+    :rtype: numpy.dtype
+    """
+
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == "f":
+        return numpy.dtype(numpy.float64)
+    if dtype.kind == "b":
+        dtype = numpy.dtype(numpy.uint8)
+    bits = dtype.itemsize * 8 + int(count - 1).bit_length()
+    if dtype.kind == "u":
+        return numpy.dtype(numpy.uint32 if bits <= 32 else numpy.uint64)
+    return numpy.dtype(numpy.int32 if bits < 32 else numpy.int64)
+
+
+def output_shape(shape: tuple, binning: tuple) -> tuple:
+    """
+    Shape of a downsampled image, remainders that do not fill a bin are dropped.
+
+    :param shape: Shape of the image
+    :type shape: tuple
+    :param binning: Binning factor per axis
+    :type binning: tuple
+    :return: Downsampled shape
+    :rtype: tuple
+    """
+
+    return tuple(size // factor for size, factor in zip(shape, binning))
+
+
+def _accumulator(shape: tuple, dtype: numpy.dtype) -> numpy.ndarray:
+    """
+    Zeroed accumulator of the calling thread.
+
+    :param shape: Shape of the accumulator
+    :type shape: tuple
+    :param dtype: Data type of the accumulator
+    :type dtype: numpy.dtype
+    :return: Accumulator
+    :rtype: numpy.ndarray
+    """
+
+    key = (shape, dtype)
+    buffers = getattr(_accumulators, "buffers", None)
+    if buffers is None:
+        buffers = _accumulators.buffers = dict()
+    if key not in buffers:
+        # drop old shapes so changing slab sizes do not pile up memory
+        if len(buffers) >= MAX_ACCUMULATORS:
+            buffers.clear()
+        buffers[key] = numpy.empty(shape, dtype)
+    buffers[key].fill(0)
+    return buffers[key]
+
+
+def _downsample_slab(image: numpy.ndarray, binning: tuple, method: str, rank: int, out: numpy.ndarray):
+    """
+    Downsample an image already cropped to a multiple of the binning.
+
+    Every offset within a bin is a strided view with the shape of the\n
+    output, so each pass reads the input once and writes output sized data.
+
+    :param image: Cropped image
+    :type image: numpy.ndarray
+    :param binning: Binning factor per axis
+    :type binning: tuple
+    :param method: Downsampling method
+    :type method: str
+    :param rank: Rank of the value kept by the rank method
+    :type rank: int
+    :param out: Output
+    :type out: numpy.ndarray
+    """
+
+    views = (
+        image[tuple(slice(offset, None, factor) for offset, factor in zip(offsets, binning))]
+        for offsets in itertools.product(*(range(factor) for factor in binning))
+    )
+    if method == "mean":
+        count = int(numpy.prod(binning))
+        accumulator = _accumulator(out.shape, accumulator_dtype(image.dtype, count))
+        for view in views:
+            numpy.add(accumulator, view, out=accumulator)
+        if accumulator.dtype.kind == "f":
+            numpy.divide(accumulator, count, out=accumulator)
+        else:
+            numpy.floor_divide(accumulator, count, out=accumulator)
+        numpy.copyto(out, accumulator, casting="unsafe")
+    elif method in ("max", "min"):
+        ufunc = numpy.maximum if method == "max" else numpy.minimum
+        numpy.copyto(out, next(views))
+        for view in views:
+            ufunc(out, view, out=out)
+    else:
+        stack = numpy.empty((int(numpy.prod(binning)),) + out.shape, image.dtype)
+        for index, view in enumerate(views):
+            stack[index] = view
+        stack.partition(rank, axis=0)
+        numpy.copyto(out, stack[rank])
+
+
+def downsample(
+    image: numpy.ndarray,
+    binning: tuple,
+    method: str = "mean",
+    rank: Optional[int] = None,
+    out: Optional[numpy.ndarray] = None,
+    worker_count: int = 1,
+) -> numpy.ndarray:
+    """
+    Downsample an image by an integer factor per axis.
+
+    Mean sums in a wider data type so it cannot overflow, and rounds down.\n
+    Work is split into slabs along the first axis, one per worker thread;\n
+    numpy releases the gil so slabs run in parallel.
+
+    :param image: Input image
+    :type image: numpy.ndarray
+    :param binning: Binning factor per axis
+    :type binning: tuple
+    :param method: Downsampling method, one of METHODS
+    :type method: str
+    :param rank: Rank of the value kept by the rank method, None for the median
+    :type rank: int
+    :param out: Preallocated output, allocated if None
+    :type out: numpy.ndarray
+    :param worker_count: Number of threads
+    :type worker_count: int
+    :raise ValueError: Invalid method or output shape
+    :return: Downsampled image
+    :rtype: numpy.ndarray
+    """
+
+    if method not in METHODS:
+        raise ValueError("method must be one of %r." % list(METHODS))
+    shape = output_shape(image.shape, binning)
+    if out is None:
+        out = numpy.empty(shape, image.dtype)
+    elif out.shape != shape:
+        raise ValueError(f"output shape {out.shape} does not match downsampled shape {shape}")
+    count = int(numpy.prod(binning))
+    rank = count // 2 if rank is None else rank % count
+    image = image[tuple(slice(0, size * factor) for size, factor in zip(shape, binning))]
+    slab_count = max(1, min(worker_count, shape[0]))
+    edges = numpy.linspace(0, shape[0], slab_count + 1).astype(int)
+    slabs = [
+        (image[start * binning[0]:end * binning[0]], binning, method, rank, out[start:end])
+        for start, end in zip(edges[:-1], edges[1:])
+    ]
+    if slab_count == 1:
+        _downsample_slab(*slabs[0])
+    else:
+        with ThreadPoolExecutor(max_workers=slab_count) as pool:
+            for _ in pool.map(lambda slab: _downsample_slab(*slab), slabs):
+                pass
+    return out
+
+
+def _pyramid_tile(
+    image: numpy.ndarray, starts: tuple, steps: tuple, binning: tuple, method: str, rank: int, outs: list
+):
+    """
+    Bin one tile through every level of a pyramid.
+
+    Tiles start on multiples of the coarsest bin, so every level of the\n
+    tile lands on whole output pixels. Each level is binned from the\n
+    previous level while it is still in cache.
+
+    :param image: Input image
+    :type image: numpy.ndarray
+    :param starts: Start of the tile along all but the last axis
+    :type starts: tuple
+    :param steps: Size of the tile along all but the last axis
+    :type steps: tuple
+    :param binning: Binning factor per axis
+    :type binning: tuple
+    :param method: Downsampling method
+    :type method: str
+    :param rank: Rank of the value kept by the rank method
+    :type rank: int
+    :param outs: Output of every level
+    :type outs: list
+    """
+
+    starts = starts + (0,)
+    tile = image[tuple(slice(start, start + step) for start, step in zip(starts, steps))]
+    for level, out in enumerate(outs, start=1):
+        shape = output_shape(tile.shape, binning)
+        if 0 in shape:
+            break
+        region = out[
+            tuple(
+                slice(start // factor**level, start // factor**level + size)
+                for start, factor, size in zip(starts, binning, shape)
+            )
+        ]
+        _downsample_slab(
+            tile[tuple(slice(0, size * factor) for size, factor in zip(shape, binning))], binning, method, rank, region
+        )
+        tile = region
+
+
+def downsample_pyramid(
+    image: numpy.ndarray,
+    binning: tuple,
+    levels: int,
+    method: str = "mean",
+    rank: Optional[int] = None,
+    worker_count: int = 1,
+) -> list:
+    """
+    Downsample an image into several levels in a single sweep.
+
+    Level n is the image binned n times, each level binned from the\n
+    previous one exactly as repeated calls to downsample would. The image\n
+    is swept once in tiles of about PYRAMID_TILE_BYTES that are carried\n
+    through all levels, so only the input is read from memory once instead\n
+    of every level being read back. Tiles are split over worker threads.
+
+    :param image: Input image
+    :type image: numpy.ndarray
+    :param binning: Binning factor per axis
+    :type binning: tuple
+    :param levels: Number of downsampled levels
+    :type levels: int
+    :param method: Downsampling method, one of METHODS
+    :type method: str
+    :param rank: Rank of the value kept by the rank method, None for the median
+    :type rank: int
+    :param worker_count: Number of threads
+    :type worker_count: int
+    :raise ValueError: Invalid method or number of levels
+    :return: Downsampled levels 1 to levels
+    :rtype: list
+    """
+
+    if method not in METHODS:
+        raise ValueError("method must be one of %r." % list(METHODS))
+    if levels < 1:
+        raise ValueError("levels must be >= 1")
+    count = int(numpy.prod(binning))
+    rank = count // 2 if rank is None else rank % count
+    outs = list()
+    shape = image.shape
+    for _ in range(levels):
+        shape = output_shape(shape, binning)
+        outs.append(numpy.empty(shape, image.dtype))
+    if image.ndim < 2:
+        _pyramid_tile(image, (), (), binning, method, rank, outs)
+        return outs
+    # tiles span whole bins of the coarsest level along all but the last axis,
+    # the innermost tiled axis is grown until the tile reaches the target size
+    steps = [factor**levels for factor in binning[:-1]]
+    line_bytes = int(numpy.prod(steps)) * image.shape[-1] * image.itemsize
+    steps[-1] *= max(1, PYRAMID_TILE_BYTES // max(1, line_bytes))
+    tiles = [
+        (image, starts, tuple(steps), binning, method, rank, outs)
+        for starts in itertools.product(*(range(0, size, step) for size, step in zip(image.shape, steps)))
+    ]
+    if worker_count <= 1 or len(tiles) == 1:
+        for tile in tiles:
+            _pyramid_tile(*tile)
+    else:
+        with ThreadPoolExecutor(max_workers=min(worker_count, len(tiles))) as pool:
+            for _ in pool.map(lambda tile: _pyramid_tile(*tile), tiles):
+                pass
+    return outs
+
+
+def default_worker_count() -> int:
+    """
+    Number of threads used when none is given.
+
+    :return: Number of threads
+    :rtype: int
+    """
+
+    return os.cpu_count() or 1
@@ -1,37 +1,74 @@
+from typing import Optional, Union
+
 import numpy
 
 from voxel.processes.downsample.base import BaseDownSample
+from voxel.processes.downsample.cpu.numpy.binning import (
+    METHODS,
+    default_worker_count,
+    downsample,
+    downsample_pyramid,
+    normalize_binning,
+)
 
 
 class NPDownSample2D(BaseDownSample):
     """
     Voxel 2D downsampling with numpy.
 
-    :param binning: Binning factor
-    :type binning: int
-    :raise ValueError: Invalid binning factor
+    :param binning: Binning factor, or one factor per (y, x) axis
+    :type binning: int or tuple
+    :param method: Downsampling method (mean, max, min or rank)
+    :type method: str
+    :param rank: Rank of the value kept by the rank method, None for the median
+    :type rank: int
+    :param worker_count: Number of threads splitting the image into row slabs,\n
+    None for one per core
+    :type worker_count: int
+    :raise ValueError: Invalid binning factor or method
     """
 
-    def __init__(self, binning: int):
+    def __init__(
+        self,
+        binning: Union[int, tuple],
+        method: str = "mean",
+        rank: Optional[int] = None,
+        worker_count: Optional[int] = None,
+    ):
         super().__init__(binning)
         # downscaling factor
-        if binning != 2:
-            raise ValueError("cpu downsampling only supports binning=2")
+        self._binning = normalize_binning(binning, 2)
+        if method not in METHODS:
+            raise ValueError("method must be one of %r." % list(METHODS))
+        self._method = method
+        self._rank = rank
+        self._worker_count = default_worker_count() if worker_count is None else worker_count
 
-    def run(self, image: numpy.array):
+    def run(self, image: numpy.array, out: Optional[numpy.array] = None):
         """
         Run function for image downsampling.
 
         :param image: Input image
         :type image: numpy.array
+        :param out: Preallocated output, allocated if None
+        :type out: numpy.array
         :return: Downsampled image
         :rtype: numpy.array
         """
 
-        downsampled_image = (
-            image[0::2, 0::2]
-            + image[1::2, 0::2]
-            + image[0::2, 1::2]
-            + image[1::2, 1::2]
-        ) // 4
-        return downsampled_image
+        return downsample(image, self._binning, self._method, self._rank, out, self._worker_count)
+
+    def run_pyramid(self, image: numpy.array, levels: int) -> list:
+        """
+        Downsample an image into a pyramid of levels in a single sweep.
+
+        :param image: Input image
+        :type image: numpy.array
+        :param levels: Number of downsampled levels
+        :type levels: int
+        :raise ValueError: Number of levels is less than 1
+        :return: Downsampled levels 1 to levels
+        :rtype: list
+        """
+
+        return downsample_pyramid(image, self._binning, levels, self._method, self._rank, self._worker_count)
@@ -29,4 +29,4 @@ class CucimDownSample2D(BaseDownSample):
         # convert numpy to cupy array
         image = cupy.asarray(image)
         downsampled_image = downscale_local_mean(image, factors=(self._binning, self._binning))
-        return downsampled_image
\ No newline at end of file
+        return cupy.asnumpy(downsampled_image)
\ No newline at end of file
@@ -0,0 +1,317 @@
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+import numpy
+
+from voxel.processes.downsample.base import BaseDownSample
+
+# benchmark results of best_downsampler, shared by all processes on the machine
+CACHE_PATH = Path(os.environ.get("VOXEL_CACHE_DIR", Path.home() / ".voxel"), "downsample_backends.json")
+# timed runs per backend after a warm up run, the fastest run is kept
+BENCHMARK_REPEATS = 3
+# largest sample image benchmarked, frames along z and pixels along y and x, results hold for larger images
+BENCHMARK_MAX_FRAMES = 4
+BENCHMARK_MAX_XY_PX = 2048
+# bins per (z, y, x) axis of the sample image used to check each backend against numpy
+VALIDATION_BIN_COUNT_PX = (4, 6, 10)
+# largest difference to numpy, backends may round the mean instead of flooring
+VALIDATION_TOLERANCE = 1
+# backend used when no other backend is usable, always importable
+FALLBACK_BACKEND = "numpy"
+
+# backend name -> (module, class) per number of dimensions, in order of preference on ties
+DOWNSAMPLERS = {
+    2: {
+        "numpy": ("voxel.processes.downsample.cpu.numpy.downsample_2d", "NPDownSample2D"),
+        "tensorstore": ("voxel.processes.downsample.cpu.tensorstore.downsample_2d", "TSDownSample2D"),
+        "gputools": ("voxel.processes.downsample.gpu.gputools.downsample_2d", "GPUToolsDownSample2D"),
+        "clesperanto": ("voxel.processes.downsample.gpu.clesperanto.downsample_2d", "CLEDownSample2D"),
+        "cucim": ("voxel.processes.downsample.gpu.cucim.downsample_2d", "CucimDownSample2D"),
+    },
+    3: {
+        "numpy": ("voxel.processes.downsample.cpu.numpy.downsample_3d", "NPDownSample3D"),
+        "tensorstore": ("voxel.processes.downsample.cpu.tensorstore.downsample_3d", "TSDownSample3D"),
+        "gputools": ("voxel.processes.downsample.gpu.gputools.downsample_3d", "GPUToolsDownSample3D"),
+        "clesperanto": ("voxel.processes.downsample.gpu.clesperanto.downsample_3d", "CLEDownSample3D"),
+        "cucim": ("voxel.processes.downsample.gpu.cucim.downsample_3d", "CucimDownSample3D"),
+    },
+}
+
+log = logging.getLogger(__name__)
+_lock = threading.Lock()
+# backend names picked in this process, keyed like the cache file
+_selected = dict()
+
+
+def register_downsampler(name: str, ndim: int, module: str, class_name: str) -> None:
+    """
+    Register a downsampling backend.
+
+    The class is imported lazily and constructed with a single binning\n
+    argument, its run method must return a numpy array.
+
+    :param name: Backend name
+    :type name: str
+    :param ndim: Number of image dimensions, 2 or 3
+    :type ndim: int
+    :param module: Module of the class
+    :type module: str
+    :param class_name: Name of a BaseDownSample subclass
+    :type class_name: str
+    :raise ValueError: Invalid number of dimensions
+    """
+
+    if ndim not in DOWNSAMPLERS:
+        raise ValueError("ndim must be one of %r." % list(DOWNSAMPLERS.keys()))
+    DOWNSAMPLERS[ndim][name] = (module, class_name)
+
+
+def create_downsampler(name: str, ndim: int, factor: int) -> BaseDownSample:
+    """
+    Import and construct a registered backend.
+
+    :param name: Backend name
+    :type name: str
+    :param ndim: Number of image dimensions, 2 or 3
+    :type ndim: int
+    :param factor: Binning factor
+    :type factor: int
+    :raise Exception: The backend cannot be imported or constructed
+    :return: Downsampler
+    :rtype: BaseDownSample
+    """
+
+    module, class_name = DOWNSAMPLERS[ndim][name]
+    return getattr(importlib.import_module(module), class_name)(binning=factor)
+
+
+def _validate(
+    downsampler: BaseDownSample, reference: BaseDownSample, ndim: int, dtype: str, factor: int
+) -> None:
+    """
+    Check a backend against the numpy backend on a small sample image.
+
+    :param downsampler: Backend to check
+    :type downsampler: BaseDownSample
+    :param reference: Numpy backend
+    :type reference: BaseDownSample
+    :param ndim: Number of image dimensions
+    :type ndim: int
+    :param dtype: Image data type
+    :type dtype: str
+    :param factor: Binning factor
+    :type factor: int
+    :raise ValueError: The backend returns a different result
+    """
+
+    shape = tuple(count * factor for count in VALIDATION_BIN_COUNT_PX[-ndim:])
+    high = 4096 if numpy.dtype(dtype).kind != "i" else min(4096, numpy.iinfo(dtype).max)
+    sample = numpy.random.default_rng(0).integers(0, high, shape).astype(dtype)
+    expected = reference.run(sample)
+    result = downsampler.run(sample)
+    if not isinstance(result, numpy.ndarray) or result.shape != expected.shape:
+        raise ValueError(f"returns {type(result).__name__} of shape {getattr(result, 'shape', None)}")
+    if numpy.abs(result.astype(numpy.float64) - expected).max() > VALIDATION_TOLERANCE:
+        raise ValueError("result differs from numpy")
+
+
+def _sample_shape(shape: tuple, factor: int) -> tuple:
+    """
+    Shape of the benchmark sample image of an image shape, capped at\n
+    BENCHMARK_MAX_FRAMES and BENCHMARK_MAX_XY_PX and a multiple of the factor.
+
+    :param shape: Image shape, 2 or 3 dimensions
+    :type shape: tuple
+    :param factor: Binning factor
+    :type factor: int
+    :return: Sample shape
+    :rtype: tuple
+    """
+
+    caps = (BENCHMARK_MAX_FRAMES, BENCHMARK_MAX_XY_PX, BENCHMARK_MAX_XY_PX)[-len(shape):]
+    return tuple(max(min(size, cap) // factor, 1) * factor for size, cap in zip(shape, caps))
+
+
+def _benchmark(downsampler: BaseDownSample, image: numpy.ndarray) -> float:
+    """
+    Time a backend on an image.
+
+    :param downsampler: Backend to time
+    :type downsampler: BaseDownSample
+    :param image: Image of the benchmarked shape and data type
+    :type image: numpy.ndarray
+    :return: Fastest run time in seconds
+    :rtype: float
+    """
+
+    # warm up run, e.g. gpu kernels compile on first use
+    downsampler.run(image)
+    times = list()
+    for _ in range(BENCHMARK_REPEATS):
+        start = perf_counter()
+        downsampler.run(image)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def _load_cache() -> dict:
+    """
+    Read the benchmark cache file.
+
+    :return: Backend names keyed by benchmark key
+    :rtype: dict
+    """
+
+    try:
+        with open(CACHE_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _save_cache(key: str, name: str) -> None:
+    """
+    Add a benchmark result to the cache file.
+
+    :param key: Benchmark key
+    :type key: str
+    :param name: Backend name
+    :type name: str
+    """
+
+    cache = _load_cache()
+    cache[key] = name
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename so concurrent processes never read a partial file
+        temp_path = CACHE_PATH.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_path, CACHE_PATH)
+    except OSError as e:
+        log.warning(f"could not write downsample cache {CACHE_PATH}: {e}")
+
+
+def best_downsampler(shape: tuple, dtype: str, factor: int, refresh: bool = False) -> BaseDownSample:
+    """
+    Fastest usable downsampler for images of a shape and data type.
+
+    On first use for a (shape, dtype, factor) every registered backend that\n
+    imports, constructs and matches numpy on a sample image is benchmarked\n
+    on a few frames of the image capped in x and y, and the winner is cached\n
+    on disk keyed by the sample shape. Later calls construct the cached\n
+    backend directly and fall back to numpy if it is no longer usable.
+
+    :param shape: Image shape, 2 or 3 dimensions
+    :type shape: tuple
+    :param dtype: Image data type
+    :type dtype: str
+    :param factor: Binning factor
+    :type factor: int
+    :param refresh: Ignore cached results and benchmark again
+    :type refresh: bool
+    :raise ValueError: Invalid number of dimensions
+    :return: Downsampler
+    :rtype: BaseDownSample
+    """
+
+    ndim = len(shape)
+    if ndim not in DOWNSAMPLERS:
+        raise ValueError("shape must have one of %r dimensions." % list(DOWNSAMPLERS.keys()))
+    dtype = numpy.dtype(dtype).name
+    shape = _sample_shape(shape, factor)
+    key = f"{'x'.join(str(size) for size in shape)}/{dtype}/{factor}"
+    with _lock:
+        name = None if refresh else _selected.get(key, _load_cache().get(key))
+        if name is not None and name in DOWNSAMPLERS[ndim]:
+            try:
+                downsampler = create_downsampler(name, ndim, factor)
+                _selected[key] = name
+                return downsampler
+            except Exception as e:
+                log.warning(f"cached downsampler {name} unavailable, benchmarking again: {e}")
+        name, downsampler = _select(shape, dtype, factor)
+        _selected[key] = name
+        _save_cache(key, name)
+        return downsampler
+
+
+def _benchmark_backends(backends: dict, shape: tuple, dtype: str, factor: int) -> dict:
+    """
+    Validate and time backends, run in a spawned process.
+
+    :param backends: Backend name -> (module, class) of the number of dimensions
+    :type backends: dict
+    :param shape: Sample image shape
+    :type shape: tuple
+    :param dtype: Image data type
+    :type dtype: str
+    :param factor: Binning factor
+    :type factor: int
+    :return: Backend name -> fastest run time in seconds, or the error of an unusable backend
+    :rtype: dict
+    """
+
+    ndim = len(shape)
+    DOWNSAMPLERS[ndim].update(backends)
+    reference = create_downsampler(FALLBACK_BACKEND, ndim, factor)
+    rng = numpy.random.default_rng(0)
+    if numpy.issubdtype(dtype, numpy.integer):
+        image = rng.integers(0, 256, shape, dtype=dtype)
+    else:
+        image = (rng.random(shape, dtype=numpy.float32) * 256).astype(dtype)
+    results = dict()
+    for name in backends:
+        try:
+            downsampler = reference if name == FALLBACK_BACKEND else create_downsampler(name, ndim, factor)
+            _validate(downsampler, reference, ndim, dtype, factor)
+            results[name] = _benchmark(downsampler, image)
+        except Exception as e:
+            results[name] = str(e)
+    return results
+
+
+def _select(shape: tuple, dtype: str, factor: int) -> tuple:
+    """
+    Benchmark all usable backends in a spawned process, backends like\n
+    tensorstore or cuda abort processes forked after they ran and only\n
+    the selected backend should touch the calling process.
+
+    :param shape: Sample image shape
+    :type shape: tuple
+    :param dtype: Image data type
+    :type dtype: str
+    :param factor: Binning factor
+    :type factor: int
+    :return: Name and instance of the fastest backend
+    :rtype: tuple
+    """
+
+    ndim = len(shape)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = pool.submit(_benchmark_backends, DOWNSAMPLERS[ndim], shape, dtype, factor).result()
+    best: Optional[tuple] = None
+    for name, result in results.items():
+        if isinstance(result, str):
+            log.info(f"downsampler {name} unavailable: {result}")
+            continue
+        log.info(f"downsampler {name}: {result * 1000:.2f} [ms] for {shape} {dtype}")
+        if best is None or result < best[0]:
+            best = (result, name)
+    if best is not None and best[1] != FALLBACK_BACKEND:
+        try:
+            downsampler = create_downsampler(best[1], ndim, factor)
+            log.info(f"selected downsampler {best[1]} for {shape} {dtype}")
+            return best[1], downsampler
+        except Exception as e:
+            log.warning(f"downsampler {best[1]} unavailable in this process: {e}")
+    log.info(f"selected downsampler {FALLBACK_BACKEND} for {shape} {dtype}")
+    return FALLBACK_BACKEND, create_downsampler(FALLBACK_BACKEND, ndim, factor)
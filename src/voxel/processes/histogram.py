@@ -1,4 +1,6 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Event, Process
 from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
@@ -10,15 +12,14 @@ from fast_histogram import histogram1d
 class HistogramProjection:
     """
     Voxel driver for performing histogram projections along the x, y, and z axes.
-    Data is saved in a csv file with the following format:
-    The first column contains the bin centers for intensity.
-    The first row contains the bin centers for the spatial projection.
-    The remaining data is the histogram projection data.
+    Histograms are accumulated over all frames of each spatial bin. Every\n
+    new_image signal hands off batch_count_px frames, and the spatial bins\n
+    of a batch are histogrammed in parallel on a thread pool.
 
-    [0, spatial_bin_1, spatial_bin_2, ...
-    intensity_bin_1, data_1_1, data_1_2, ...
-    intensity_bin_2, data_2_1, data_2_2, ...
-    ...]
+    Each axis is saved to a compressed npz file with the following arrays:
+    histogram: counts with shape (intensity bins, spatial bins)
+    intensity_bin_centers: bin centers for intensity
+    spatial_bin_centers: bin centers for the spatial projection
 
     :param path: Path for the histogram projection process
     :type path: str
@@ -45,6 +46,8 @@ class HistogramProjection:
         self._filename = None
         self._acquisition_name = Path()
         self._data_type = None
+        self._batch_count_px = 1
+        self._worker_count = os.cpu_count()
         self.new_image = Event()
         self.new_image.clear()
 
@@ -444,6 +447,56 @@ class HistogramProjection:
         )
         self.log.info(f"setting filename to: {filename}")
 
+    @property
+    def batch_count_px(self):
+        """Get the number of frames handed off per new_image signal.
+
+        :return: Batch count in pixels
+        :rtype: int
+        """
+
+        return self._batch_count_px
+
+    @batch_count_px.setter
+    def batch_count_px(self, batch_count_px: int):
+        """Set the number of frames handed off per new_image signal.\n
+        The shared memory passed to prepare must hold this many frames,\n
+        the last batch may be partially filled.
+
+        :param batch_count_px: Batch count in pixels
+        :type batch_count_px: int
+        :raises ValueError: Batch count is less than 1
+        """
+
+        if batch_count_px < 1:
+            raise ValueError("batch count must be >= 1")
+        self.log.info(f"setting batch count to: {batch_count_px} [px]")
+        self._batch_count_px = batch_count_px
+
+    @property
+    def worker_count(self):
+        """Get the number of threads histogramming spatial bins.
+
+        :return: Number of threads
+        :rtype: int
+        """
+
+        return self._worker_count
+
+    @worker_count.setter
+    def worker_count(self, worker_count: int):
+        """Set the number of threads histogramming spatial bins.
+
+        :param worker_count: Number of threads
+        :type worker_count: int
+        :raises ValueError: Worker count is less than 1
+        """
+
+        if worker_count < 1:
+            raise ValueError("worker count must be >= 1")
+        self.log.info(f"setting worker count to: {worker_count}")
+        self._worker_count = worker_count
+
     def prepare(self, shm_name):
         """
         Prepare the max projection process.
@@ -453,7 +506,7 @@ class HistogramProjection:
         """
 
         self._process = Process(target=self._run)
-        self.shm_shape = (self._row_count_px, self._column_count_px)
+        self.shm_shape = (self._batch_count_px, self._row_count_px, self._column_count_px)
         # create attributes to open shared memory in run function
         self.shm = SharedMemory(shm_name, create=False)
         self.latest_img = np.ndarray(
@@ -508,60 +561,96 @@ class HistogramProjection:
             self.histogram_z = np.zeros((self._z_bins, len(z_index_list)-1), dtype='float')
 
         frame_index = 0
-        z_chunk_number = 0
+        pool = ThreadPoolExecutor(max_workers=self._worker_count)
 
         while frame_index < self._frame_count_px_px:
-            # max project latest image
-            if self.new_image.is_set():
-                self.latest_img = np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf)
-                if z_projection:
-                    # if this projection thickness is complete or end of stack
-                    chunk_index = frame_index % self._z_bin_count_px
-                    if chunk_index == self._z_bin_count_px - 1 or frame_index == self._frame_count_px_px - 1:
-                        self.histogram_z[:, z_chunk_number] = histogram1d(self.latest_img,
-                                                                          bins=self._z_bins,
-                                                                          range=[self._z_min_value, self._z_max_value])
-                        z_chunk_number += 1
-                if x_projection:
-                    for i in range(0, len(x_index_list)-1):
-                        self.histogram_x[:, i] = histogram1d(self.latest_img[:, x_index_list[i]:x_index_list[i+1]],
-                                                             bins=self._x_bins,
-                                                             range=[self._x_min_value, self._x_max_value])
-                if y_projection:
-                    for i in range(0, len(y_index_list)-1):
-                        self.histogram_y[:, i] = histogram1d(self.latest_img[y_index_list[i]:y_index_list[i+1], :],
-                                                             bins=self._y_bins,
-                                                             range=[self._y_min_value, self._y_max_value])
-                frame_index += 1
-                self.new_image.clear()
-        # save projections as csv files
-        self.log.info(f'saving {self.filename}_histogram_x.tiff')
-        x_bin_step = (self._x_max_value - self._x_min_value)/self._x_bins
-        x_bin_centers = np.linspace(self._x_min_value + x_bin_step / 2,
-                                    self._x_max_value - x_bin_step / 2, self._x_bins)
-        x_projection_centers = np.zeros(shape=(1, len(x_index_list)), dtype='float')
-        x_projection_centers[0, 1:] = (x_index_list[1:] + x_index_list[:-1]) / 2
-        np.savetxt(Path(self._path, self._acquisition_name, f"{self.filename}_histogram_x.csv"),
-                   np.row_stack((x_projection_centers, np.column_stack((x_bin_centers, self.histogram_x)))),
-                   delimiter=',', fmt='%f')
-        self.log.info(f'saving {self.filename}_histogram_y.tiff')
-        y_bin_step = (self._y_max_value - self._y_min_value)/self._y_bins
-        y_bin_centers = np.linspace(self._y_min_value + y_bin_step / 2,
-                                    self._y_max_value - y_bin_step / 2, self._y_bins)
-        y_projection_centers = np.zeros(shape=(1, len(y_index_list)), dtype='float')
-        y_projection_centers[0, 1:] = (y_index_list[1:] + y_index_list[:-1]) / 2
-        np.savetxt(Path(self._path, self._acquisition_name, f"{self.filename}_histogram_y.csv"),
-                   np.row_stack((y_projection_centers, np.column_stack((y_bin_centers, self.histogram_y)))),
-                   delimiter=',', fmt='%f')
-        self.log.info(f'saving {self.filename}_histogram_z.tiff')
-        z_bin_step = (self._z_max_value - self._z_min_value)/self._z_bins
-        z_bin_centers = np.linspace(self._z_min_value + z_bin_step / 2,
-                                    self._z_max_value - z_bin_step / 2, self._z_bins)
-        z_projection_centers = np.zeros(shape=(1, len(z_index_list)), dtype='float')
-        z_projection_centers[0, 1:] = (z_index_list[1:] + z_index_list[:-1]) / 2
-        np.savetxt(Path(self._path, self._acquisition_name, f"{self.filename}_histogram_z.csv"),
-                   np.row_stack((z_projection_centers, np.column_stack((z_bin_centers, self.histogram_z)))),
-                   delimiter=',', fmt='%f')
+            # wait for the latest image or batch of images
+            self.new_image.wait()
+            self.latest_img = np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf)
+            # the last batch may only be partially filled
+            frame_count = min(self._batch_count_px, self._frame_count_px_px - frame_index)
+            frames = self.latest_img[:frame_count]
+            # histogram every spatial bin of the batch in a single call,
+            # fast_histogram releases the gil so bins run in parallel
+            tasks = list()
+            if z_projection:
+                # split the batch where z projections end
+                start = 0
+                while start < frame_count:
+                    z_chunk_number = (frame_index + start) // self._z_bin_count_px
+                    end = min(frame_count, z_index_list[z_chunk_number + 1] - frame_index)
+                    tasks.append((self.histogram_z, z_chunk_number, frames[start:end],
+                                  self._z_bins, self._z_min_value, self._z_max_value))
+                    start = end
+            if x_projection:
+                for i in range(0, len(x_index_list)-1):
+                    tasks.append((self.histogram_x, i, frames[:, :, x_index_list[i]:x_index_list[i+1]],
+                                  self._x_bins, self._x_min_value, self._x_max_value))
+            if y_projection:
+                for i in range(0, len(y_index_list)-1):
+                    tasks.append((self.histogram_y, i, frames[:, y_index_list[i]:y_index_list[i+1], :],
+                                  self._y_bins, self._y_min_value, self._y_max_value))
+            for _ in pool.map(lambda task: self._accumulate(*task), tasks):
+                pass
+            frames = None
+            frame_index += frame_count
+            self.new_image.clear()
+        pool.shutdown()
+
+        # save projections as compressed npz files
+        if x_projection:
+            self._save("x", self.histogram_x, x_index_list, self._x_bins, self._x_min_value, self._x_max_value)
+        if y_projection:
+            self._save("y", self.histogram_y, y_index_list, self._y_bins, self._y_min_value, self._y_max_value)
+        if z_projection:
+            self._save("z", self.histogram_z, z_index_list, self._z_bins, self._z_min_value, self._z_max_value)
+
+    def _accumulate(self, histogram: np.ndarray, index: int, image: np.ndarray, bins: int,
+                    min_value: int, max_value: int):
+        """Add the intensity histogram of an image to one spatial bin.
+
+        :param histogram: Histogram projection of an axis
+        :type histogram: numpy.ndarray
+        :param index: Spatial bin of the image
+        :type index: int
+        :param image: Pixels in the spatial bin
+        :type image: numpy.ndarray
+        :param bins: Number of intensity bins
+        :type bins: int
+        :param min_value: Lower edge of the intensity range
+        :type min_value: int
+        :param max_value: Upper edge of the intensity range
+        :type max_value: int
+        """
+
+        histogram[:, index] += histogram1d(image, bins=bins, range=[min_value, max_value])
+
+    def _save(self, axis: str, histogram: np.ndarray, index_list: np.ndarray, bins: int,
+              min_value: int, max_value: int):
+        """Save the histogram projection of an axis.
+
+        :param axis: Axis of the projection
+        :type axis: str
+        :param histogram: Histogram projection of the axis
+        :type histogram: numpy.ndarray
+        :param index_list: Edges of the spatial bins in pixels
+        :type index_list: numpy.ndarray
+        :param bins: Number of intensity bins
+        :type bins: int
+        :param min_value: Lower edge of the intensity range
+        :type min_value: int
+        :param max_value: Upper edge of the intensity range
+        :type max_value: int
+        """
+
+        self.log.info(f'saving {self.filename}_histogram_{axis}.npz')
+        bin_step = (max_value - min_value)/bins
+        intensity_bin_centers = np.linspace(min_value + bin_step / 2, max_value - bin_step / 2, bins)
+        spatial_bin_centers = (index_list[1:] + index_list[:-1]) / 2
+        np.savez_compressed(Path(self._path, self._acquisition_name, f"{self.filename}_histogram_{axis}.npz"),
+                            histogram=histogram.astype(np.uint64),
+                            intensity_bin_centers=intensity_bin_centers,
+                            spatial_bin_centers=spatial_bin_centers)
 
     def wait_to_finish(self):
         """
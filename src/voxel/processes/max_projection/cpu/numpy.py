@@ -5,11 +5,19 @@ import tifffile
 
 from voxel.processes.max_projection.base import BaseMaxProjection
 
+# x projections up to this width are reduced with strided maximums,
+# wider ones with reduceat which is faster once bins span many pixels
+STRIDED_BIN_MAX_PX = 8
+
 
 class CPUMaxProjection(BaseMaxProjection):
     """
     Voxel driver for the CPU max projection process.
 
+    Projections are vectorized with numpy ufunc reductions into preallocated\n
+    buffers. By default new_image signals a single frame in shared memory,\n
+    with batch_count_px > 1 it signals a chunk of that many frames.
+
     The process will save data to the following location
 
     path\\acquisition_name\\filename*
@@ -20,6 +28,137 @@ class CPUMaxProjection(BaseMaxProjection):
 
     def __init__(self, path: str):
         super().__init__(path)
+        self._batch_count_px = 1
+
+    @property
+    def batch_count_px(self) -> int:
+        """Get the number of frames handed off per new_image signal.
+
+        :return: Batch count in pixels
+        :rtype: int
+        """
+
+        return self._batch_count_px
+
+    @batch_count_px.setter
+    def batch_count_px(self, batch_count_px: int) -> None:
+        """Set the number of frames handed off per new_image signal.\n
+        The shared memory passed to prepare must hold this many frames,\n
+        the last batch may be partially filled.
+
+        :param batch_count_px: Batch count in pixels
+        :type batch_count_px: int
+        :raises ValueError: Batch count is less than 1
+        """
+
+        if batch_count_px < 1:
+            raise ValueError("batch count must be >= 1")
+        self.log.info(f"setting batch count to: {batch_count_px} [px]")
+        self._batch_count_px = batch_count_px
+
+    def prepare(self, shm_name):
+        """
+        Prepare the max projection process.
+
+        :param shm_name: Shared memory name
+        :type shm_name: multiprocessing.shared_memory.SharedMemory
+        """
+
+        super().prepare(shm_name)
+        self.shm_shape = (self._batch_count_px, self._row_count_px, self._column_count_px)
+        self.latest_img = np.ndarray(self.shm_shape, self._data_type, buffer=self.shm.buf)
+
+    def _save_xy(self, start_index: int, end_index: int):
+        """
+        Save the xy max projection over a range of frames.
+
+        :param start_index: First frame of the projection
+        :type start_index: int
+        :param end_index: Frame after the last frame of the projection
+        :type end_index: int
+        """
+
+        self.log.info(
+            f"saving {self.filename}_max_projection_xy_z_{start_index:06}_{end_index:06}.tiff"
+        )
+        tifffile.imwrite(
+            Path(
+                self.path,
+                self._acquisition_name,
+                f"{self.filename}_max_projection_xy_z_{start_index:06}_{end_index:06}.tiff",
+            ),
+            self.mip_xy,
+        )
+
+    def _project(self, frames: np.ndarray, frame_index: int, x_starts, y_starts):
+        """
+        Max project a block of consecutive frames.
+
+        :param frames: Frames to project, (frames, rows, columns)
+        :type frames: numpy.ndarray
+        :param frame_index: Index of the first frame in the stack
+        :type frame_index: int
+        :param x_starts: Start column of every x projection, None if disabled
+        :type x_starts: numpy.ndarray
+        :param y_starts: Start row of every y projection, None if disabled
+        :type y_starts: numpy.ndarray
+        """
+
+        frame_count = frames.shape[0]
+        if self._z_projection_count_px is not None:
+            # split the block where z projections end
+            start = 0
+            while start < frame_count:
+                index = frame_index + start
+                end = min(
+                    frame_count,
+                    (index // self._z_projection_count_px + 1) * self._z_projection_count_px - frame_index,
+                )
+                if end - start == 1:
+                    np.maximum(self.mip_xy, frames[start], out=self.mip_xy)
+                else:
+                    np.maximum.reduce(frames[start:end], axis=0, out=self._mip_xy_block)
+                    np.maximum(self.mip_xy, self._mip_xy_block, out=self.mip_xy)
+                # if this projection thickness is complete or end of stack
+                if (
+                    (frame_index + end) % self._z_projection_count_px == 0
+                    or frame_index + end == self._frame_count_px_px
+                ):
+                    self._save_xy(self._z_start_index, frame_index + end)
+                    # reset the xy mip
+                    self.mip_xy.fill(0)
+                    # set next start index to previous end index
+                    self._z_start_index = frame_index + end
+                start = end
+        frame_slice = slice(frame_index, frame_index + frame_count)
+        if x_starts is not None:
+            mip_yz = self.mip_yz[frame_slice, :, : len(x_starts)]
+            width = self._x_projection_count_px
+            if width <= STRIDED_BIN_MAX_PX:
+                # full width projections as maximums over strided column views
+                full_count = self._column_count_px // width
+                full_end = full_count * width
+                mip_full = mip_yz[:, :, :full_count]
+                np.copyto(mip_full, frames[:, :, 0:full_end:width])
+                for offset in range(1, width):
+                    np.maximum(mip_full, frames[:, :, offset:full_end:width], out=mip_full)
+                if full_end < self._column_count_px:
+                    np.max(frames[:, :, full_end:], axis=2, out=mip_yz[:, :, full_count])
+            else:
+                np.maximum.reduceat(frames, x_starts, axis=2, out=mip_yz)
+        if y_starts is not None:
+            # full height projections reduce over the middle axis of a reshaped
+            # view, which keeps the inner loop over contiguous columns
+            height = self._y_projection_count_px
+            full_count = self._row_count_px // height
+            full_end = full_count * height
+            mip_block = self._mip_xz_block[:frame_count]
+            frames[:, :full_end].reshape(
+                frame_count, full_count, height, self._column_count_px
+            ).max(axis=2, out=mip_block)
+            self.mip_xz[frame_slice, :, :full_count] = mip_block.transpose(0, 2, 1)
+            if full_end < self._row_count_px:
+                np.max(frames[:, full_end:], axis=1, out=self.mip_xz[frame_slice, :, full_count])
 
     def _run(self):
 
@@ -27,6 +166,7 @@ class CPUMaxProjection(BaseMaxProjection):
         # if not, set to max possible values based on tile
         if self._x_projection_count_px is None:
             x_projection = False
+            x_starts = None
         else:
             x_projection = True
             if (
@@ -41,12 +181,14 @@ class CPUMaxProjection(BaseMaxProjection):
             )
             if self._column_count_px not in x_index_list:
                 x_index_list = np.append(x_index_list, self._column_count_px)
+            x_starts = x_index_list[:-1]
             self.mip_yz = np.zeros(
                 (self._frame_count_px_px, self._row_count_px, len(x_index_list)),
                 dtype=self._data_type,
             )
         if self._y_projection_count_px is None:
             y_projection = False
+            y_starts = None
         else:
             y_projection = True
             if (
@@ -57,14 +199,21 @@ class CPUMaxProjection(BaseMaxProjection):
             y_index_list = np.arange(0, self._row_count_px, self._y_projection_count_px)
             if self._row_count_px not in y_index_list:
                 y_index_list = np.append(y_index_list, self._row_count_px)
+            y_starts = y_index_list[:-1]
             self.mip_xz = np.zeros(
                 (self._frame_count_px_px, self._column_count_px, len(y_index_list)),
                 dtype=self._data_type,
             )
-        if self._z_projection_count_px is None:
-            z_projection = False
-        else:
-            z_projection = True
+            # scratch buffer for the full height projections of a batch
+            self._mip_xz_block = np.zeros(
+                (
+                    self._batch_count_px,
+                    self._row_count_px // self._y_projection_count_px,
+                    self._column_count_px,
+                ),
+                dtype=self._data_type,
+            )
+        if self._z_projection_count_px is not None:
             if (
                 self._z_projection_count_px < 0
                 or self._z_projection_count_px > self._frame_count_px_px
@@ -75,59 +224,23 @@ class CPUMaxProjection(BaseMaxProjection):
             self.mip_xy = np.zeros(
                 (self._row_count_px, self._column_count_px), dtype=self._data_type
             )
+            # scratch buffer for the projection of several frames of a batch
+            self._mip_xy_block = np.zeros_like(self.mip_xy)
 
         frame_index = 0
-        start_index = 0
+        self._z_start_index = 0
 
         while frame_index < self._frame_count_px_px:
-            # max project latest image
-            if self.new_image.is_set():
-                self.latest_img = np.ndarray(
-                    self.shm_shape, self._data_type, buffer=self.shm.buf
-                )
-                if z_projection:
-                    self.mip_xy = np.maximum(self.mip_xy, self.latest_img).astype(
-                        np.uint16
-                    )
-                    # if this projection thickness is complete or end of stack
-                    chunk_index = frame_index % self._z_projection_count_px
-                    if (
-                        chunk_index == self._z_projection_count_px - 1
-                        or frame_index == self._frame_count_px_px - 1
-                    ):
-                        end_index = int(frame_index + 1)
-                        self.log.info(
-                            f"saving {self.filename}_max_projection_xy_z_{start_index:06}_{end_index:06}.tiff"
-                        )
-                        tifffile.imwrite(
-                            Path(
-                                self.path,
-                                self._acquisition_name,
-                                f"{self.filename}_max_projection_xy_z_{start_index:06}_{end_index:06}.tiff",
-                            ),
-                            self.mip_xy,
-                        )
-                        # reset the xy mip
-                        self.mip_xy = np.zeros(
-                            (self._row_count_px, self._column_count_px),
-                            dtype=self._data_type,
-                        )
-                        # set next start index to previous end index
-                        start_index = end_index
-                if x_projection:
-                    for i in range(0, len(x_index_list) - 1):
-                        self.mip_yz[frame_index, :, i] = np.max(
-                            self.latest_img[:, x_index_list[i] : x_index_list[i + 1]],
-                            axis=1,
-                        )
-                if y_projection:
-                    for i in range(0, len(y_index_list) - 1):
-                        self.mip_xz[frame_index, :, i] = np.max(
-                            self.latest_img[y_index_list[i] : y_index_list[i + 1], :],
-                            axis=0,
-                        )
-                frame_index += 1
-                self.new_image.clear()
+            # wait for the latest image or batch of images
+            self.new_image.wait()
+            self.latest_img = np.ndarray(
+                self.shm_shape, self._data_type, buffer=self.shm.buf
+            )
+            # the last batch may only be partially filled
+            frame_count = min(self._batch_count_px, self._frame_count_px_px - frame_index)
+            self._project(self.latest_img[:frame_count], frame_index, x_starts, y_starts)
+            frame_index += frame_count
+            self.new_image.clear()
         if x_projection:
             for i in range(0, len(x_index_list) - 1):
                 start_index = x_index_list[i]
@@ -6,11 +6,30 @@ Available writers:
     - BDVWriter
 - voxel.writers.tiff
     - TiffWriter
+- voxel.writers.zarr
+    - ZarrWriter
+- voxel.writers.raw
+    - RawWriter
 """
 
+import importlib
+
 from .base import BaseWriter
-from .bdv import BDVWriter
-from .imaris import ImarisWriter
-from .tiff import TiffWriter
 
-__all__ = ["BaseWriter", "ImarisWriter", "BDVWriter", "TiffWriter"]
+# writer -> module, imported on first use so that importing one writer or the
+# shared data structures does not import the optional dependencies of the others
+_WRITERS = {
+    "ImarisWriter": "imaris",
+    "BDVWriter": "bdv",
+    "TiffWriter": "tiff",
+    "ZarrWriter": "zarr",
+    "RawWriter": "raw",
+}
+
+__all__ = ["BaseWriter", "ImarisWriter", "BDVWriter", "TiffWriter", "ZarrWriter", "RawWriter"]
+
+
+def __getattr__(name: str):
+    if name not in _WRITERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_WRITERS[name]}", __name__), name)
@@ -1,10 +1,24 @@
 import logging
+import multiprocessing
+import threading
 from abc import abstractmethod
-from multiprocessing import Event, Queue, Value
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from typing import Optional
+from queue import Empty
+from time import perf_counter
+from typing import Callable, Optional
 import numpy
 from voxel.descriptors.deliminated_property import DeliminatedProperty
+from voxel.processes.downsample.cpu.numpy.downsample_3d import NPDownSample3D
+from voxel.writers.data_structures.shared_chunk_metrics import SharedChunkMetrics
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+# interval at which a waiting writer checks for abort and timeout
+CHUNK_WAIT_INTERVAL_S = 0.1
+# writer processes are spawned as on windows, libraries like tensorstore abort in a process forked after they ran
+SPAWN_CONTEXT = multiprocessing.get_context("spawn")
 
 
 class BaseWriter:
@@ -37,13 +51,38 @@ class BaseWriter:
         self._channel = None
         self._process = None
         # share values to update inside process
-        self._progress = Value("d", 0.0)
+        self._progress = SPAWN_CONTEXT.Value("d", 0.0)
         # share queue for passing logs out of process
-        self._log_queue = Queue()
+        self._log_queue = SPAWN_CONTEXT.Queue()
         # Flow control attributes to synchronize inter-process communication.
-        self.done_reading = Event()
+        self.done_reading = SPAWN_CONTEXT.Event()
         self.done_reading.set()  # Set after processing all data in shared mem.
-        self.deallocating = Event()
+        self.deallocating = SPAWN_CONTEXT.Event()
+        # Queue carrying (shm_name, chunk_index) of chunks handed off with put_chunk().
+        self._chunk_queue = SPAWN_CONTEXT.Queue()
+        # Set to stop the run process from waiting on further chunks.
+        self._abort = SPAWN_CONTEXT.Event()
+        self._timeout_s = None
+        # Optional ring buffer handed to the writer in prepare(), replaces the shm_name handoff.
+        self._buffer = None
+        # Chunk slots of the ring buffer the acquisition creates for this writer.
+        self._slot_count = 4
+        self._slot_index = None
+        # Shared memory attached inside the run process, keyed by shm name and kept until the run ends.
+        self._shm_blocks = dict()
+        self._shm_frames = dict()
+        # Asynchronous chunk writes, the pool and lock are created inside the run process.
+        self._io_depth = 1
+        self._io_pool = None
+        self._io_lock = None
+        self._io_in_flight = deque()
+        self._io_error = None
+        # Per chunk timings recorded by the run process, readable from any process.
+        self._metrics = SharedChunkMetrics()
+        # Leading chunks written without error, unlike the metrics it stops at the first failed write.
+        self._written_chunk_count = SPAWN_CONTEXT.Value("i", 0)
+        self._chunk_wait_s = 0.0
+        self._chunk_nbytes = 0
 
     @property
     @abstractmethod
@@ -463,6 +502,86 @@ class BaseWriter:
         self._shm_name[len(name)] = "\x00"  # Null terminate the string.
         self.log.info(f"setting shared memory to: {name}")
 
+    @property
+    def timeout_s(self) -> Optional[float]:
+        """
+        Maximum time the writer waits for a new chunk before aborting.
+
+        :return: Timeout in seconds, None waits forever
+        :rtype: float
+        """
+
+        return self._timeout_s
+
+    @timeout_s.setter
+    def timeout_s(self, timeout_s: Optional[float]) -> None:
+        """
+        Maximum time the writer waits for a new chunk before aborting.
+
+        :param timeout_s: Timeout in seconds, None waits forever
+        :type timeout_s: float
+        """
+
+        self._timeout_s = timeout_s
+        self.log.info(f"setting timeout to: {timeout_s} [s]")
+
+    @property
+    def io_depth(self) -> int:
+        """
+        Maximum number of chunk writes in flight.
+
+        :return: Number of chunk writes
+        :rtype: int
+        """
+
+        return self._io_depth
+
+    @io_depth.setter
+    def io_depth(self, io_depth: int) -> None:
+        """
+        Maximum number of chunk writes in flight.\n
+        Depths above 1 only take effect with a ring buffer, and are capped\n
+        by its slot count minus the slot held by the producer.
+
+        :param io_depth: Number of chunk writes
+        :type io_depth: int
+        :raise ValueError: Depth is less than 1
+        """
+
+        if io_depth < 1:
+            raise ValueError("io depth must be >= 1")
+        self._io_depth = io_depth
+        self.log.info(f"setting io depth to: {io_depth}")
+
+    @property
+    def slot_count(self) -> int:
+        """
+        Number of chunk slots of the ring buffer chunks are handed to the writer through.
+
+        :return: Number of slots
+        :rtype: int
+        """
+
+        return self._slot_count
+
+    @slot_count.setter
+    def slot_count(self, slot_count: int) -> None:
+        """
+        Number of chunk slots of the ring buffer chunks are handed to the\n
+        writer through. The camera only waits on the writer once every slot\n
+        but the one it fills is waiting to be written, each slot holds one\n
+        chunk in memory.
+
+        :param slot_count: Number of slots
+        :type slot_count: int
+        :raise ValueError: Slot count is less than 2
+        """
+
+        if slot_count < 2:
+            raise ValueError("slot count must be >= 2")
+        self._slot_count = slot_count
+        self.log.info(f"setting slot count to: {slot_count}")
+
     @DeliminatedProperty(minimum=0, maximum=100, unit='%')
     @abstractmethod
     def progress(self) -> float:
@@ -475,13 +594,40 @@ class BaseWriter:
         # convert to %
         return self._progress.value*100
 
+    @property
+    def metrics(self) -> SharedChunkMetrics:
+        """
+        Per chunk wait, copy and write times, sizes and compression of the\n
+        current stack, with rolling throughput and latency statistics.
+
+        :return: Chunk metrics
+        :rtype: SharedChunkMetrics
+        """
+
+        return self._metrics
+
+    def finished_files(self) -> dict:
+        """
+        Local files, or leading bytes of files, that the writer will not\n
+        change again, so a transfer can ship them while the writer runs.\n
+        Writers of single files with headers finalized at the end report none.
+
+        :return: Final leading bytes keyed by absolute path, None for whole files
+        :rtype: dict
+        """
+
+        return dict()
+
     @abstractmethod
     def get_logs(self):
         """
         Get logs from the writer run process.
         """
-        while not self._log_queue.empty():
-            self.log.info(self._log_queue.get())
+        while True:
+            try:
+                self.log.info(self._log_queue.get_nowait())
+            except Empty:
+                break
 
     @abstractmethod
     def start(self):
@@ -490,6 +636,8 @@ class BaseWriter:
         """
 
         self.log.info(f"{self._filename}: starting writer.")
+        self._metrics.reset()
+        self._written_chunk_count.value = 0
         self._process.start()
 
     @abstractmethod
@@ -499,7 +647,11 @@ class BaseWriter:
         """
 
         self.log.info(f"{self._filename}: waiting to finish.")
-        self._process.join()
+        # keep draining logs, the run process cannot exit while its log queue is full
+        while self._process.is_alive():
+            self._process.join(CHUNK_WAIT_INTERVAL_S)
+            self.get_logs()
+        self.get_logs()
 
     @abstractmethod
     def delete_files(self):
@@ -509,12 +661,262 @@ class BaseWriter:
         pass
 
     @abstractmethod
-    def prepare(self):
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
         """
         Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
         """
         pass
 
+    def put_chunk(self, shm_name: str, chunk_index: int, timeout_s: Optional[float] = None) -> None:
+        """
+        Hand a chunk in shared memory off to the writer process.\n
+        Blocks until the writer is done reading the previous chunk.
+
+        :param shm_name: Shared memory name of the chunk
+        :type shm_name: str
+        :param chunk_index: Index of the chunk within the stack
+        :type chunk_index: int
+        :param timeout_s: Maximum time in seconds to wait for the writer
+        :type timeout_s: float
+        :raise TimeoutError: Writer did not finish the previous chunk in time
+        """
+
+        if not self.done_reading.wait(timeout_s):
+            raise TimeoutError(f"{self._filename}: writer did not finish reading after {timeout_s} [s]")
+        self.done_reading.clear()
+        self.shm_name = shm_name
+        self._chunk_queue.put((shm_name, chunk_index))
+
+    def estimate_compression_ratio(self, frames: numpy.ndarray) -> float:
+        """
+        Estimate the compression ratio of a stack from a sample of frames.\n
+        The sample and its 2x binned pyramid levels are compressed in memory\n
+        with the configured codec. Every level of the sample shrinks by the\n
+        same factor as the stack, so the sample ratio extrapolates to the stack.
+
+        :param frames: Sample of frames (z, y, x) in the writer data type
+        :type frames: numpy.ndarray
+        :return: Full resolution raw size over compressed size of all levels
+        :rtype: float
+        """
+
+        compressed_nbytes = 0
+        level_frames = frames
+        for level in range(self._estimate_level_count(frames.shape)):
+            if level > 0:
+                if min(level_frames.shape) < 2:
+                    break
+                level_frames = NPDownSample3D(binning=2).run(level_frames)
+            compressed_nbytes += self._compressed_nbytes(level_frames)
+        return frames.nbytes / compressed_nbytes
+
+    def _estimate_level_count(self, shape: tuple) -> int:
+        """
+        Number of pyramid levels written for a sample of frames.
+
+        :param shape: Sample shape (z, y, x)
+        :type shape: tuple
+        :return: Number of levels, including full resolution
+        :rtype: int
+        """
+
+        return 1
+
+    def _compressed_nbytes(self, frames: numpy.ndarray) -> int:
+        """
+        Size of frames compressed in memory with the configured codec.
+
+        :param frames: Frames (z, y, x)
+        :type frames: numpy.ndarray
+        :return: Compressed size in bytes
+        :rtype: int
+        """
+
+        return frames.nbytes
+
+    def abort(self) -> None:
+        """
+        Abort the writer, the run process stops waiting for new chunks.
+        """
+
+        self.log.info(f"{self._filename}: aborting writer.")
+        self._abort.set()
+
+    def _read_chunk(self, chunk_num: int, shm_shape: list, shm_nbytes: int) -> Optional[numpy.ndarray]:
+        """
+        Wait for the next chunk and return a view of it in shared memory.
+
+        :param chunk_num: Index of the chunk expected next
+        :type chunk_num: int
+        :param shm_shape: Shared memory address shape
+        :type shm_shape: list
+        :param shm_nbytes: Shared memory address bytes
+        :type shm_nbytes: int
+        :return: Chunk of frames, None if the writer was aborted or timed out
+        :rtype: numpy.ndarray
+        """
+
+        wait_start = perf_counter()
+        self._chunk_nbytes = shm_nbytes
+        while not self._abort.is_set():
+            if self._timeout_s is not None and perf_counter() - wait_start > self._timeout_s:
+                self._log_queue.put(f"{self._filename}: no chunk received after {self._timeout_s} [s], aborting.")
+                self._abort.set()
+                break
+            # block on the handoff, waking up periodically to check for abort and timeout.
+            if self._buffer is not None:
+                self._slot_index = self._buffer.acquire_read_slot(timeout=CHUNK_WAIT_INTERVAL_S)
+                if self._slot_index is None:
+                    continue
+                sequence_number = self._buffer.sequence_numbers[self._slot_index]
+                frames = self._buffer.slots[self._slot_index]
+            else:
+                try:
+                    shm_name, sequence_number = self._chunk_queue.get(timeout=CHUNK_WAIT_INTERVAL_S)
+                except Empty:
+                    continue
+                # Attach a reference to the data from shared memory once per block,
+                # later chunks in the same block reuse the existing mapping.
+                if shm_name not in self._shm_frames:
+                    self._shm_blocks[shm_name] = SharedMemory(shm_name, create=False, size=shm_nbytes)
+                    self._shm_frames[shm_name] = numpy.ndarray(
+                        shm_shape, self._data_type, buffer=self._shm_blocks[shm_name].buf
+                    )
+                frames = self._shm_frames[shm_name]
+            self._chunk_wait_s = perf_counter() - wait_start
+            if sequence_number != chunk_num:
+                self._log_queue.put(f"{self._filename}: expected chunk {chunk_num} but received {sequence_number}.")
+            return frames
+        return None
+
+    def _release_chunk(self) -> None:
+        """
+        Hand the chunk returned by _read_chunk back to the producer.
+        """
+
+        if self._buffer is not None:
+            self._buffer.release_read_slot(self._slot_index)
+            self._slot_index = None
+        else:
+            self.done_reading.set()
+
+    def _record_chunk(
+        self, chunk_num: int, copy_s: float = 0.0, write_s: float = 0.0, compressed_nbytes: Optional[int] = None
+    ) -> None:
+        """
+        Record the metrics of the chunk returned by the last _read_chunk.
+
+        :param chunk_num: Index of the chunk
+        :type chunk_num: int
+        :param copy_s: Time spent copying or downsampling the chunk
+        :type copy_s: float
+        :param write_s: Time spent writing the chunk
+        :type write_s: float
+        :param compressed_nbytes: Size written to disk, None if unknown
+        :type compressed_nbytes: int
+        """
+
+        self._metrics.record(chunk_num, self._chunk_wait_s, copy_s, write_s, self._chunk_nbytes, compressed_nbytes)
+        self._written_chunk_count.value += 1
+
+    def _submit_chunk(self, chunk_num: int, chunk_total: int, write: Callable, *args) -> None:
+        """
+        Write the chunk returned by _read_chunk on the io thread pool.\n
+        Blocks while io_depth writes are already in flight. The chunk is\n
+        released and progress updated once its write completes, in chunk order.
+
+        :param chunk_num: Index of the chunk
+        :type chunk_num: int
+        :param chunk_total: Total number of chunks
+        :type chunk_total: int
+        :param write: Callable writing the chunk, called with args
+        :type write: Callable
+        :raise Exception: Re-raises the first exception of a failed write
+        """
+
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self._io_depth, thread_name_prefix="chunk_io")
+            self._io_lock = threading.Condition()
+        self._raise_io_error()
+        entry = {
+            "chunk_num": chunk_num,
+            "chunk_total": chunk_total,
+            "slot_index": self._slot_index,
+            "wait_s": self._chunk_wait_s,
+            "nbytes": self._chunk_nbytes,
+            "start_time": perf_counter(),
+        }
+        self._slot_index = None
+        with self._io_lock:
+            self._io_lock.wait_for(lambda: len(self._io_in_flight) < self._io_depth)
+            self._io_in_flight.append(entry)
+            entry["future"] = self._io_pool.submit(write, *args)
+        entry["future"].add_done_callback(self._complete_chunks)
+
+    def _complete_chunks(self, future: Future) -> None:
+        """
+        Release completed chunks from the head of the in flight queue.\n
+        Called on the io thread of each finished write.
+
+        :param future: Future of the finished write
+        :type future: concurrent.futures.Future
+        """
+
+        with self._io_lock:
+            while self._io_in_flight and self._io_in_flight[0]["future"].done():
+                entry = self._io_in_flight[0]
+                latency_s = perf_counter() - entry["start_time"]
+                if entry["future"].exception() is not None and self._io_error is None:
+                    self._io_error = entry["future"].exception()
+                    self._log_queue.put(f"{self._filename}: writing chunk {entry['chunk_num']} failed: {self._io_error}")
+                    self._abort.set()
+                if self._io_error is None:
+                    self._written_chunk_count.value += 1
+                if self._buffer is not None:
+                    self._buffer.release_read_slot(entry["slot_index"])
+                else:
+                    self.done_reading.set()
+                self._metrics.record(entry["chunk_num"], entry["wait_s"], 0.0, latency_s, entry["nbytes"])
+                self._progress.value = (entry["chunk_num"] + 1) / entry["chunk_total"]
+                self._io_in_flight.popleft()
+            self._io_lock.notify_all()
+
+    def _wait_chunks(self) -> None:
+        """
+        Wait for all chunk writes in flight and shut down the io thread pool.
+
+        :raise Exception: Re-raises the first exception of a failed write
+        """
+
+        if self._io_pool is None:
+            return
+        self._io_pool.shutdown(wait=True)
+        self._io_pool = None
+        self._raise_io_error()
+
+    def _raise_io_error(self) -> None:
+        """
+        Re-raise the exception of a failed chunk write.
+        """
+
+        if self._io_error is not None:
+            raise self._io_error
+
+    def _detach_chunks(self) -> None:
+        """
+        Close all shared memory attached by the run process.\n
+        All references to chunks must be dropped before calling.
+        """
+
+        self._shm_frames.clear()
+        for shm in self._shm_blocks.values():
+            shm.close()
+        self._shm_blocks.clear()
+
     @abstractmethod
     def _run(self):
         """
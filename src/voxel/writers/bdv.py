@@ -3,14 +3,15 @@ import os
 import sys
 from ctypes import c_wchar
 from math import ceil
-from multiprocessing import Array, Process
-from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from time import perf_counter, sleep
+from typing import Optional
 
+import h5py
 import numpy as np
 
-from voxel.writers.base import BaseWriter
+from voxel.writers.base import SPAWN_CONTEXT, BaseWriter
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
 from voxel.writers.bdv_writer import npy2bdv
 from voxel.descriptors.deliminated_property import DeliminatedProperty
 
@@ -24,6 +25,22 @@ B3D_READ_NOISE = 1.5  # e-
 
 COMPRESSION_TYPES = {"none": None, "gzip": "gzip", "lzf": "lzf", "b3d": "b3d"}
 
+# pyramid subsampling factors xyz
+# TODO CALCULATE THESE AS WITH ZARRV3 WRITER
+SUBSAMPLING_FACTORS = (
+    (1, 1, 1),
+    (2, 2, 2),
+    (4, 4, 4),
+)
+# chunksize xyz
+BLOCK_SHAPES = (
+    (4, 256, 256),
+    (4, 256, 256),
+    (4, 256, 256),
+    (4, 256, 256),
+    (4, 256, 256),
+)
+
 
 # TODO ADD DOWNSAMPLE METHOD TO GET PASSED INTO NPY2BDV
 
@@ -191,14 +208,20 @@ class BDVWriter(BaseWriter):
                 int(B3D_READ_NOISE * 1000),
             )
 
-    def prepare(self):
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
         """
         Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
         """
 
         self.log.info(f"{self._filename}: intializing writer.")
+        self._buffer = buffer
+        self._abort.clear()
         # Specs for reconstructing the shared memory object.
-        self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
+        self._shm_name = SPAWN_CONTEXT.Array(c_wchar, 32)  # hidden and exposed via property.
         # opinioated decision on chunking dimension order
         chunk_dim_order = ("z", "y", "x")
         # This is almost always going to be: (chunk_size, rows, columns).
@@ -290,7 +313,7 @@ class BDVWriter(BaseWriter):
         self.affine_shift_dict[(self.current_tile_num, self.current_channel_num)] = (
             affine_shift
         )
-        self._process = Process(
+        self._process = SPAWN_CONTEXT.Process(
             target=self._run,
             args=(shm_shape, shm_nbytes, self._progress, self._log_queue),
         )
@@ -326,21 +349,8 @@ class BDVWriter(BaseWriter):
         logger.addHandler(log_handler)
 
         # compute necessary inputs to BDV/XML files
-        # pyramid subsampling factors xyz
-        # TODO CALCULATE THESE AS WITH ZARRV3 WRITER
-        subsamp = (
-            (1, 1, 1),
-            (2, 2, 2),
-            (4, 4, 4),
-        )
-        # chunksize xyz
-        blockdim = (
-            (4, 256, 256),
-            (4, 256, 256),
-            (4, 256, 256),
-            (4, 256, 256),
-            (4, 256, 256),
-        )
+        subsamp = SUBSAMPLING_FACTORS
+        blockdim = BLOCK_SHAPES
         # bdv requires input string not Path
         filepath = str(
             Path(self._path, self._acquisition_name, self._filename).absolute()
@@ -399,11 +409,10 @@ class BDVWriter(BaseWriter):
         chunk_total = ceil(self._frame_count_px_px / CHUNK_COUNT_PX)
         for chunk_num in range(chunk_total):
             # wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=shm_nbytes)
-            frames = np.ndarray(shm_shape, self._data_type, buffer=shm.buf)
+            frames = self._read_chunk(chunk_num, shm_shape, shm_nbytes)
+            if frames is None:
+                # writer was aborted or timed out waiting for data.
+                break
             shared_log_queue.put(
                 f"{self._filename}: writing chunk "
                 f"{chunk_num + 1}/{chunk_total} of size {frames.shape}."
@@ -418,12 +427,8 @@ class BDVWriter(BaseWriter):
                 channel=self.current_channel_num,
             )
             frames = None
-            shared_log_queue.put(
-                f"{self._filename}: writing chunk took "
-                f"{perf_counter() - start_time:.2f} [s]"
-            )
-            shm.close()
-            self.done_reading.set()
+            self._release_chunk()
+            self._record_chunk(chunk_num, write_s=perf_counter() - start_time)
             # update shared progress value
             shared_progress.value = (chunk_num + 1) / chunk_total
 
@@ -431,8 +436,11 @@ class BDVWriter(BaseWriter):
                 f"{self._filename}: {self._progress.value * 100:.2f} [%] complete."
             )
 
+        # wait for the downsampled levels streamed off the write path.
+        bdv_writer.finish_pyramids()
+
         # wait for file writing to finish.
-        while shared_progress.value < 1.0:
+        while shared_progress.value < 1.0 and not self._abort.is_set():
             sleep(0.5)
             shared_log_queue.put(
                 f"waiting for data writing to complete for "
@@ -440,9 +448,8 @@ class BDVWriter(BaseWriter):
                 f"{self._progress.value * 100:.2f} [%] complete."
             )
 
-        # check and empty queue to avoid code hanging in process
-        if not shared_log_queue.empty:
-            shared_log_queue.get_nowait()
+        # release shared memory attached during the run
+        self._detach_chunks()
 
         # write xml file
         bdv_writer.write_xml()
@@ -472,12 +479,42 @@ class BDVWriter(BaseWriter):
             )
         bdv_writer.close()
 
+    def _estimate_level_count(self, shape: tuple) -> int:
+        """
+        Number of pyramid levels written for a sample of frames.
+
+        :param shape: Sample shape (z, y, x)
+        :type shape: tuple
+        :return: Number of levels, including full resolution
+        :rtype: int
+        """
+
+        return len(SUBSAMPLING_FACTORS)
+
+    def _compressed_nbytes(self, frames: np.ndarray) -> int:
+        """
+        Size of frames written to an in memory hdf5 dataset with the\n
+        configured filter and block shape.
+
+        :param frames: Frames (z, y, x)
+        :type frames: numpy.ndarray
+        :return: Compressed size in bytes
+        :rtype: int
+        """
+
+        chunks = tuple(min(block, size) for block, size in zip(BLOCK_SHAPES[0], frames.shape))
+        with h5py.File("compression_estimate.h5", "w", driver="core", backing_store=False) as f:
+            dataset = f.create_dataset(
+                "cells",
+                data=frames,
+                chunks=chunks,
+                compression=self._compression,
+                compression_opts=self.compression_opts,
+            )
+            return dataset.id.get_storage_size()
+
     def delete_files(self):
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
-        xmlpath = (
-            Path(self._path, self._acquisition_name, self._filename)
-            .absolute()
-            .replace("h5", "xml")
-        )
+        xmlpath = filepath.with_suffix(".xml")
         os.remove(filepath)
         os.remove(xmlpath)
\ No newline at end of file
@@ -10,7 +10,8 @@ import skimage.transform
 import shutil
 from pathlib import Path
 from tqdm import trange
-from voxel.processes.downsample.gpu.gputools.downsample_3d import GPUToolsDownSample3D
+from voxel.processes.downsample.registry import best_downsampler
+from voxel.writers.bdv_writer.pyramid import StreamingPyramid
 
 
 class BdvBase:
@@ -52,8 +53,10 @@ class BdvBase:
         self.ntimes = self.nilluminations = self.nchannels = self.ntiles = self.nangles = self.nsetups = 0
         self.compression = None
         self.compressions_supported = (None, 'gzip', 'lzf', 'b3d')
-        # initialize the downsampling in 3d
-        self.gpu_binning = GPUToolsDownSample3D(binning=2)
+        # downsampling in 3d, the fastest available backend is picked on first use
+        self.gpu_binning = None
+        # streaming pyramids keyed by (time, setup)
+        self._pyramids = {}
 
     def _determine_setup_id(self, illumination=0, channel=0, tile=0, angle=0):
         """Takes the view attributes (illumination, channel, tile, angle) and converts them into unique setup_id.
@@ -243,16 +246,67 @@ class BdvBase:
         self._write_pyramids_header()
         for time in trange(self.ntimes, desc='time points'):
             for isetup in trange(self.nsetups, desc='views'):
-                for ilevel in range(1, self.nlevels):
-                    full_res_group_name = self._fmt.format(time, isetup, 0)
-                    if full_res_group_name in self._file_object_h5:
-                        raw_data = self._file_object_h5[full_res_group_name]['cells'][()].astype('uint16')
-                        pyramid_group_name = self._fmt.format(time, isetup, ilevel)
-                        grp = self._file_object_h5.create_group(pyramid_group_name)
-                        if ilevel >0:
-                            raw_data = self.gpu_binning.run(raw_data).astype('int16')
-                        grp.create_dataset('cells', data=subdata, chunks=tuple(self.chunks[ilevel]),
-                                           maxshape=(None, None, None), compression=self.compression, compression_opts=self.compression_opts, dtype='int16')
+                full_res_group_name = self._fmt.format(time, isetup, 0)
+                if full_res_group_name in self._file_object_h5:
+                    # stream the full resolution in blocks instead of loading it into memory
+                    raw_dataset = self._file_object_h5[full_res_group_name]['cells']
+                    for ilevel in range(1, self.nlevels):
+                        grp = self._file_object_h5.create_group(self._fmt.format(time, isetup, ilevel))
+                        grp.create_dataset('cells', shape=tuple(np.asarray(raw_dataset.shape) // 2**ilevel),
+                                           chunks=tuple(self.chunks[ilevel]), maxshape=(None, None, None),
+                                           compression=self.compression, compression_opts=self.compression_opts,
+                                           dtype='int16')
+                    pyramid = self._pyramid(time, isetup)
+                    slab_z = int(np.max(self.chunks[:, 0]) * 2**(self.nlevels - 1))
+                    for z_start in range(0, raw_dataset.shape[0], slab_z):
+                        pyramid.push(raw_dataset[z_start:z_start + slab_z].astype('uint16'), z_start)
+                    pyramid.finish()
+                    del self._pyramids[(time, isetup)]
+
+    def _pyramid(self, time, isetup) -> StreamingPyramid:
+        """Get the streaming pyramid of a view, creating it on first use.
+
+        Parameters:
+        -----------
+            time: int
+                Time index of the view, >=0.
+            isetup: int
+                Setup id of the view, >=0.
+
+        Returns:
+        --------
+            StreamingPyramid writing levels > 0 of the view.
+        """
+        if (time, isetup) not in self._pyramids:
+            def write_slab(ilevel, z_start, slab):
+                dataset = self._file_object_h5[self._fmt.format(time, isetup, ilevel)]["cells"]
+                dataset[z_start:z_start + slab.shape[0], :slab.shape[1], :slab.shape[2]] = slab
+            self._pyramids[(time, isetup)] = StreamingPyramid(self.nlevels, write_slab,
+                                                              tuple(chunk[0] for chunk in self.chunks),
+                                                              dtype='int16', downsample=self.gpu_binning)
+        return self._pyramids[(time, isetup)]
+
+    def _get_binning(self, stack):
+        """Get the 2x downsampler, picked from the fastest available backend for the first stack binned.
+
+        Parameters:
+        -----------
+            stack: numpy array (z,y,x)
+                Stack to be downsampled.
+
+        Returns:
+        --------
+            BaseDownSample with a 2x binning.
+        """
+        if self.gpu_binning is None:
+            self.gpu_binning = best_downsampler(stack.shape, stack.dtype, 2)
+        return self.gpu_binning
+
+    def finish_pyramids(self):
+        """Wait for all streaming pyramids to be written."""
+        for pyramid in self._pyramids.values():
+            pyramid.finish()
+        self._pyramids = {}
 
 
 class BdvWriter(BdvBase):
@@ -449,12 +503,20 @@ class BdvWriter(BdvBase):
             f"Substack offset {y_start} + y-dim {substack.shape[1]} > virtual stack y-dim {self.stack_shapes[isetup][1]}."
         assert x_start + substack.shape[2] <= self.stack_shapes[isetup][2], \
             f"Substack offset {x_start} + x-dim {substack.shape[2]} > virtual stack x-dim {self.stack_shapes[isetup][2]}."
+        if y_start == 0 and x_start == 0 and substack.shape[1:] == tuple(self.stack_shapes[isetup][1:]):
+            # full frames: write full resolution and stream the pyramid off the write path
+            group_name = self._fmt.format(time, isetup, 0)
+            self._file_object_h5[group_name]["cells"][z_start:z_start + substack.shape[0]] = substack
+            self._pyramid(time, isetup).push(substack, z_start)
+            return
+        # all levels are binned in one sweep over the substack
+        levels = [substack]
+        if self.nlevels > 1:
+            levels += self._get_binning(substack).run_pyramid(substack, self.nlevels - 1)
         for ilevel in range(self.nlevels):
             group_name = self._fmt.format(time, isetup, ilevel)
             dataset = self._file_object_h5[group_name]["cells"]
-            # change subsampling to ingest the previous pyramid and not _subsample_stack function
-            if ilevel > 0:
-                substack = self.gpu_binning.run(substack).astype('int16')
+            substack = levels[ilevel].astype('int16') if ilevel > 0 else levels[ilevel]
             sub_z_start = int(z_start/2**ilevel)
             sub_y_start = int(y_start/2**ilevel)
             sub_x_start = int(x_start/2**ilevel)
@@ -521,7 +583,7 @@ class BdvWriter(BdvBase):
             else:
                 grp = self._file_object_h5.create_group(group_name)
                 if stack is not None:
-                    stack = self.gpu_binning.run(stack).astype('int16')
+                    stack = self._get_binning(stack).run(stack).astype('int16')
                     grp.create_dataset('cells', data=stack, chunks=self.chunks[ilevel],
                                        maxshape=(None, None, None), compression=self.compression, compression_opts=self.compression_opts, dtype='int16')
                 else:  # a virtual stack initialized
@@ -686,6 +748,7 @@ class BdvWriter(BdvBase):
 
     def close(self):
         """Save changes and close the H5 file."""
+        self.finish_pyramids()
         self._file_object_h5.flush()
         self._file_object_h5.close()
 
@@ -0,0 +1,241 @@
+import logging
+import threading
+from queue import Queue
+from typing import Callable, Optional
+
+import numpy as np
+
+from voxel.processes.downsample.base import BaseDownSample
+from voxel.processes.downsample.cpu.numpy.downsample_3d import NPDownSample3D
+from voxel.processes.downsample.registry import best_downsampler
+
+# maximum number of downsampled slabs waiting for the worker thread
+MAX_PENDING_SLABS = 8
+
+
+class StreamingPyramid:
+    """
+    Streaming 2x image pyramid for a single view.
+
+    Full resolution substacks are pushed in z order. Each level keeps a\n
+    partial-chunk accumulator so substacks of any z size can be binned,\n
+    and slabs are only written once they fill whole blocks in z. The first\n
+    2x reduction runs in the calling thread so the caller can release its\n
+    input right away; all further levels and all writes run on a worker thread.\n
+    For substacks aligned to whole bins of the coarsest level the worker\n
+    bins level 1 into all further levels in one sweep with run_pyramid.
+
+    Level shapes follow integer division, i.e. level n has shape\n
+    full_shape // 2**n, matching the datasets created by npy2bdv.
+
+    :param level_count: Number of levels, including full resolution
+    :type level_count: int
+    :param write_slab: Callable(level, z_start, slab) that writes a slab of a level
+    :type write_slab: Callable
+    :param block_z_px: Block size in z of every level, used to align writes
+    :type block_z_px: tuple
+    :param dtype: Data type of the written slabs
+    :type dtype: str
+    :param downsample: 2x downsampler, None picks the fastest available backend\n
+    on the first slab, falls back to numpy if it fails
+    :type downsample: BaseDownSample
+    """
+
+    def __init__(
+        self,
+        level_count: int,
+        write_slab: Callable[[int, int, np.ndarray], None],
+        block_z_px: tuple,
+        dtype: str = "int16",
+        downsample: Optional[BaseDownSample] = None,
+    ):
+        self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._level_count = level_count
+        self._write_slab = write_slab
+        self._block_z_px = block_z_px
+        self._dtype = dtype
+        self._downsample = downsample
+        self._cpu_downsample = NPDownSample3D(binning=2)
+        # planes of each level that could not be paired in z yet
+        self._unbinned = [None] * level_count
+        # planes of each level that do not fill a whole block in z yet
+        self._unwritten = [None] * level_count
+        # z offset of the next plane written for each level
+        self._z_written = [0] * level_count
+        self._z_next = 0
+        self._queue = Queue(maxsize=MAX_PENDING_SLABS)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def push(self, substack: np.ndarray, z_start: int):
+        """
+        Push the next full resolution substack, the substack can be\n
+        released once this returns.
+
+        :param substack: Full resolution (z, y, x) substack
+        :type substack: numpy.ndarray
+        :param z_start: Z offset of the substack, must follow the previous substack
+        :type z_start: int
+        :raises ValueError: Substacks are not pushed contiguously in z
+        """
+
+        self._raise_worker_error()
+        if z_start != self._z_next:
+            raise ValueError(f"substack z offset {z_start} does not follow previous substack at {self._z_next}")
+        self._z_next += substack.shape[0]
+        if self._level_count < 2:
+            return
+        # planes are paired in order, so no level carries an unpaired plane
+        # when the substack starts and ends on whole bins of the coarsest level
+        coarsest_bin_px = 2 ** (self._level_count - 1)
+        fused = z_start % coarsest_bin_px == 0 and substack.shape[0] % coarsest_bin_px == 0
+        slab = self._bin(0, substack)
+        if slab is not None:
+            self._queue.put((1, slab, fused))
+
+    def finish(self):
+        """
+        Wait for all queued levels to be written and flush partial blocks.
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_worker_error()
+        for level in range(1, self._level_count):
+            self._flush(level, final=True)
+
+    def _raise_worker_error(self):
+        """
+        Re-raise an exception raised by the worker thread.
+        """
+
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        """
+        Worker thread that writes each level and bins it into the next.
+        """
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                level, slab, fused = item
+                if fused:
+                    slabs = [slab] + self._bin_pyramid(slab, self._level_count - 1 - level)
+                    for level, slab in enumerate(slabs, start=level):
+                        self._accumulate(level, slab)
+                        self._flush(level)
+                    continue
+                while slab is not None:
+                    self._accumulate(level, slab)
+                    self._flush(level)
+                    if level + 1 >= self._level_count:
+                        break
+                    slab = self._bin(level, slab)
+                    level += 1
+            except Exception as e:
+                self._error = e
+
+    def _bin(self, level: int, slab: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Bin a slab of a level by 2x, carrying an unpaired z plane over to\n
+        the next call.
+
+        :param level: Level of the slab
+        :type level: int
+        :param slab: Slab of the level
+        :type slab: numpy.ndarray
+        :return: Slab of the next level, None if no plane pair is available yet
+        :rtype: numpy.ndarray
+        """
+
+        if self._unbinned[level] is not None:
+            slab = np.concatenate((self._unbinned[level], slab))
+            self._unbinned[level] = None
+        z_count = slab.shape[0] - slab.shape[0] % 2
+        if slab.shape[0] > z_count:
+            # copy so the caller's buffer is not referenced after returning
+            self._unbinned[level] = np.array(slab[z_count:])
+        if z_count == 0:
+            return None
+        # crop odd rows and columns, level shapes use integer division
+        y_count = slab.shape[1] - slab.shape[1] % 2
+        x_count = slab.shape[2] - slab.shape[2] % 2
+        slab = slab[:z_count, :y_count, :x_count]
+        if self._downsample is None:
+            self._downsample = best_downsampler(slab.shape, slab.dtype, 2)
+        if self._downsample is not self._cpu_downsample:
+            try:
+                return np.asarray(self._downsample.run(slab)).astype(self._dtype)
+            except Exception as e:
+                self.log.warning(f"downsampling failed, falling back to numpy: {e}")
+                self._downsample = self._cpu_downsample
+        return self._cpu_downsample.run(slab).astype(self._dtype)
+
+    def _bin_pyramid(self, slab: np.ndarray, level_count: int) -> list:
+        """
+        Bin a slab into the following levels in one sweep.
+
+        :param slab: Slab of a level, z size a multiple of the coarsest bin
+        :type slab: numpy.ndarray
+        :param level_count: Number of levels to bin into
+        :type level_count: int
+        :return: Slabs of the next level_count levels
+        :rtype: list
+        """
+
+        if level_count < 1:
+            return list()
+        if self._downsample is None:
+            self._downsample = best_downsampler(slab.shape, slab.dtype, 2)
+        if self._downsample is not self._cpu_downsample:
+            try:
+                slabs = self._downsample.run_pyramid(slab, level_count)
+                return [np.asarray(level_slab).astype(self._dtype) for level_slab in slabs]
+            except Exception as e:
+                self.log.warning(f"downsampling failed, falling back to numpy: {e}")
+                self._downsample = self._cpu_downsample
+        slabs = self._cpu_downsample.run_pyramid(slab, level_count)
+        return [level_slab.astype(self._dtype) for level_slab in slabs]
+
+    def _accumulate(self, level: int, slab: np.ndarray):
+        """
+        Add a slab to the write accumulator of its level.
+
+        :param level: Level of the slab
+        :type level: int
+        :param slab: Slab of the level
+        :type slab: numpy.ndarray
+        """
+
+        if self._unwritten[level] is None:
+            self._unwritten[level] = slab
+        else:
+            self._unwritten[level] = np.concatenate((self._unwritten[level], slab))
+
+    def _flush(self, level: int, final: bool = False):
+        """
+        Write the whole blocks held in the accumulator of a level.
+
+        :param level: Level to flush
+        :type level: int
+        :param final: Also write a trailing partial block
+        :type final: bool
+        """
+
+        unwritten = self._unwritten[level]
+        if unwritten is None:
+            return
+        block_z_px = self._block_z_px[level]
+        z_count = unwritten.shape[0] if final else unwritten.shape[0] - unwritten.shape[0] % block_z_px
+        if z_count == 0:
+            return
+        self._write_slab(level, self._z_written[level], unwritten[:z_count])
+        self._z_written[level] += z_count
+        self._unwritten[level] = unwritten[z_count:] if z_count < unwritten.shape[0] else None
@@ -0,0 +1,248 @@
+from ctypes import c_double, c_longlong
+from multiprocessing import get_context
+from time import monotonic
+from typing import Optional
+
+import numpy as np
+
+# per chunk record, times in seconds, end_time_s on the monotonic clock shared by all processes
+METRIC_FIELDS = ("chunk_index", "end_time_s", "wait_s", "copy_s", "write_s", "nbytes", "compressed_nbytes")
+# window of the rolling throughput and latency statistics
+ROLLING_WINDOW_S = 10.0
+# log spaced latency histogram bin edges from 1 ms to 100 s
+LATENCY_BIN_EDGES_S = np.logspace(-3, 2, 21)
+# fraction of time the writer is busy above which it is about to fall behind the producer
+SATURATED_BUSY_FRACTION = 0.9
+
+
+# created in the spawn context so spawned writer processes can inherit them
+SPAWN_CONTEXT = get_context("spawn")
+
+class SharedChunkMetrics:
+    """
+    A single-writer-multi-reader multi-process ring of per chunk metrics\n
+    implemented as a shared ctypes array.
+
+    The writer process records one row per written chunk, any process\n
+    holding the object reads rolling throughput, latency percentiles and\n
+    histograms. Once capacity chunks are recorded the oldest are overwritten.
+
+    :param capacity: number of chunk records kept
+    :type capacity: int
+    :raise ValueError: Invalid capacity
+
+    .. code-block: python
+
+        metrics = SharedChunkMetrics(capacity=1024)
+
+        # writer process
+        metrics.record(0, wait_s=0.01, copy_s=0.02, write_s=0.1, nbytes=2**29)
+
+        # any process
+        metrics.throughput_mb_s()
+        counts, edges = metrics.histogram("write_s")
+    """
+
+    def __init__(self, capacity: int = 1024):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.capacity = capacity
+        # the lock of the record array also guards the counter and start time.
+        self._values = SPAWN_CONTEXT.Array(c_double, capacity * len(METRIC_FIELDS))
+        self._count = SPAWN_CONTEXT.Value(c_longlong, 0, lock=False)
+        self._start_time_s = SPAWN_CONTEXT.Value(c_double, monotonic(), lock=False)
+        self._records = self._attach()
+
+    def _attach(self) -> np.ndarray:
+        """
+        Numpy view of the shared record array.
+
+        :return: Records, one row per slot
+        :rtype: numpy.ndarray
+        """
+
+        return np.frombuffer(self._values.get_obj(), dtype=np.float64).reshape(self.capacity, len(METRIC_FIELDS))
+
+    @property
+    def count(self) -> int:
+        """
+        Number of chunks recorded since the last reset.
+
+        :return: Number of chunks
+        :rtype: int
+        """
+
+        return self._count.value
+
+    def reset(self) -> None:
+        """
+        Drop all records and restart the clock of the throughput statistics.
+        """
+
+        with self._values.get_lock():
+            self._count.value = 0
+            self._start_time_s.value = monotonic()
+
+    def record(
+        self,
+        chunk_index: int,
+        wait_s: float,
+        copy_s: float,
+        write_s: float,
+        nbytes: int,
+        compressed_nbytes: Optional[int] = None,
+    ) -> None:
+        """
+        Record a written chunk, called by the writer process.
+
+        :param chunk_index: Index of the chunk within the stack
+        :type chunk_index: int
+        :param wait_s: Time spent waiting for the chunk
+        :type wait_s: float
+        :param copy_s: Time spent copying or downsampling the chunk
+        :type copy_s: float
+        :param write_s: Time spent writing the chunk
+        :type write_s: float
+        :param nbytes: Uncompressed chunk size in bytes
+        :type nbytes: int
+        :param compressed_nbytes: Size written to disk, None if the writer cannot tell
+        :type compressed_nbytes: int
+        """
+
+        row = (
+            chunk_index,
+            monotonic(),
+            wait_s,
+            copy_s,
+            write_s,
+            nbytes,
+            np.nan if compressed_nbytes is None else compressed_nbytes,
+        )
+        with self._values.get_lock():
+            self._records[self._count.value % self.capacity] = row
+            self._count.value += 1
+
+    def records(self, window_s: Optional[float] = None) -> np.ndarray:
+        """
+        Copy of the kept records, oldest first.
+
+        :param window_s: Only return chunks completed within this many seconds, None returns all
+        :type window_s: float
+        :return: Records with one field per METRIC_FIELDS entry
+        :rtype: numpy.ndarray
+        """
+
+        with self._values.get_lock():
+            count = self._count.value
+            # once wrapped, the oldest record sits at the next write position
+            rows = np.roll(self._records, -count, axis=0) if count > self.capacity else self._records[:count].copy()
+        records = np.rec.fromarrays(rows.T, names=METRIC_FIELDS).view(np.ndarray)
+        if window_s is not None:
+            records = records[records["end_time_s"] >= monotonic() - window_s]
+        return records
+
+    def throughput_mb_s(self, window_s: float = ROLLING_WINDOW_S) -> float:
+        """
+        Uncompressed data rate of the chunks completed within a window.
+
+        :param window_s: Window in seconds
+        :type window_s: float
+        :return: Throughput in MB/s
+        :rtype: float
+        """
+
+        records = self.records(window_s)
+        elapsed_s = min(window_s, monotonic() - self._start_time_s.value)
+        if elapsed_s <= 0:
+            return 0.0
+        return float(records["nbytes"].sum()) / 1024**2 / elapsed_s
+
+    def histogram(
+        self, field: str = "write_s", bin_edges_s: np.ndarray = LATENCY_BIN_EDGES_S, window_s: Optional[float] = None
+    ) -> tuple:
+        """
+        Latency histogram of one of the timing fields.
+
+        :param field: wait_s, copy_s or write_s
+        :type field: str
+        :param bin_edges_s: Bin edges in seconds
+        :type bin_edges_s: numpy.ndarray
+        :param window_s: Only include chunks completed within this many seconds, None includes all
+        :type window_s: float
+        :raise ValueError: Field is not a timing field
+        :return: Counts per bin and bin edges
+        :rtype: tuple
+        """
+
+        if field not in ("wait_s", "copy_s", "write_s"):
+            raise ValueError("field must be one of %r." % ["wait_s", "copy_s", "write_s"])
+        return np.histogram(self.records(window_s)[field], bins=bin_edges_s)
+
+    def summary(self, window_s: float = ROLLING_WINDOW_S) -> dict:
+        """
+        Rolling statistics of the chunks completed within a window.
+
+        busy_fraction is the share of time spent copying and writing rather\n
+        than waiting for chunks. A writer close to 1 keeps up only just and\n
+        the producer will soon block on it.
+
+        :param window_s: Window in seconds
+        :type window_s: float
+        :return: Chunk count, throughput, latency percentiles, compression ratio and busy fraction
+        :rtype: dict
+        """
+
+        records = self.records(window_s)
+        summary = {
+            "chunk_count": len(records),
+            "throughput_mb_s": self.throughput_mb_s(window_s),
+            "compression_ratio": None,
+            "busy_fraction": None,
+        }
+        for field in ("wait_s", "copy_s", "write_s"):
+            values = records[field] * 1000
+            for name, value in (("mean", np.mean), ("p50", np.median), ("p99", lambda v: np.percentile(v, 99))):
+                summary[f"{field[:-2]}_{name}_ms"] = float(value(values)) if len(values) else None
+        if len(records):
+            compressed = ~np.isnan(records["compressed_nbytes"])
+            if compressed.any() and records["compressed_nbytes"][compressed].sum() > 0:
+                summary["compression_ratio"] = float(
+                    records["nbytes"][compressed].sum() / records["compressed_nbytes"][compressed].sum()
+                )
+            busy_s = float((records["copy_s"] + records["write_s"]).sum())
+            total_s = busy_s + float(records["wait_s"].sum())
+            summary["busy_fraction"] = busy_s / total_s if total_s > 0 else None
+        return summary
+
+    def is_saturated(self, threshold: float = SATURATED_BUSY_FRACTION, window_s: float = ROLLING_WINDOW_S) -> bool:
+        """
+        Whether the writer spends nearly all its time writing within a window.
+
+        :param threshold: Busy fraction above which the writer is saturated
+        :type threshold: float
+        :param window_s: Window in seconds
+        :type window_s: float
+        :return: True if the writer is saturated
+        :rtype: bool
+        """
+
+        busy_fraction = self.summary(window_s)["busy_fraction"]
+        return busy_fraction is not None and busy_fraction > threshold
+
+    def __getstate__(self):
+        """
+        Drop the process local numpy view when pickled into another\n
+        process, it would otherwise be copied by value.
+        """
+
+        state = self.__dict__.copy()
+        del state["_records"]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Re-attach to the shared record array when unpickled in another process.
+        """
+
+        self.__dict__.update(state)
+        self._records = self._attach()
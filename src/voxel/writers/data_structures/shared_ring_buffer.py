@@ -0,0 +1,225 @@
+import os
+from ctypes import c_longlong
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import numpy as np
+
+
+# created in the spawn context so spawned writer processes can inherit them
+SPAWN_CONTEXT = get_context("spawn")
+
+class SharedRingBuffer:
+    """
+    A single-producer-single-consumer multi-process ring buffer with\n
+    a configurable number of chunk slots implemented as numpy ndarrays.
+
+    The producer side exposes the same interface as SharedDoubleBuffer\n
+    (write_buf, read_buf_mem_name, toggle_buffers, ...) but only blocks\n
+    when every slot is still waiting to be read out by the consumer.
+
+    :param shape: shape of a single chunk slot
+    :type shape: tuple
+    :param dtype: data type of the buffer
+    :type dtype: str
+    :param slot_count: number of chunk slots, must be >= 2
+    :type slot_count: int
+    :raise ValueError: Invalid slot count
+
+    .. code-block: python
+
+        ring_buf = SharedRingBuffer((8, 320, 240), 'uint16', slot_count=4)
+
+        # producer
+        ring_buf.write_buf[0][:,:] = np.zeros((320, 240), dtype='uint16')
+        ring_buf.toggle_buffers() # commit the slot and move to the next free one.
+
+        # consumer (typically inside a writer process)
+        slot = ring_buf.acquire_read_slot()
+        frames = ring_buf.slots[slot]
+        ...
+        frames = None
+        ring_buf.release_read_slot(slot)
+    """
+
+    def __init__(self, shape: tuple, dtype: str, slot_count: int = 4):
+        if slot_count < 2:
+            raise ValueError("slot count must be >= 2")
+        # overflow errors without casting for large datasets
+        nbytes = int(np.prod(shape, dtype=np.int64) * np.dtype(dtype).itemsize)
+        self.mem_blocks = [SharedMemory(create=True, size=nbytes) for _ in range(slot_count)]
+        # attach numpy array references to shared memory.
+        self.slots = [np.ndarray(shape, dtype=dtype, buffer=mem.buf) for mem in self.mem_blocks]
+        # attach references to the names of the memory locations.
+        self.mem_names = [mem.name for mem in self.mem_blocks]
+        # save values for querying later.
+        self.dtype = dtype
+        self.shape = shape
+        self.nbytes = nbytes
+        self.slot_count = slot_count
+        # per-slot sequence numbers, -1 marks a slot that has never been committed.
+        self.sequence_numbers = SPAWN_CONTEXT.Array(c_longlong, [-1] * slot_count)
+        # the producer always owns the slot it is writing into, so one less slot starts free.
+        self.free_slots = SPAWN_CONTEXT.Semaphore(slot_count - 1)
+        self.full_slots = SPAWN_CONTEXT.Semaphore(0)
+        # producer and consumer cursors, each is only used on its own side.
+        self.write_index = 0
+        self.read_index = 0
+        self.sequence_number = 0
+        # initialize buffer index
+        self.buffer_index = -1
+        # only the creating process unlinks, also when the buffer is inherited by a forked process.
+        self._owner_pid = os.getpid()
+
+    @property
+    def write_buf(self) -> np.ndarray:
+        """
+        Slot currently being filled by the producer.
+
+        :return: Write slot
+        :rtype: numpy.ndarray
+        """
+
+        return self.slots[self.write_index]
+
+    @property
+    def write_buf_mem_name(self) -> str:
+        """
+        Shared memory name of the slot currently being filled by the producer.
+
+        :return: Shared memory name
+        :rtype: str
+        """
+
+        return self.mem_names[self.write_index]
+
+    @property
+    def read_buf(self) -> np.ndarray:
+        """
+        Most recently committed slot.
+
+        :return: Read slot
+        :rtype: numpy.ndarray
+        """
+
+        return self.slots[(self.write_index - 1) % self.slot_count]
+
+    @property
+    def read_buf_mem_name(self) -> str:
+        """
+        Shared memory name of the most recently committed slot.
+
+        :return: Shared memory name
+        :rtype: str
+        """
+
+        return self.mem_names[(self.write_index - 1) % self.slot_count]
+
+    def toggle_buffers(self, timeout: Optional[float] = None):
+        """
+        Commit the write slot to the consumer and move the producer to\n
+        the next free slot.
+
+        :param timeout: Maximum time in seconds to wait for a free slot
+        :type timeout: float
+        :raise TimeoutError: No slot was released by the consumer in time
+        """
+
+        # claim the next slot before committing so a timeout leaves the buffer untouched.
+        if not self.free_slots.acquire(timeout=timeout):
+            raise TimeoutError(f"no free slot in ring buffer after {timeout} [s]")
+        self.sequence_numbers[self.write_index] = self.sequence_number
+        self.sequence_number += 1
+        self.full_slots.release()
+        self.write_index = (self.write_index + 1) % self.slot_count
+        # reset buffer index
+        self.buffer_index = -1
+
+    def add_image(self, image: np.array):
+        """
+        Add an image into the buffer at the correct index.
+        """
+
+        self.write_buf[self.buffer_index + 1] = image
+        self.buffer_index += 1
+
+    def get_last_image(self):
+        """
+        Get the last image from the buffer.
+
+        :return: Last image from the buffer
+        :rtype: numpy.array
+        """
+
+        if self.buffer_index == -1:
+            # buffer just switched, grab last image from the committed slot
+            return self.read_buf[-1]
+        else:
+            # return the image from the write buffer
+            return self.write_buf[self.buffer_index]
+
+    def acquire_read_slot(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Block until the producer commits a slot and return its index.
+
+        :param timeout: Maximum time in seconds to wait for a committed slot
+        :type timeout: float
+        :return: Index of the slot to read, None if the timeout expired
+        :rtype: int
+        """
+
+        if not self.full_slots.acquire(timeout=timeout):
+            return None
+        slot = self.read_index
+        self.read_index = (self.read_index + 1) % self.slot_count
+        return slot
+
+    def release_read_slot(self, slot: int):
+        """
+        Hand a slot that has been read out back to the producer.
+
+        :param slot: Index of the slot returned by acquire_read_slot
+        :type slot: int
+        """
+
+        self.free_slots.release()
+
+    def __getstate__(self):
+        """
+        Drop the process local shared memory handles when pickled into\n
+        another process, numpy views would otherwise be copied by value.
+        """
+
+        state = self.__dict__.copy()
+        del state["mem_blocks"]
+        del state["slots"]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Re-attach to every slot once when unpickled in another process.
+        """
+
+        self.__dict__.update(state)
+        self.mem_blocks = [SharedMemory(name, create=False, size=self.nbytes) for name in self.mem_names]
+        self.slots = [np.ndarray(self.shape, dtype=self.dtype, buffer=mem.buf) for mem in self.mem_blocks]
+
+    def close_and_unlink(self):
+        """
+        Shared memory cleanup; call when done using this object.\n
+        Only the creating process unlinks the shared memory.
+        """
+
+        self.slots = []
+        for mem in self.mem_blocks:
+            mem.close()
+            if os.getpid() == self._owner_pid:
+                mem.unlink()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Cleanup called automatically if opened using a `with` statement.
+        """
+
+        self.close_and_unlink()
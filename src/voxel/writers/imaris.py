@@ -4,10 +4,9 @@ import sys
 from ctypes import c_wchar
 from datetime import datetime
 from math import ceil
-from multiprocessing import Array, Process
-from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from time import perf_counter, sleep
+from typing import Optional
 
 import numpy as np
 import os
@@ -15,7 +14,8 @@ from matplotlib.colors import hex2color
 from PyImarisWriter import PyImarisWriter as pw
 
 from voxel.descriptors.deliminated_property import DeliminatedProperty
-from voxel.writers.base import BaseWriter
+from voxel.writers.base import SPAWN_CONTEXT, BaseWriter
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
 
 CHUNK_COUNT_PX = 64
 DIVISIBLE_FRAME_COUNT_PX = 64
@@ -179,14 +179,40 @@ class ImarisWriter(BaseWriter):
         filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
         os.remove(filepath)
 
-    def prepare(self):
+    def _compressed_nbytes(self, frames: np.ndarray) -> int:
+        """
+        Size of frames byte shuffled and lz4 compressed in memory, as the\n
+        converter compresses each block. Imaris builds its resolution\n
+        pyramid internally, so only full resolution is estimated.
+
+        :param frames: Frames (z, y, x)
+        :type frames: numpy.ndarray
+        :return: Compressed size in bytes
+        :rtype: int
+        """
+
+        if self._compression == COMPRESSION_TYPES["none"]:
+            return frames.nbytes
+        # tifffile's codec library, imported here as it is only needed for the estimate
+        import imagecodecs
+
+        shuffled = np.ascontiguousarray(frames).view(np.uint8).reshape(-1, frames.itemsize).T
+        return len(imagecodecs.lz4_encode(shuffled.tobytes()))
+
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
         """
         Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
         """
 
         self.log.info(f"{self._filename}: intializing writer.")
+        self._buffer = buffer
+        self._abort.clear()
         # Specs for reconstructing the shared memory object.
-        self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
+        self._shm_name = SPAWN_CONTEXT.Array(c_wchar, 32)  # hidden and exposed via property.
         # opinioated decision on chunking dimension order
         chunk_dim_order = ("z", "y", "x")
         # This is almost always going to be: (chunk_size, rows, columns).
@@ -249,7 +275,7 @@ class ImarisWriter(BaseWriter):
         # date time parameters
         time_infos = [datetime.today()]
         # create run process
-        self._process = Process(
+        self._process = SPAWN_CONTEXT.Process(
             target=self._run,
             args=(
                 chunk_dim_order,
@@ -355,12 +381,11 @@ class ImarisWriter(BaseWriter):
         chunk_total = ceil(self._frame_count_px / CHUNK_COUNT_PX)
         for chunk_num in range(chunk_total):
             block_index = pw.ImageSize(x=0, y=0, z=chunk_num, c=0, t=0)
-            # Wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # Attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=shm_nbytes)
-            frames = np.ndarray(shm_shape, self._data_type, buffer=shm.buf)
+            # wait for new data.
+            frames = self._read_chunk(chunk_num, shm_shape, shm_nbytes)
+            if frames is None:
+                # writer was aborted or timed out waiting for data.
+                break
             shared_log_queue.put(
                 f"{self._filename}: writing chunk "
                 f"{chunk_num + 1}/{chunk_total} of size {frames.shape}."
@@ -370,12 +395,9 @@ class ImarisWriter(BaseWriter):
             # Put the frames back into x, y, z, c, t order.
             converter.CopyBlock(frames.transpose(dim_order), block_index)
             frames = None
-            shared_log_queue.put(
-                f"{self._filename}: writing chunk took "
-                f"{perf_counter() - start_time:.2f} [s]"
-            )
-            shm.close()
-            self.done_reading.set()
+            self._release_chunk()
+            # the converter compresses and writes blocks on its own threads
+            self._record_chunk(chunk_num, copy_s=perf_counter() - start_time)
             # update shared value progress range 0-1
             shared_progress.value = self.callback_class.progress
 
@@ -384,7 +406,7 @@ class ImarisWriter(BaseWriter):
             )
 
         # wait for file writing to finish
-        while self.callback_class.progress < 1.0:
+        while self.callback_class.progress < 1.0 and not self._abort.is_set():
             sleep(0.5)
             self._progress.value = self.callback_class.progress
             shared_log_queue.put(
@@ -394,9 +416,8 @@ class ImarisWriter(BaseWriter):
             )
         f"{self.progress.value * 100:.2f}% [%] complete."
 
-        # check and empty queue to avoid code hanging in process
-        if not shared_log_queue.empty:
-            shared_log_queue.get_nowait()
+        # release shared memory attached during the run
+        self._detach_chunks()
 
         converter.Finish(
             image_extents,
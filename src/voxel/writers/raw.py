@@ -0,0 +1,459 @@
+import errno
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+from ctypes import c_wchar
+from math import ceil
+from pathlib import Path
+from time import sleep
+from typing import Optional
+
+import numpy as np
+
+from voxel.writers.base import SPAWN_CONTEXT, BaseWriter
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+CHUNK_COUNT_PX = 64
+# offset, size and memory alignment required by O_DIRECT on common filesystems
+DIRECT_IO_ALIGNMENT_BYTES = 4096
+# largest single write, kept below the ~2 GB per call limit of os.write
+MAX_WRITE_BYTES = 1 << 30
+
+COMPRESSION_TYPES = {
+    "none": None,
+}
+
+
+class RawWriter(BaseWriter):
+    """
+    Voxel driver for the raw binary writer.
+
+    Chunks are written straight from shared memory with O_DIRECT, bypassing\n
+    the page cache, and fall back to buffered writes where O_DIRECT is not\n
+    supported. A JSON sidecar indexes the byte offset of every chunk so the\n
+    data can be memory-mapped or converted later.
+
+    Writer will save data to the following location
+
+    path\\acquisition_name\\filename.raw
+    path\\acquisition_name\\filename.json
+
+    :param path: Path for the data writer
+    :type path: str
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._compression = COMPRESSION_TYPES["none"]
+        self._direct_io = True
+        # file offset between chunks, set by the run process once it knows whether O_DIRECT pads them
+        self._chunk_stride_bytes = SPAWN_CONTEXT.Value("q", 0, lock=False)
+        # file state of the run process, shared by the io threads
+        self._fd = None
+        self._fd_path = None
+        self._fd_direct_io = False
+        self._fd_lock = None
+        self._fds = list()
+        self._chunk_index = list()
+
+    @property
+    def frame_count_px(self):
+        """Get the number of frames in the writer.
+
+        :return: Frame number in pixels
+        :rtype: int
+        """
+
+        return self._frame_count_px_px
+
+    @frame_count_px.setter
+    def frame_count_px(self, frame_count_px: int):
+        """Set the number of frames in the writer.
+
+        :param value: Frame number in pixels
+        :type value: int
+        """
+
+        self.log.info(f"setting frame count to: {frame_count_px} [px]")
+        self._frame_count_px_px = frame_count_px
+
+    @property
+    def chunk_count_px(self):
+        """Get the chunk count in pixels
+
+        :return: Chunk count in pixels
+        :rtype: int
+        """
+
+        return CHUNK_COUNT_PX
+
+    @property
+    def compression(self):
+        """Get the compression codec of the writer.
+
+        :return: Compression codec
+        :rtype: str
+        """
+
+        return next(
+            key
+            for key, value in COMPRESSION_TYPES.items()
+            if value == self._compression
+        )
+
+    @compression.setter
+    def compression(self, compression: str):
+        """Set the compression codec of the writer.
+
+        :param value: Compression codec
+        * **none**
+        :type value: str
+        """
+
+        valid = list(COMPRESSION_TYPES.keys())
+        if compression not in valid:
+            raise ValueError("compression type must be one of %r." % valid)
+        self.log.info(f"setting compression mode to: {compression}")
+        self._compression = COMPRESSION_TYPES[compression]
+
+    @property
+    def direct_io(self):
+        """Get whether chunks are written with O_DIRECT.
+
+        :return: True if O_DIRECT is requested
+        :rtype: bool
+        """
+
+        return self._direct_io
+
+    @direct_io.setter
+    def direct_io(self, direct_io: bool):
+        """Set whether chunks are written with O_DIRECT.\n
+        Buffered writes are used if O_DIRECT is not supported.
+
+        :param direct_io: True to request O_DIRECT
+        :type direct_io: bool
+        """
+
+        self.log.info(f"setting direct io to: {direct_io}")
+        self._direct_io = direct_io
+
+    @property
+    def filename(self):
+        """
+        The base filename of file writer.
+
+        :return: The base filename
+        :rtype: str
+        """
+
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename: str):
+        """
+        The base filename of file writer.
+
+        :param value: The base filename
+        :type value: str
+        """
+
+        self._filename = filename if filename.endswith(".raw") else f"{filename}.raw"
+        self.log.info(f"setting filename to: {filename}")
+
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
+        """
+        Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
+        """
+
+        self.log.info(f"{self._filename}: intializing writer.")
+        self._buffer = buffer
+        self._abort.clear()
+        # Specs for reconstructing the shared memory object.
+        self._shm_name = SPAWN_CONTEXT.Array(c_wchar, 32)  # hidden and exposed via property.
+        # opinioated decision on chunking dimension order
+        chunk_dim_order = ("z", "y", "x")
+        # This is almost always going to be: (chunk_size, rows, columns).
+        chunk_shape_map = {
+            "x": self._column_count_px,
+            "y": self._row_count_px,
+            "z": CHUNK_COUNT_PX,
+        }
+        shm_shape = [chunk_shape_map[x] for x in chunk_dim_order]
+        shm_nbytes = int(
+            np.prod(shm_shape, dtype=np.int64) * np.dtype(self._data_type).itemsize
+        )
+        self._process = SPAWN_CONTEXT.Process(
+            target=self._run,
+            args=(shm_shape, shm_nbytes, self._progress, self._log_queue),
+        )
+
+    def _open_file(self, filepath: Path) -> tuple:
+        """
+        Open the raw file, with O_DIRECT if requested and supported.
+
+        :param filepath: Path of the raw file
+        :type filepath: Path
+        :return: File descriptor and whether O_DIRECT is in use
+        :rtype: tuple
+        """
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        if self._direct_io and hasattr(os, "O_DIRECT"):
+            try:
+                return os.open(filepath, flags | os.O_DIRECT), True
+            except OSError as e:
+                # e.g. tmpfs and some network filesystems reject O_DIRECT
+                self.log.warning(f"{self._filename}: O_DIRECT unsupported, using buffered io: {e}")
+        elif self._direct_io:
+            self.log.warning(f"{self._filename}: O_DIRECT unavailable on {sys.platform}, using buffered io.")
+        return os.open(filepath, flags), False
+
+    def _write_all(self, fd: int, data: memoryview, offset_bytes: int):
+        """
+        Write a buffer completely at an offset, in pieces of at most MAX_WRITE_BYTES.
+
+        :param fd: File descriptor
+        :type fd: int
+        :param data: Bytes to write
+        :type data: memoryview
+        :param offset_bytes: File offset of the first byte
+        :type offset_bytes: int
+        """
+
+        position = 0
+        while position < data.nbytes:
+            piece = data[position:position + MAX_WRITE_BYTES]
+            if hasattr(os, "pwrite"):
+                position += os.pwrite(fd, piece, offset_bytes + position)
+            else:
+                # no positional writes on windows, serialize seek and write
+                with self._fd_lock:
+                    os.lseek(fd, offset_bytes + position, os.SEEK_SET)
+                    position += os.write(fd, piece)
+
+    def _write_data(self, fd: int, data: memoryview, offset_bytes: int, direct_io: bool):
+        """
+        Write the bytes of one chunk.
+
+        With O_DIRECT the aligned body is written straight from shared memory\n
+        and the unaligned tail is zero padded through a page-aligned bounce\n
+        buffer.
+
+        :param fd: File descriptor
+        :type fd: int
+        :param data: Chunk bytes, page aligned in memory
+        :type data: memoryview
+        :param offset_bytes: File offset of the chunk, aligned for O_DIRECT
+        :type offset_bytes: int
+        :param direct_io: Whether fd was opened with O_DIRECT
+        :type direct_io: bool
+        """
+
+        if not direct_io:
+            self._write_all(fd, data, offset_bytes)
+            return
+        body_nbytes = data.nbytes - data.nbytes % DIRECT_IO_ALIGNMENT_BYTES
+        self._write_all(fd, data[:body_nbytes], offset_bytes)
+        if body_nbytes == data.nbytes:
+            return
+        tail_nbytes = data.nbytes - body_nbytes
+        # anonymous mmaps are page aligned, as O_DIRECT requires
+        with mmap.mmap(-1, DIRECT_IO_ALIGNMENT_BYTES) as bounce:
+            bounce[:tail_nbytes] = data[body_nbytes:]
+            self._write_all(fd, memoryview(bounce), offset_bytes + body_nbytes)
+
+    def _write_chunk(self, chunk_num: int, frames: np.ndarray, frame_count_px: int, offset_bytes: int):
+        """
+        Write one chunk, runs on the io thread pool.
+
+        :param chunk_num: Index of the chunk
+        :type chunk_num: int
+        :param frames: Chunk of frames in shared memory
+        :type frames: numpy.ndarray
+        :param frame_count_px: Number of frames of the chunk to write
+        :type frame_count_px: int
+        :param offset_bytes: File offset of the chunk
+        :type offset_bytes: int
+        """
+
+        with memoryview(frames[:frame_count_px]).cast("B") as data:
+            fd, direct_io = self._fd, self._fd_direct_io
+            try:
+                self._write_data(fd, data, offset_bytes, direct_io)
+            except OSError as e:
+                if not direct_io or e.errno != errno.EINVAL:
+                    raise
+                # filesystem accepted O_DIRECT on open but rejects the writes
+                with self._fd_lock:
+                    if self._fd_direct_io:
+                        self._log_queue.put(f"{self._filename}: O_DIRECT write failed, using buffered io: {e}")
+                        # writes in flight may still use the previous descriptor, it is closed at the end
+                        self._fds.append(self._fd)
+                        self._fd = os.open(self._fd_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+                        self._fd_direct_io = False
+                self._write_data(self._fd, data, offset_bytes, False)
+            self._chunk_index.append(
+                {
+                    "chunk_index": chunk_num,
+                    "offset_bytes": offset_bytes,
+                    "nbytes": data.nbytes,
+                    "frame_count_px": frame_count_px,
+                }
+            )
+
+    def _write_index(self, filepath: Path, chunks: list, direct_io: bool):
+        """
+        Write the JSON sidecar describing the layout of the raw file.
+
+        :param filepath: Path of the raw file
+        :type filepath: Path
+        :param chunks: Offset, size and frame count of every written chunk
+        :type chunks: list
+        :param direct_io: Whether O_DIRECT was used
+        :type direct_io: bool
+        """
+
+        frame_count_px = sum(chunk["frame_count_px"] for chunk in chunks)
+        # chunks are back to back unless O_DIRECT had to pad a chunk
+        contiguous = all(
+            chunk["offset_bytes"] == sum(c["nbytes"] for c in chunks[:index])
+            for index, chunk in enumerate(chunks)
+        )
+        index = {
+            "data_file": filepath.name,
+            "data_type": np.dtype(self._data_type).name,
+            "byte_order": sys.byteorder,
+            "axes": "ZYX",
+            "shape": [frame_count_px, self._row_count_px, self._column_count_px],
+            "chunk_count_px": CHUNK_COUNT_PX,
+            "contiguous": contiguous,
+            "direct_io": direct_io,
+            "voxel_size_um": {
+                "x": self._x_voxel_size_um,
+                "y": self._y_voxel_size_um,
+                "z": self._z_voxel_size_um,
+            },
+            "position_mm": {
+                "x": self._x_position_mm,
+                "y": self._y_position_mm,
+                "z": self._z_position_mm,
+            },
+            "channel": self._channel,
+            "chunks": chunks,
+        }
+        with open(filepath.with_suffix(".json"), "w") as f:
+            json.dump(index, f, indent=2)
+
+    def _run(self, shm_shape, shm_nbytes, shared_progress, shared_log_queue):
+        """
+        Main run function of the raw writer.
+
+        :param shm_shape: Shared memory address shape
+        :type shm_shape: list
+        :param shm_nbytes: Shared memory address bytes
+        :type shm_nbytes: int
+        :param shared_progress: Shared progress value of the writer
+        :type shared_progress: multiprocessing.Value
+        :param shared_log_queue: Shared queue for passing log statements
+        :type shared_log_queue: multiprocessing.Queue
+        """
+        # internal logger for process
+        logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        fmt = "%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s"
+        datefmt = "%Y-%m-%d,%H:%M:%S"
+        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
+        log_handler = logging.StreamHandler(sys.stdout)
+        log_handler.setFormatter(log_formatter)
+        logger.addHandler(log_handler)
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._fd_path = filepath
+        self._fd, self._fd_direct_io = self._open_file(filepath)
+        direct_io = self._fd_direct_io
+        self._fds = list()
+        self._fd_lock = threading.Lock()
+        self._chunk_index = list()
+        # every chunk starts at a fixed stride, aligned for O_DIRECT, so
+        # chunks can be written concurrently at known offsets
+        chunk_nbytes = shm_nbytes
+        if direct_io:
+            chunk_nbytes = ceil(shm_nbytes / DIRECT_IO_ALIGNMENT_BYTES) * DIRECT_IO_ALIGNMENT_BYTES
+        self._chunk_stride_bytes.value = chunk_nbytes
+
+        chunk_total = ceil(self._frame_count_px_px / CHUNK_COUNT_PX)
+        for chunk_num in range(chunk_total):
+            # wait for new data.
+            frames = self._read_chunk(chunk_num, shm_shape, shm_nbytes)
+            if frames is None:
+                # writer was aborted or timed out waiting for data.
+                break
+            shared_log_queue.put(
+                f"{self._filename}: writing chunk "
+                f"{chunk_num + 1}/{chunk_total} of size {frames.shape}."
+            )
+            # the last chunk may only be partially filled
+            frame_count_px = min(CHUNK_COUNT_PX, self._frame_count_px_px - chunk_num * CHUNK_COUNT_PX)
+            # released and counted towards progress once the write completes
+            self._submit_chunk(
+                chunk_num, chunk_total, self._write_chunk, chunk_num, frames, frame_count_px, chunk_num * chunk_nbytes
+            )
+            frames = None
+
+        # wait for chunk writes in flight.
+        self._wait_chunks()
+
+        # wait for file writing to finish.
+        while shared_progress.value < 1.0 and not self._abort.is_set():
+            sleep(0.5)
+            shared_log_queue.put(
+                f"waiting for data writing to complete for "
+                f"{self._filename}: "
+                f"{self._progress.value * 100:.2f} [%] complete."
+            )
+
+        # release shared memory attached during the run
+        self._detach_chunks()
+
+        chunks = sorted(self._chunk_index, key=lambda chunk: chunk["chunk_index"])
+        # drop the padding of the last chunk
+        if chunks:
+            os.ftruncate(self._fd, chunks[-1]["offset_bytes"] + chunks[-1]["nbytes"])
+        os.fsync(self._fd)
+        for fd in self._fds + [self._fd]:
+            os.close(fd)
+        self._write_index(filepath, chunks, direct_io)
+
+    def finished_files(self) -> dict:
+        """
+        Leading bytes of the raw file holding the chunks written so far.\n
+        Chunks complete in order and never move, the sidecar is written last.
+
+        :return: Final leading bytes of the raw file keyed by its path
+        :rtype: dict
+        """
+
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        chunk_count = self._written_chunk_count.value
+        if chunk_count == 0:
+            return {str(filepath): 0}
+        frame_nbytes = self._row_count_px * self._column_count_px * np.dtype(self._data_type).itemsize
+        # chunks start at the stride padded for O_DIRECT, the last written chunk ends its data, it may be partial
+        last_frame_count_px = min(CHUNK_COUNT_PX, self._frame_count_px_px - (chunk_count - 1) * CHUNK_COUNT_PX)
+        return {str(filepath): (chunk_count - 1) * self._chunk_stride_bytes.value + last_frame_count_px * frame_nbytes}
+
+    def delete_files(self):
+        """
+        Delete all files generated by the writer.
+        """
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        os.remove(filepath)
+        os.remove(filepath.with_suffix(".json"))
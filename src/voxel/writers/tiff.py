@@ -1,22 +1,37 @@
+import io
 import logging
+import multiprocessing
 import os
 import sys
 from ctypes import c_wchar
 from math import ceil
-from multiprocessing import Array, Process
-from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from time import perf_counter, sleep
+from typing import Optional
 
 import numpy as np
 import tifffile
 
 from voxel.descriptors.deliminated_property import DeliminatedProperty
-from voxel.writers.base import BaseWriter
+from voxel.writers.base import SPAWN_CONTEXT, BaseWriter
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
 
 CHUNK_COUNT_PX = 64
+# tiff tiles must be a multiple of 16 px
+DIVISIBLE_TILE_SIZE_PX = 16
 
-COMPRESSION_TYPES = {"none": "none"}
+COMPRESSION_TYPES = {
+    "none": "none",
+    "zstd": "zstd",
+    "deflate": "adobe_deflate",
+    "lzw": "lzw",
+}
+
+# fast levels so compression keeps up with camera rate
+COMPRESSION_ARGS = {
+    "zstd": {"level": 1},
+    "adobe_deflate": {"level": 1},
+}
 
 
 class TiffWriter(BaseWriter):
@@ -31,6 +46,9 @@ class TiffWriter(BaseWriter):
 
     def __init__(self, path: str):
         super().__init__(path)
+        self._compression = COMPRESSION_TYPES["none"]
+        self._tile_size_px = None
+        self._rows_per_strip_px = None
 
     @property
     def frame_count_px(self):
@@ -82,6 +100,9 @@ class TiffWriter(BaseWriter):
         """Set the compression codec of the writer.
 
         :param value: Compression codec
+        * **zstd**
+        * **deflate**
+        * **lzw**
         * **none**
         :type value: str
         """
@@ -92,6 +113,52 @@ class TiffWriter(BaseWriter):
         self.log.info(f"setting compression mode to: {compression}")
         self._compression = COMPRESSION_TYPES[compression]
 
+    @property
+    def tile_size_px(self):
+        """Get the tile size of the written pages.
+
+        :return: Tile size in pixels, None if pages are written in strips
+        :rtype: int
+        """
+
+        return self._tile_size_px
+
+    @tile_size_px.setter
+    def tile_size_px(self, tile_size_px: Optional[int]):
+        """Set the tile size of the written pages.
+
+        :param tile_size_px: Tile size in pixels, None to write pages in strips
+        :type tile_size_px: int
+        :raises ValueError: Tile size is not a multiple of 16 px
+        """
+
+        if tile_size_px is not None and tile_size_px % DIVISIBLE_TILE_SIZE_PX != 0:
+            raise ValueError(f"tile size must be a multiple of {DIVISIBLE_TILE_SIZE_PX} px")
+        self.log.info(f"setting tile size to: {tile_size_px} [px]")
+        self._tile_size_px = tile_size_px
+
+    @property
+    def rows_per_strip_px(self):
+        """Get the number of rows per strip of the written pages.
+
+        :return: Rows per strip in pixels, None for the tifffile default
+        :rtype: int
+        """
+
+        return self._rows_per_strip_px
+
+    @rows_per_strip_px.setter
+    def rows_per_strip_px(self, rows_per_strip_px: Optional[int]):
+        """Set the number of rows per strip of the written pages.\n
+        Only used if tile_size_px is None.
+
+        :param rows_per_strip_px: Rows per strip in pixels, None for the tifffile default
+        :type rows_per_strip_px: int
+        """
+
+        self.log.info(f"setting rows per strip to: {rows_per_strip_px} [px]")
+        self._rows_per_strip_px = rows_per_strip_px
+
     @property
     def filename(self):
         """
@@ -115,14 +182,20 @@ class TiffWriter(BaseWriter):
         self._filename = filename if filename.endswith(".tiff") else f"{filename}.tiff"
         self.log.info(f"setting filename to: {filename}")
 
-    def prepare(self):
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
         """
         Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
         """
 
         self.log.info(f"{self._filename}: intializing writer.")
+        self._buffer = buffer
+        self._abort.clear()
         # Specs for reconstructing the shared memory object.
-        self._shm_name = Array(c_wchar, 32)  # hidden and exposed via property.
+        self._shm_name = SPAWN_CONTEXT.Array(c_wchar, 32)  # hidden and exposed via property.
         # opinioated decision on chunking dimension order
         chunk_dim_order = ("z", "y", "x")
         # This is almost always going to be: (chunk_size, rows, columns).
@@ -135,11 +208,49 @@ class TiffWriter(BaseWriter):
         shm_nbytes = int(
             np.prod(shm_shape, dtype=np.int64) * np.dtype(self._data_type).itemsize
         )
-        self._process = Process(
+        self._process = SPAWN_CONTEXT.Process(
             target=self._run,
             args=(shm_shape, shm_nbytes, self._progress, self._log_queue),
         )
 
+    def _write_kwargs(self) -> dict:
+        """
+        Compression and layout arguments of tifffile.TiffWriter.write.
+
+        :return: Keyword arguments
+        :rtype: dict
+        """
+
+        # tifffile compresses the strips/tiles of all pages in a chunk on a
+        # thread pool ahead of its sequential page writer
+        compressed = self._compression != COMPRESSION_TYPES["none"]
+        write_kwargs = {
+            "compression": self._compression,
+            "compressionargs": COMPRESSION_ARGS.get(self._compression),
+            "predictor": compressed,
+            "maxworkers": multiprocessing.cpu_count() if compressed else 1,
+        }
+        if self._tile_size_px is not None:
+            write_kwargs["tile"] = (self._tile_size_px, self._tile_size_px)
+        else:
+            write_kwargs["rowsperstrip"] = self._rows_per_strip_px
+        return write_kwargs
+
+    def _compressed_nbytes(self, frames: np.ndarray) -> int:
+        """
+        Size of frames written to an in memory tiff with the configured codec.
+
+        :param frames: Frames (z, y, x)
+        :type frames: numpy.ndarray
+        :return: Compressed size in bytes
+        :rtype: int
+        """
+
+        with io.BytesIO() as f:
+            with tifffile.TiffWriter(f, bigtiff=True) as writer:
+                writer.write(data=frames, **self._write_kwargs())
+            return f.tell()
+
     def _run(self, shm_shape, shm_nbytes, shared_progress, shared_log_queue):
         """
         Main run function of the Tiff writer.
@@ -184,27 +295,27 @@ class TiffWriter(BaseWriter):
             },
         }
 
+        write_kwargs = self._write_kwargs()
+
         chunk_total = ceil(self._frame_count_px_px / CHUNK_COUNT_PX)
         for chunk_num in range(chunk_total):
-            # Wait for new data.
-            while self.done_reading.is_set():
-                sleep(0.001)
-            # Attach a reference to the data from shared memory.
-            shm = SharedMemory(self.shm_name, create=False, size=shm_nbytes)
-            frames = np.ndarray(shm_shape, self._data_type, buffer=shm.buf)
+            # wait for new data.
+            frames = self._read_chunk(chunk_num, shm_shape, shm_nbytes)
+            if frames is None:
+                # writer was aborted or timed out waiting for data.
+                break
             shared_log_queue.put(
                 f"{self._filename}: writing chunk "
                 f"{chunk_num + 1}/{chunk_total} of size {frames.shape}."
             )
             start_time = perf_counter()
-            writer.write(data=frames, metadata=metadata, compression=self._compression)
+            offset = writer.filehandle.tell()
+            writer.write(data=frames, metadata=metadata, **write_kwargs)
             frames = None
-            shared_log_queue.put(
-                f"{self._filename}: writing chunk took "
-                f"{perf_counter() - start_time:.2f} [s]"
+            self._release_chunk()
+            self._record_chunk(
+                chunk_num, write_s=perf_counter() - start_time, compressed_nbytes=writer.filehandle.tell() - offset
             )
-            shm.close()
-            self.done_reading.set()
             shared_progress.value = (chunk_num + 1) / chunk_total
 
             shared_log_queue.put(
@@ -212,7 +323,7 @@ class TiffWriter(BaseWriter):
             )
 
         # wait for file writing to finish.
-        while shared_progress.value < 1.0:
+        while shared_progress.value < 1.0 and not self._abort.is_set():
             sleep(0.5)
             shared_log_queue.put(
                 f"waiting for data writing to complete for "
@@ -220,9 +331,8 @@ class TiffWriter(BaseWriter):
                 f"{self._progress.value * 100:.2f} [%] complete."
             )
 
-        # check and empty queue to avoid code hanging in process
-        if not shared_log_queue.empty:
-            shared_log_queue.get_nowait()
+        # release shared memory attached during the run
+        self._detach_chunks()
 
         writer.close()
 
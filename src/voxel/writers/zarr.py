@@ -0,0 +1,534 @@
+import json
+import logging
+import multiprocessing
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from ctypes import c_wchar
+from math import ceil
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Optional
+
+import numpy as np
+import tensorstore as ts
+
+from voxel.processes.downsample.cpu.tensorstore.downsample_3d import TSDownSample3D
+from voxel.writers.base import SPAWN_CONTEXT, BaseWriter
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+CHUNK_COUNT_PX = 64
+DIVISIBLE_FRAME_COUNT_PX = 64
+# xy size of the inner chunks within each shard
+CHUNK_SIZE_PX = 256
+# stop adding pyramid levels once the smallest xy dimension drops below this
+PYRAMID_MIN_SIZE_PX = 64
+
+COMPRESSION_TYPES = {
+    "none": None,
+    "zstd": {"name": "zstd", "configuration": {"level": 1}},
+    "blosc-zstd": {
+        "name": "blosc",
+        "configuration": {"cname": "zstd", "clevel": 1, "shuffle": "bitshuffle"},
+    },
+    "blosc-lz4": {
+        "name": "blosc",
+        "configuration": {"cname": "lz4", "clevel": 5, "shuffle": "shuffle"},
+    },
+}
+
+
+def _write_in_memory(spec: dict, frames: np.ndarray) -> int:
+    """
+    Write frames to an in memory zarr array and sum the stored bytes.
+
+    :param spec: Tensorstore spec with a memory key value store
+    :type spec: dict
+    :param frames: Frames (z, y, x)
+    :type frames: numpy.ndarray
+    :return: Stored size in bytes
+    :rtype: int
+    """
+
+    store = ts.open(spec).result()
+    store.write(frames).result()
+    kvstore = store.kvstore
+    return sum(len(kvstore.read(key).result().value) for key in kvstore.list().result())
+
+
+class ZarrWriter(BaseWriter):
+    """
+    Voxel driver for the OME-Zarr v3 writer.
+
+    Each incoming chunk is written as one shard per pyramid level, the\n
+    lower resolution levels are downsampled from the chunk as it arrives.
+
+    Writer will save data to the following location
+
+    path\\acquisition_name\\filename.zarr\\level
+
+    :param path: Path for the data writer
+    :type path: str
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._pyramid_levels = 1
+        # spawned helper process running the in memory writes of estimate_compression_ratio()
+        self._estimate_pool = None
+
+    @property
+    def frame_count_px(self):
+        """Get the number of frames in the writer.
+
+        :return: Frame number in pixels
+        :rtype: int
+        """
+
+        return self._frame_count_px_px
+
+    @frame_count_px.setter
+    def frame_count_px(self, frame_count_px: int):
+        """Set the number of frames in the writer.
+
+        :param value: Frame number in pixels
+        :type value: int
+        """
+
+        self.log.info(f"setting frame count to: {frame_count_px} [px]")
+        if frame_count_px % DIVISIBLE_FRAME_COUNT_PX != 0:
+            frame_count_px = (
+                    ceil(frame_count_px / DIVISIBLE_FRAME_COUNT_PX)
+                    * DIVISIBLE_FRAME_COUNT_PX
+            )
+            self.log.info(f"adjusting frame count to: {frame_count_px} [px]")
+        self._frame_count_px_px = frame_count_px
+
+    @property
+    def chunk_count_px(self):
+        """Get the chunk count in pixels
+
+        :return: Chunk count in pixels
+        :rtype: int
+        """
+
+        return CHUNK_COUNT_PX
+
+    @property
+    def pyramid_levels(self):
+        """Get the number of pyramid levels, including full resolution.
+
+        :return: Number of pyramid levels
+        :rtype: int
+        """
+
+        return self._pyramid_levels
+
+    @property
+    def compression(self):
+        """Get the compression codec of the writer.
+
+        :return: Compression codec
+        :rtype: str
+        """
+
+        return next(
+            key
+            for key, value in COMPRESSION_TYPES.items()
+            if value == self._compression
+        )
+
+    @compression.setter
+    def compression(self, compression: str):
+        """Set the compression codec of the writer.
+
+        :param value: Compression codec
+        * **zstd**
+        * **blosc-zstd**
+        * **blosc-lz4**
+        * **none**
+        :type value: str
+        """
+
+        valid = list(COMPRESSION_TYPES.keys())
+        if compression not in valid:
+            raise ValueError("compression type must be one of %r." % valid)
+        self.log.info(f"setting compression mode to: {compression}")
+        self._compression = COMPRESSION_TYPES[compression]
+
+    @property
+    def filename(self):
+        """
+        The base filename of file writer.
+
+        :return: The base filename
+        :rtype: str
+        """
+
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename: str):
+        """
+        The base filename of file writer.
+
+        :param value: The base filename
+        :type value: str
+        """
+
+        self._filename = filename if filename.endswith(".zarr") else f"{filename}.zarr"
+        self.log.info(f"setting filename to: {filename}")
+
+    def prepare(self, buffer: Optional[SharedRingBuffer] = None):
+        """
+        Prepare the writer.
+
+        :param buffer: Ring buffer to read chunks from, if None chunks are\n
+        handed off through shm_name and done_reading
+        :type buffer: SharedRingBuffer
+        """
+
+        self.log.info(f"{self._filename}: intializing writer.")
+        self._buffer = buffer
+        self._abort.clear()
+        # Specs for reconstructing the shared memory object.
+        self._shm_name = SPAWN_CONTEXT.Array(c_wchar, 32)  # hidden and exposed via property.
+        # opinioated decision on chunking dimension order
+        chunk_dim_order = ("z", "y", "x")
+        # This is almost always going to be: (chunk_size, rows, columns).
+        chunk_shape_map = {
+            "x": self._column_count_px,
+            "y": self._row_count_px,
+            "z": CHUNK_COUNT_PX,
+        }
+        shm_shape = [chunk_shape_map[x] for x in chunk_dim_order]
+        shm_nbytes = int(
+            np.prod(shm_shape, dtype=np.int64) * np.dtype(self._data_type).itemsize
+        )
+        self._pyramid_levels = self._level_count(self._row_count_px, self._column_count_px)
+        self.log.info(f"{self._filename}: writing {self._pyramid_levels} pyramid levels.")
+        self._process = SPAWN_CONTEXT.Process(
+            target=self._run,
+            args=(shm_shape, shm_nbytes, self._progress, self._log_queue),
+        )
+
+    def _level_count(self, row_count_px: int, column_count_px: int) -> int:
+        """
+        Number of pyramid levels for a frame size.
+
+        :param row_count_px: Number of rows
+        :type row_count_px: int
+        :param column_count_px: Number of columns
+        :type column_count_px: int
+        :return: Number of levels, including full resolution
+        :rtype: int
+        """
+
+        # add 2x pyramid levels while the chunk can still be halved in z
+        # and the xy size stays above the minimum
+        level_count = 1
+        while (
+            CHUNK_COUNT_PX // 2**level_count >= 1
+            and min(row_count_px, column_count_px) // 2**level_count >= PYRAMID_MIN_SIZE_PX
+        ):
+            level_count += 1
+        return level_count
+
+    def _estimate_level_count(self, shape: tuple) -> int:
+        """
+        Number of pyramid levels written for a sample of frames.
+
+        :param shape: Sample shape (z, y, x)
+        :type shape: tuple
+        :return: Number of levels, including full resolution
+        :rtype: int
+        """
+
+        return self._level_count(shape[1], shape[2])
+
+    def estimate_compression_ratio(self, frames: np.ndarray) -> float:
+        """
+        Estimate the compression ratio of a stack from a sample of frames.\n
+        The in memory writes run in a spawned helper process, tensorstore\n
+        used in the calling process aborts every process forked after it.
+
+        :param frames: Sample of frames (z, y, x) in the writer data type
+        :type frames: numpy.ndarray
+        :return: Full resolution raw size over compressed size of all levels
+        :rtype: float
+        """
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=SPAWN_CONTEXT) as self._estimate_pool:
+            try:
+                return super().estimate_compression_ratio(frames)
+            finally:
+                self._estimate_pool = None
+
+    def _compressed_nbytes(self, frames: np.ndarray) -> int:
+        """
+        Size of frames written to an in memory zarr array with the\n
+        configured codec and shard layout.
+
+        :param frames: Frames (z, y, x)
+        :type frames: numpy.ndarray
+        :return: Compressed size in bytes
+        :rtype: int
+        """
+
+        # the level only sets the shard depth, one shard per sample
+        level = int(np.log2(CHUNK_COUNT_PX // frames.shape[0])) if frames.shape[0] < CHUNK_COUNT_PX else 0
+        spec = self._level_spec(None, level, frames.shape, kvstore={"driver": "memory"})
+        return self._estimate_pool.submit(_write_in_memory, spec, frames).result()
+
+    def _level_shapes(self) -> list:
+        """
+        Array shape of every pyramid level, halving (and rounding up) per level.
+
+        :return: List of (z, y, x) shapes
+        :rtype: list
+        """
+
+        shape = (self._frame_count_px_px, self._row_count_px, self._column_count_px)
+        shapes = [shape]
+        for _ in range(1, self._pyramid_levels):
+            shape = tuple(ceil(s / 2) for s in shape)
+            shapes.append(shape)
+        return shapes
+
+    def _write_group_metadata(self, filepath: Path, level_shapes: list):
+        """
+        Write the OME-Zarr v0.5 multiscales group metadata.
+
+        :param filepath: Path of the zarr group
+        :type filepath: Path
+        :param level_shapes: Array shape of every pyramid level
+        :type level_shapes: list
+        """
+
+        voxel_size_um = [self._z_voxel_size_um, self._y_voxel_size_um, self._x_voxel_size_um]
+        position_um = [
+            self._z_position_mm * 1000,
+            self._y_position_mm * 1000,
+            self._x_position_mm * 1000,
+        ]
+        datasets = [
+            {
+                "path": str(level),
+                "coordinateTransformations": [
+                    {"type": "scale", "scale": [size * 2**level for size in voxel_size_um]},
+                    {"type": "translation", "translation": position_um},
+                ],
+            }
+            for level in range(len(level_shapes))
+        ]
+        metadata = {
+            "zarr_format": 3,
+            "node_type": "group",
+            "attributes": {
+                "ome": {
+                    "version": "0.5",
+                    "multiscales": [
+                        {
+                            "name": self._channel,
+                            "axes": [
+                                {"name": axis, "type": "space", "unit": "micrometer"}
+                                for axis in ("z", "y", "x")
+                            ],
+                            "datasets": datasets,
+                        }
+                    ],
+                }
+            },
+        }
+        filepath.mkdir(parents=True, exist_ok=True)
+        with open(Path(filepath, "zarr.json"), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    def _open_level(self, filepath: Path, level: int, shape: tuple, context: ts.Context) -> ts.TensorStore:
+        """
+        Create the sharded zarr v3 array of one pyramid level.
+
+        :param filepath: Path of the zarr group
+        :type filepath: Path
+        :param level: Pyramid level
+        :type level: int
+        :param shape: Array shape of the level
+        :type shape: tuple
+        :param context: Shared tensorstore context
+        :type context: tensorstore.Context
+        :return: Opened tensorstore array
+        :rtype: tensorstore.TensorStore
+        """
+
+        return ts.open(self._level_spec(filepath, level, shape), context=context).result()
+
+    def _level_spec(self, filepath: Path, level: int, shape: tuple, kvstore: Optional[dict] = None) -> dict:
+        """
+        Tensorstore spec of the sharded zarr v3 array of one pyramid level.
+
+        Every shard holds exactly one incoming chunk so each shard is written\n
+        once and never read back.
+
+        :param filepath: Path of the zarr group
+        :type filepath: Path
+        :param level: Pyramid level
+        :type level: int
+        :param shape: Array shape of the level
+        :type shape: tuple
+        :param kvstore: Key value store spec, None stores the level under filepath
+        :type kvstore: dict
+        :return: Tensorstore spec
+        :rtype: dict
+        """
+
+        chunk_z_px = CHUNK_COUNT_PX // 2**level
+        chunk_y_px = min(CHUNK_SIZE_PX, shape[1])
+        chunk_x_px = min(CHUNK_SIZE_PX, shape[2])
+        shard_shape = [
+            chunk_z_px,
+            ceil(shape[1] / chunk_y_px) * chunk_y_px,
+            ceil(shape[2] / chunk_x_px) * chunk_x_px,
+        ]
+        inner_codecs = [{"name": "bytes", "configuration": {"endian": "little"}}]
+        if self._compression is not None:
+            inner_codecs.append(self._compression)
+        spec = {
+            "driver": "zarr3",
+            "kvstore": kvstore if kvstore is not None else {"driver": "file", "path": str(Path(filepath, str(level)))},
+            "metadata": {
+                "shape": list(shape),
+                "data_type": np.dtype(self._data_type).name,
+                "chunk_grid": {"name": "regular", "configuration": {"chunk_shape": shard_shape}},
+                "codecs": [
+                    {
+                        "name": "sharding_indexed",
+                        "configuration": {
+                            "chunk_shape": [chunk_z_px, chunk_y_px, chunk_x_px],
+                            "codecs": inner_codecs,
+                            "index_codecs": [
+                                {"name": "bytes", "configuration": {"endian": "little"}},
+                                {"name": "crc32c"},
+                            ],
+                        },
+                    }
+                ],
+                "dimension_names": ["z", "y", "x"],
+            },
+            "create": True,
+            "delete_existing": True,
+        }
+        return spec
+
+    def _run(self, shm_shape, shm_nbytes, shared_progress, shared_log_queue):
+        """
+        Main run function of the Zarr writer.
+
+        :param shm_shape: Shared memory address shape
+        :type shm_shape: list
+        :param shm_nbytes: Shared memory address bytes
+        :type shm_nbytes: int
+        :param shared_progress: Shared progress value of the writer
+        :type shared_progress: multiprocessing.Value
+        :param shared_log_queue: Shared queue for passing log statements
+        :type shared_log_queue: multiprocessing.Queue
+        """
+        # internal logger for process
+        logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        fmt = "%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s"
+        datefmt = "%Y-%m-%d,%H:%M:%S"
+        log_formatter = logging.Formatter(fmt=fmt, datefmt=datefmt)
+        log_handler = logging.StreamHandler(sys.stdout)
+        log_handler.setFormatter(log_formatter)
+        logger.addHandler(log_handler)
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+
+        # shared context so all levels compress and write with the same thread pools
+        thread_count = 2 * multiprocessing.cpu_count()
+        context = ts.Context(
+            {
+                "data_copy_concurrency": {"limit": thread_count},
+                "file_io_concurrency": {"limit": thread_count},
+            }
+        )
+        level_shapes = self._level_shapes()
+        self._write_group_metadata(filepath, level_shapes)
+        levels = [
+            self._open_level(filepath, level, shape, context)
+            for level, shape in enumerate(level_shapes)
+        ]
+        downsampler = TSDownSample3D(binning=2)
+
+        chunk_total = ceil(self._frame_count_px_px / CHUNK_COUNT_PX)
+        for chunk_num in range(chunk_total):
+            # wait for new data.
+            frames = self._read_chunk(chunk_num, shm_shape, shm_nbytes)
+            if frames is None:
+                # writer was aborted or timed out waiting for data.
+                break
+            shared_log_queue.put(
+                f"{self._filename}: writing chunk "
+                f"{chunk_num + 1}/{chunk_total} of size {frames.shape}."
+            )
+            start_time = perf_counter()
+            # issue the full resolution write, then build and write each
+            # lower level from the level above while the writes run in parallel
+            z_start = chunk_num * CHUNK_COUNT_PX
+            write_futures = [levels[0][z_start:z_start + CHUNK_COUNT_PX].write(frames)]
+            image = frames
+            for level in range(1, len(levels)):
+                image = downsampler.run(image)
+                z_level = z_start // 2**level
+                write_futures.append(levels[level][z_level:z_level + image.shape[0]].write(image))
+            # shared memory can be handed back as soon as the full resolution data is copied
+            write_futures[0].copy.result()
+            copy_s = perf_counter() - start_time
+            image = None
+            frames = None
+            self._release_chunk()
+            for future in write_futures:
+                future.result()
+            self._record_chunk(chunk_num, copy_s=copy_s, write_s=perf_counter() - start_time - copy_s)
+            shared_progress.value = (chunk_num + 1) / chunk_total
+
+            shared_log_queue.put(
+                f"{self._filename}: {self._progress.value * 100:.2f} [%] complete."
+            )
+
+        # wait for file writing to finish.
+        while shared_progress.value < 1.0 and not self._abort.is_set():
+            sleep(0.5)
+            shared_log_queue.put(
+                f"waiting for data writing to complete for "
+                f"{self._filename}: "
+                f"{self._progress.value * 100:.2f} [%] complete."
+            )
+
+        # release shared memory attached during the run
+        self._detach_chunks()
+
+    def finished_files(self) -> dict:
+        """
+        Shards of the chunks written so far. Each shard is written once, by\n
+        an atomic rename, so every existing shard of a written chunk is final.
+
+        :return: Shard paths, None as they are final as a whole
+        :rtype: dict
+        """
+
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        finished_files = dict()
+        # chunks are written in order, the count is the number of leading chunks written
+        for chunk_num in range(self._written_chunk_count.value):
+            for level in range(self._pyramid_levels):
+                # one shard spans the whole frame, its key is its z index
+                shard_path = Path(filepath, str(level), "c", str(chunk_num), "0", "0")
+                if shard_path.is_file():
+                    finished_files[str(shard_path)] = None
+        return finished_files
+
+    def delete_files(self):
+        """
+        Delete all files generated by the writer.
+        """
+        filepath = Path(self._path, self._acquisition_name, self._filename).absolute()
+        shutil.rmtree(filepath)
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from voxel.file_transfers import base
+from voxel.file_transfers.journal import VERIFIED, TransferJournal
+from voxel.file_transfers.native import NativeFileTransfer
+
+ACQUISITION_NAME = "acquisition"
+FILENAME = "tile_0"
+SIZE_BYTES = 3 << 20
+FINISHED_BYTES = 1 << 20
+
+
+class FakeProcess:
+    """Writer process running for a number of exit code checks."""
+
+    def __init__(self, running_checks: int):
+        self.running_checks = running_checks
+
+    @property
+    def exitcode(self):
+        if self.running_checks > 0:
+            self.running_checks -= 1
+            return None
+        return 0
+
+
+class FakeWriter:
+    """Writer reporting the leading bytes of a growing file as finished."""
+
+    def __init__(self, file_path, running_checks: int):
+        self.filename = FILENAME
+        self.file_path = str(file_path)
+        self._process = FakeProcess(running_checks)
+
+    def finished_files(self) -> dict:
+        return {self.file_path: FINISHED_BYTES}
+
+
+@pytest.fixture
+def transfer(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "FOLLOW_INTERVAL_S", 0)
+    (tmp_path / "local" / ACQUISITION_NAME).mkdir(parents=True)
+    (tmp_path / "external" / ACQUISITION_NAME).mkdir(parents=True)
+    transfer = NativeFileTransfer(str(tmp_path / "external"), str(tmp_path / "local"))
+    transfer.acquisition_name = ACQUISITION_NAME
+    transfer.filename = FILENAME
+    transfer.max_retry = 1
+    return transfer
+
+
+@pytest.fixture
+def paths(tmp_path):
+    local_file_path = tmp_path / "local" / ACQUISITION_NAME / f"{FILENAME}.raw"
+    external_file_path = tmp_path / "external" / ACQUISITION_NAME / f"{FILENAME}.raw"
+    journal_path = tmp_path / "external" / ACQUISITION_NAME / f"{FILENAME}_journal.jsonl"
+    return local_file_path, external_file_path, journal_path
+
+
+def _record_ranges(transfer, monkeypatch, fail: bool = False) -> list:
+    """Record the byte range copies of the transfer, optionally failing them."""
+
+    ranges = list()
+    copy_range = transfer._copy_range
+
+    def record_range(local_file_path, external_file_path, start_bytes, end_bytes):
+        ranges.append((start_bytes, end_bytes))
+        if fail:
+            raise OSError("external drive unavailable")
+        copy_range(local_file_path, external_file_path, start_bytes, end_bytes)
+
+    monkeypatch.setattr(transfer, "_copy_range", record_range)
+    return ranges
+
+
+def test_follow_then_final_pass(transfer, paths, monkeypatch):
+    local_file_path, external_file_path, journal_path = paths
+    data = os.urandom(SIZE_BYTES)
+    local_file_path.write_bytes(data)
+    transfer.writer = FakeWriter(local_file_path, running_checks=1)
+    ranges = _record_ranges(transfer, monkeypatch)
+
+    transfer._run()
+
+    # the finished bytes ship while writing, the rest in the final pass
+    assert ranges == [(0, FINISHED_BYTES), (FINISHED_BYTES, SIZE_BYTES)]
+    assert external_file_path.read_bytes() == data
+    assert not local_file_path.exists()
+    assert TransferJournal(journal_path).get(str(external_file_path))["state"] == VERIFIED
+    assert transfer.progress == 100
+
+
+def test_failed_range_ships_in_final_pass(transfer, paths, monkeypatch):
+    local_file_path, external_file_path, _ = paths
+    data = os.urandom(SIZE_BYTES)
+    local_file_path.write_bytes(data)
+    transfer.writer = FakeWriter(local_file_path, running_checks=1)
+    ranges = _record_ranges(transfer, monkeypatch, fail=True)
+
+    transfer._run()
+
+    # nothing counted as shipped, the final pass copies the whole file
+    assert ranges == [(0, FINISHED_BYTES)]
+    assert external_file_path.read_bytes() == data
+    assert not local_file_path.exists()
+    assert transfer.progress == 100
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+from voxel.writers.raw import CHUNK_COUNT_PX, DIRECT_IO_ALIGNMENT_BYTES, RawWriter
+
+ACQUISITION_NAME = "acquisition"
+FILENAME = "tile_0"
+# odd frame size, O_DIRECT pads every chunk to its alignment
+ROW_COUNT_PX = 3
+COLUMN_COUNT_PX = 5
+CHUNK_TOTAL = 3
+# the last chunk is partial
+FRAME_COUNT_PX = CHUNK_TOTAL * CHUNK_COUNT_PX - 10
+FRAME_NBYTES = ROW_COUNT_PX * COLUMN_COUNT_PX * 2
+
+
+@pytest.fixture
+def writer(tmp_path):
+    (tmp_path / ACQUISITION_NAME).mkdir()
+    writer = RawWriter(str(tmp_path))
+    writer.acquisition_name = ACQUISITION_NAME
+    writer.filename = FILENAME
+    writer.data_type = "uint16"
+    writer.row_count_px = ROW_COUNT_PX
+    writer.column_count_px = COLUMN_COUNT_PX
+    writer.frame_count_px = FRAME_COUNT_PX
+    writer.x_voxel_size_um = writer.y_voxel_size_um = writer.z_voxel_size_um = 1.0
+    writer.x_position_mm = writer.y_position_mm = writer.z_position_mm = 0.0
+    writer.theta_deg = 0.0
+    writer.channel = "0"
+    return writer
+
+
+def _done_future(exception=None) -> Future:
+    future = Future()
+    if exception is None:
+        future.set_result(None)
+    else:
+        future.set_exception(exception)
+    return future
+
+
+def test_finished_files_skip_failed_chunks(writer, tmp_path):
+    stride_bytes = DIRECT_IO_ALIGNMENT_BYTES
+    writer._chunk_stride_bytes.value = stride_bytes
+    writer._io_lock = threading.Condition()
+    # the second chunk failed, the third completed after it but does not follow a finished chunk
+    for chunk_num, exception in enumerate([None, OSError("disk full"), None]):
+        writer._io_in_flight.append(
+            {
+                "chunk_num": chunk_num,
+                "chunk_total": CHUNK_TOTAL,
+                "slot_index": None,
+                "wait_s": 0.0,
+                "nbytes": CHUNK_COUNT_PX * FRAME_NBYTES,
+                "start_time": 0.0,
+                "future": _done_future(exception),
+            }
+        )
+    writer._complete_chunks(None)
+
+    assert writer.metrics.count == CHUNK_TOTAL
+    filepath = str(tmp_path / ACQUISITION_NAME / f"{FILENAME}.raw")
+    assert writer.finished_files() == {filepath: CHUNK_COUNT_PX * FRAME_NBYTES}
+
+
+def test_finished_files_match_written_file(writer, tmp_path):
+    buffer = SharedRingBuffer((CHUNK_COUNT_PX, ROW_COUNT_PX, COLUMN_COUNT_PX), "uint16", slot_count=3)
+    try:
+        writer.prepare(buffer)
+        writer.start()
+        for chunk_index in range(CHUNK_TOTAL):
+            buffer.write_buf[:] = chunk_index + 1
+            buffer.toggle_buffers(timeout=60)
+        writer.wait_to_finish()
+    finally:
+        buffer.close_and_unlink()
+
+    assert writer._process.exitcode == 0
+    filepath = tmp_path / ACQUISITION_NAME / f"{FILENAME}.raw"
+    index = json.loads(filepath.with_suffix(".json").read_text())
+    last_chunk = index["chunks"][-1]
+    # the leading bytes end with the data of the last chunk, past the padding of the others
+    assert writer.finished_files() == {str(filepath): os.path.getsize(filepath)}
+    assert os.path.getsize(filepath) == last_chunk["offset_bytes"] + last_chunk["nbytes"]
+    data = np.fromfile(filepath, dtype="uint16", count=last_chunk["nbytes"] // 2, offset=last_chunk["offset_bytes"])
+    assert (data == CHUNK_TOTAL).all()
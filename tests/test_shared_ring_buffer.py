@@ -0,0 +1,104 @@
+from multiprocessing import Process, Queue
+
+import numpy as np
+import pytest
+
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer
+
+SHAPE = (2, 4, 3)
+DTYPE = "uint16"
+SLOT_COUNT = 3
+
+
+@pytest.fixture
+def ring_buffer():
+    ring_buffer = SharedRingBuffer(SHAPE, DTYPE, slot_count=SLOT_COUNT)
+    yield ring_buffer
+    ring_buffer.close_and_unlink()
+
+
+def _consume(ring_buffer: SharedRingBuffer, chunk_count: int, results: Queue):
+    """Read chunks in another process and report their sequence numbers and first pixels."""
+
+    for _ in range(chunk_count):
+        slot = ring_buffer.acquire_read_slot(timeout=10)
+        results.put((ring_buffer.sequence_numbers[slot], int(ring_buffer.slots[slot][0, 0, 0])))
+        ring_buffer.release_read_slot(slot)
+    ring_buffer.close_and_unlink()
+
+
+def test_slot_count_less_than_two():
+    with pytest.raises(ValueError):
+        SharedRingBuffer(SHAPE, DTYPE, slot_count=1)
+
+
+def test_wrap_around_and_sequence_numbers(ring_buffer):
+    chunk_count = 3 * SLOT_COUNT + 1
+    for chunk_index in range(chunk_count):
+        assert ring_buffer.write_index == chunk_index % SLOT_COUNT
+        ring_buffer.write_buf[:] = chunk_index
+        ring_buffer.toggle_buffers(timeout=0)
+        assert ring_buffer.read_buf[0, 0, 0] == chunk_index
+        slot = ring_buffer.acquire_read_slot(timeout=0)
+        assert slot == chunk_index % SLOT_COUNT
+        assert ring_buffer.sequence_numbers[slot] == chunk_index
+        assert (ring_buffer.slots[slot] == chunk_index).all()
+        ring_buffer.release_read_slot(slot)
+    assert ring_buffer.sequence_number == chunk_count
+
+
+def test_uncommitted_slots_have_no_sequence_number(ring_buffer):
+    assert list(ring_buffer.sequence_numbers) == [-1] * SLOT_COUNT
+    ring_buffer.toggle_buffers(timeout=0)
+    assert list(ring_buffer.sequence_numbers) == [0] + [-1] * (SLOT_COUNT - 1)
+
+
+def test_producer_blocks_only_when_every_slot_is_full(ring_buffer):
+    # the producer keeps the slot it fills, the others can be committed without a consumer
+    for _ in range(SLOT_COUNT - 1):
+        ring_buffer.toggle_buffers(timeout=0)
+    write_index = ring_buffer.write_index
+    with pytest.raises(TimeoutError):
+        ring_buffer.toggle_buffers(timeout=0.01)
+    # a timeout leaves the buffer untouched
+    assert ring_buffer.write_index == write_index
+    assert ring_buffer.sequence_number == SLOT_COUNT - 1
+    slot = ring_buffer.acquire_read_slot(timeout=0)
+    ring_buffer.release_read_slot(slot)
+    ring_buffer.toggle_buffers(timeout=0)
+    assert ring_buffer.sequence_number == SLOT_COUNT
+
+
+def test_consumer_waits_for_committed_slots(ring_buffer):
+    assert ring_buffer.acquire_read_slot(timeout=0.01) is None
+    ring_buffer.toggle_buffers(timeout=0)
+    ring_buffer.toggle_buffers(timeout=0)
+    assert ring_buffer.acquire_read_slot(timeout=0) == 0
+    assert ring_buffer.acquire_read_slot(timeout=0) == 1
+    assert ring_buffer.acquire_read_slot(timeout=0.01) is None
+
+
+def test_last_image(ring_buffer):
+    ring_buffer.add_image(np.full(SHAPE[1:], 1, dtype=DTYPE))
+    ring_buffer.add_image(np.full(SHAPE[1:], 2, dtype=DTYPE))
+    assert ring_buffer.get_last_image()[0, 0] == 2
+    ring_buffer.toggle_buffers(timeout=0)
+    # just switched, the last image is in the committed slot
+    assert ring_buffer.buffer_index == -1
+    assert ring_buffer.get_last_image()[0, 0] == 2
+
+
+def test_consumer_process(ring_buffer):
+    chunk_count = 4 * SLOT_COUNT
+    results = Queue()
+    consumer = Process(target=_consume, args=(ring_buffer, chunk_count, results))
+    consumer.start()
+    try:
+        for chunk_index in range(chunk_count):
+            ring_buffer.write_buf[:] = chunk_index
+            ring_buffer.toggle_buffers(timeout=10)
+        received = [results.get(timeout=10) for _ in range(chunk_count)]
+    finally:
+        consumer.join(10)
+    assert received == [(chunk_index, chunk_index) for chunk_index in range(chunk_count)]
+    assert consumer.exitcode == 0
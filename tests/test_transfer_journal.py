@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+from voxel.file_transfers.digests import DEFAULT_ALGORITHM, file_digest
+from voxel.file_transfers.journal import COPYING, VERIFIED, TransferJournal
+from voxel.file_transfers.native import NativeFileTransfer
+
+ACQUISITION_NAME = "acquisition"
+FILENAME = "tile_0"
+SIZE_BYTES = 3 << 20
+OFFSET_BYTES = 1 << 20
+
+
+@pytest.fixture
+def transfer(tmp_path):
+    local_dir = tmp_path / "local" / ACQUISITION_NAME
+    local_dir.mkdir(parents=True)
+    (tmp_path / "external" / ACQUISITION_NAME).mkdir(parents=True)
+    transfer = NativeFileTransfer(str(tmp_path / "external"), str(tmp_path / "local"))
+    transfer.acquisition_name = ACQUISITION_NAME
+    transfer.filename = FILENAME
+    transfer.max_retry = 1
+    return transfer
+
+
+@pytest.fixture
+def paths(tmp_path):
+    local_file_path = tmp_path / "local" / ACQUISITION_NAME / f"{FILENAME}.raw"
+    external_file_path = tmp_path / "external" / ACQUISITION_NAME / f"{FILENAME}.raw"
+    journal_path = tmp_path / "external" / ACQUISITION_NAME / f"{FILENAME}_journal.jsonl"
+    return local_file_path, external_file_path, journal_path
+
+
+@pytest.fixture
+def copies(transfer, monkeypatch):
+    """Record the whole file copies and byte range copies of the transfer."""
+
+    calls = {"files": list(), "ranges": list()}
+    copy_files = transfer._copy_files
+    copy_range = transfer._copy_range
+
+    def record_files(local_dir, external_dir, filenames):
+        calls["files"].extend(filenames)
+        copy_files(local_dir, external_dir, filenames)
+
+    def record_range(local_file_path, external_file_path, start_bytes, end_bytes):
+        calls["ranges"].append((os.path.basename(local_file_path), start_bytes, end_bytes))
+        copy_range(local_file_path, external_file_path, start_bytes, end_bytes)
+
+    monkeypatch.setattr(transfer, "_copy_files", record_files)
+    monkeypatch.setattr(transfer, "_copy_range", record_range)
+    return calls
+
+
+def test_resume_at_recorded_offset(transfer, paths, copies):
+    local_file_path, external_file_path, journal_path = paths
+    data = os.urandom(SIZE_BYTES)
+    local_file_path.write_bytes(data)
+    # a crashed run flushed the leading bytes and recorded them
+    external_file_path.write_bytes(data[:OFFSET_BYTES])
+    journal = TransferJournal(journal_path)
+    journal.record_copying(str(external_file_path), str(local_file_path), OFFSET_BYTES)
+    journal.close()
+
+    transfer._run()
+
+    assert copies["files"] == []
+    assert copies["ranges"] == [(local_file_path.name, OFFSET_BYTES, SIZE_BYTES)]
+    assert external_file_path.read_bytes() == data
+    assert not local_file_path.exists()
+    entry = TransferJournal(journal_path).get(str(external_file_path))
+    assert entry["state"] == VERIFIED
+    assert entry["digest"] == file_digest(external_file_path, entry["algorithm"])
+
+
+def test_skip_verified_file(transfer, paths, copies):
+    local_file_path, external_file_path, journal_path = paths
+    data = os.urandom(SIZE_BYTES)
+    local_file_path.write_bytes(data)
+    # a crashed run verified the file but did not delete the local copy
+    external_file_path.write_bytes(data)
+    journal = TransferJournal(journal_path)
+    digest = file_digest(external_file_path, DEFAULT_ALGORITHM)
+    journal.record_verified(str(external_file_path), str(local_file_path), DEFAULT_ALGORITHM, digest)
+    journal.close()
+
+    transfer._run()
+
+    assert copies["files"] == []
+    assert copies["ranges"] == []
+    assert not local_file_path.exists()
+    assert external_file_path.read_bytes() == data
+    assert transfer.progress == 100
+
+
+def test_changed_local_mtime_recopies(transfer, paths, copies):
+    local_file_path, external_file_path, journal_path = paths
+    data = os.urandom(SIZE_BYTES)
+    local_file_path.write_bytes(data)
+    external_file_path.write_bytes(os.urandom(OFFSET_BYTES))
+    journal = TransferJournal(journal_path)
+    journal.record_copying(str(external_file_path), str(local_file_path), OFFSET_BYTES)
+    journal.close()
+    # the local file was rewritten since, the recorded bytes no longer apply
+    stat = os.stat(local_file_path)
+    os.utime(local_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert TransferJournal(journal_path).resume(str(external_file_path), str(local_file_path)) is None
+
+    transfer._run()
+
+    assert copies["files"] == [local_file_path.name]
+    assert copies["ranges"] == []
+    assert external_file_path.read_bytes() == data
+    assert not local_file_path.exists()
+
+
+def test_journal_skips_cut_short_line(paths):
+    local_file_path, external_file_path, journal_path = paths
+    local_file_path.parent.mkdir(parents=True)
+    external_file_path.parent.mkdir(parents=True)
+    local_file_path.write_bytes(b"\0" * OFFSET_BYTES)
+    external_file_path.write_bytes(b"\0" * OFFSET_BYTES)
+    journal = TransferJournal(journal_path)
+    journal.record_copying(str(external_file_path), str(local_file_path), OFFSET_BYTES)
+    journal.close()
+    with open(journal_path, "a") as f:
+        f.write('{"path": "tile_0.raw", "sta')
+
+    entry = TransferJournal(journal_path).resume(str(external_file_path), str(local_file_path))
+
+    assert entry["state"] == COPYING
+    assert entry["offset_bytes"] == OFFSET_BYTES
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+ts = pytest.importorskip("tensorstore")
+
+from voxel.writers.data_structures.shared_ring_buffer import SharedRingBuffer  # noqa: E402
+from voxel.writers.zarr import CHUNK_COUNT_PX, ZarrWriter  # noqa: E402
+
+ACQUISITION_NAME = "acquisition"
+FILENAME = "tile_0"
+ROW_COUNT_PX = 128
+COLUMN_COUNT_PX = 256
+CHUNK_TOTAL = 2
+
+
+@pytest.fixture
+def writer(tmp_path):
+    (tmp_path / ACQUISITION_NAME).mkdir()
+    writer = ZarrWriter(str(tmp_path))
+    writer.acquisition_name = ACQUISITION_NAME
+    writer.filename = FILENAME
+    writer.data_type = "uint16"
+    writer.compression = "zstd"
+    writer.row_count_px = ROW_COUNT_PX
+    writer.column_count_px = COLUMN_COUNT_PX
+    writer.frame_count_px = CHUNK_TOTAL * CHUNK_COUNT_PX
+    writer.x_voxel_size_um = writer.y_voxel_size_um = writer.z_voxel_size_um = 1.0
+    writer.x_position_mm = writer.y_position_mm = writer.z_position_mm = 0.0
+    writer.theta_deg = 0.0
+    writer.channel = "0"
+    return writer
+
+
+def test_write_after_compression_estimate(writer, tmp_path):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 64, (8, ROW_COUNT_PX, COLUMN_COUNT_PX), dtype="uint16")
+    assert writer.estimate_compression_ratio(frames) > 1
+
+    buffer = SharedRingBuffer((CHUNK_COUNT_PX, ROW_COUNT_PX, COLUMN_COUNT_PX), "uint16", slot_count=3)
+    try:
+        writer.prepare(buffer)
+        writer.start()
+        for chunk_index in range(CHUNK_TOTAL):
+            buffer.write_buf[:] = chunk_index
+            buffer.toggle_buffers(timeout=60)
+        writer.wait_to_finish()
+    finally:
+        buffer.close_and_unlink()
+
+    assert writer._process.exitcode == 0
+    assert writer.progress == 100
+    level_path = tmp_path / ACQUISITION_NAME / f"{FILENAME}.zarr" / "0"
+    level = ts.open({"driver": "zarr3", "kvstore": {"driver": "file", "path": str(level_path)}}).result()
+    data = level.read().result()
+    assert data.shape == (CHUNK_TOTAL * CHUNK_COUNT_PX, ROW_COUNT_PX, COLUMN_COUNT_PX)
+    assert (data[:CHUNK_COUNT_PX] == 0).all()
+    assert (data[CHUNK_COUNT_PX:] == 1).all()